@@ -0,0 +1,39 @@
+"""049_table_embedding_vector
+
+Revision ID: 5b6f0c3d9e21
+Revises: 2809fbbf08bc
+Create Date: 2025-11-24 10:12:41.215832
+
+"""
+from alembic import op
+from common.core.config import settings
+
+# revision identifiers, used by Alembic.
+revision = '5b6f0c3d9e21'
+down_revision = '2809fbbf08bc'
+branch_labels = None
+depends_on = None
+
+# dimension of the configured embedding model, ANN indexes need a fixed one; startup checks the model
+EMBEDDING_DIM = settings.EMBEDDING_DIMENSION
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    for table in ('core_table', 'core_datasource'):
+        # json text '[0.1, 0.2, ...]' is valid vector input, other dimensions are cleared and embedded again
+        op.execute(f"""
+            ALTER TABLE {table} ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM}) USING
+            CASE WHEN embedding IS NOT NULL AND embedding <> '' AND json_array_length(embedding::json) = {EMBEDDING_DIM}
+            THEN embedding::vector({EMBEDDING_DIM}) END
+        """)
+        op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding ON {table} "
+                   f"USING hnsw (embedding vector_cosine_ops)")
+    op.create_index('ix_core_table_ds_id', 'core_table', ['ds_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_core_table_ds_id', table_name='core_table')
+    for table in ('core_table', 'core_datasource'):
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE text USING embedding::text")
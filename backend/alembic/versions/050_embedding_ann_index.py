@@ -0,0 +1,39 @@
+"""050_embedding_ann_index
+
+Revision ID: 8d41e7a2c6f0
+Revises: 5b6f0c3d9e21
+Create Date: 2025-11-25 15:03:27.640118
+
+"""
+from alembic import op
+from common.core.config import settings
+
+# revision identifiers, used by Alembic.
+revision = '8d41e7a2c6f0'
+down_revision = '5b6f0c3d9e21'
+branch_labels = None
+depends_on = None
+
+# dimension of the configured embedding model, ANN indexes need a fixed one; startup checks the model
+EMBEDDING_DIM = settings.EMBEDDING_DIMENSION
+
+
+def upgrade():
+    for table in ('terminology', 'data_training'):
+        # vectors of another dimension are cleared and embedded again at startup
+        op.execute(f"""
+            ALTER TABLE {table} ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM}) USING
+            CASE WHEN vector_dims(embedding) = {EMBEDDING_DIM} THEN embedding::vector({EMBEDDING_DIM}) END
+        """)
+        op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding ON {table} "
+                   f"USING hnsw (embedding vector_cosine_ops)")
+    op.create_index('ix_terminology_oid', 'terminology', ['oid'], unique=False)
+    op.create_index('ix_data_training_oid_datasource', 'data_training', ['oid', 'datasource'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_data_training_oid_datasource', table_name='data_training')
+    op.drop_index('ix_terminology_oid', table_name='terminology')
+    for table in ('terminology', 'data_training'):
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE vector")
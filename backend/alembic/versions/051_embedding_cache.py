@@ -0,0 +1,30 @@
+"""051_embedding_cache
+
+Revision ID: 3a9c5e17b4d2
+Revises: 8d41e7a2c6f0
+Create Date: 2025-11-27 09:41:12.307945
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import pgvector
+
+# revision identifiers, used by Alembic.
+revision = '3a9c5e17b4d2'
+down_revision = '8d41e7a2c6f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'embedding_cache',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('embedding', pgvector.sqlalchemy.vector.VECTOR(), nullable=False),
+        sa.Column('create_time', sa.DateTime(timezone=False), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+    )
+
+
+def downgrade():
+    op.drop_table('embedding_cache')
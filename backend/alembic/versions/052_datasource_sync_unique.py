@@ -0,0 +1,38 @@
+"""052_datasource_sync_unique
+
+Revision ID: 6e2b9d4f1a73
+Revises: 3a9c5e17b4d2
+Create Date: 2025-11-28 14:05:37.118420
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '6e2b9d4f1a73'
+down_revision = '3a9c5e17b4d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # table sync upserts on these keys, duplicates left by earlier syncs keep the first row
+    op.execute("""
+        DELETE FROM core_field f WHERE f.table_id IN (
+            SELECT t.id FROM core_table t WHERE EXISTS (
+                SELECT 1 FROM core_table k WHERE k.ds_id = t.ds_id AND k.table_name = t.table_name AND k.id < t.id))
+    """)
+    op.execute("""
+        DELETE FROM core_table t WHERE EXISTS (
+            SELECT 1 FROM core_table k WHERE k.ds_id = t.ds_id AND k.table_name = t.table_name AND k.id < t.id)
+    """)
+    op.execute("""
+        DELETE FROM core_field f WHERE EXISTS (
+            SELECT 1 FROM core_field k WHERE k.table_id = f.table_id AND k.field_name = f.field_name AND k.id < f.id)
+    """)
+    op.create_index('ux_core_table_ds_id_table_name', 'core_table', ['ds_id', 'table_name'], unique=True)
+    op.create_index('ux_core_field_table_id_field_name', 'core_field', ['table_id', 'field_name'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ux_core_field_table_id_field_name', table_name='core_field')
+    op.drop_index('ux_core_table_ds_id_table_name', table_name='core_table')
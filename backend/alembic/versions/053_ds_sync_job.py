@@ -0,0 +1,40 @@
+"""053_ds_sync_job
+
+Revision ID: 9c3f7a1e5b08
+Revises: 6e2b9d4f1a73
+Create Date: 2025-12-01 10:22:09.451736
+
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9c3f7a1e5b08'
+down_revision = '6e2b9d4f1a73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'core_ds_sync_job',
+        sa.Column('id', sa.BigInteger(), sa.Identity(always=True), nullable=False),
+        sa.Column('ds_id', sa.BigInteger(), nullable=True),
+        sa.Column('status', sa.String(length=32), nullable=False),
+        sa.Column('tables', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column('tables_total', sa.Integer(), nullable=False),
+        sa.Column('tables_done', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('create_by', sa.BigInteger(), nullable=True),
+        sa.Column('create_time', sa.DateTime(timezone=False), nullable=True),
+        sa.Column('update_time', sa.DateTime(timezone=False), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_core_ds_sync_job_ds_id', 'core_ds_sync_job', ['ds_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_core_ds_sync_job_ds_id', table_name='core_ds_sync_job')
+    op.drop_table('core_ds_sync_job')
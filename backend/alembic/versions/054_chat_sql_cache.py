@@ -0,0 +1,50 @@
+"""054_chat_sql_cache
+
+Revision ID: 4d8a2f6c1e39
+Revises: 9c3f7a1e5b08
+Create Date: 2025-12-03 14:18:45.902116
+
+"""
+import pgvector
+import sqlalchemy as sa
+
+from alembic import op
+from common.core.config import settings
+
+# revision identifiers, used by Alembic.
+revision = '4d8a2f6c1e39'
+down_revision = '9c3f7a1e5b08'
+branch_labels = None
+depends_on = None
+
+# same dimension as 050, hnsw can not index a vector column without one
+EMBEDDING_DIM = settings.EMBEDDING_DIMENSION
+
+
+def upgrade():
+    op.create_table(
+        'chat_sql_cache',
+        sa.Column('id', sa.BigInteger(), sa.Identity(always=True), nullable=False),
+        sa.Column('datasource', sa.BigInteger(), nullable=False),
+        sa.Column('schema_version', sa.String(length=64), nullable=False),
+        sa.Column('permission_key', sa.String(length=64), nullable=False),
+        sa.Column('embedding_model', sa.String(length=255), nullable=False),
+        sa.Column('question', sa.Text(), nullable=True),
+        sa.Column('embedding', pgvector.sqlalchemy.vector.VECTOR(EMBEDDING_DIM), nullable=False),
+        sa.Column('record_id', sa.BigInteger(), nullable=False),
+        sa.Column('generate_ms', sa.Integer(), nullable=True),
+        sa.Column('hit_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('create_time', sa.DateTime(timezone=False), nullable=True),
+        sa.Column('last_hit_time', sa.DateTime(timezone=False), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_chat_sql_cache_datasource', 'chat_sql_cache', ['datasource', 'schema_version'],
+                    unique=False)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_chat_sql_cache_embedding ON chat_sql_cache "
+               "USING hnsw (embedding vector_cosine_ops)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_chat_sql_cache_embedding")
+    op.drop_index('ix_chat_sql_cache_datasource', table_name='chat_sql_cache')
+    op.drop_table('chat_sql_cache')
@@ -1,5 +1,9 @@
 import os.path
 import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Optional
 
 from langchain_core.embeddings import Embeddings
@@ -7,6 +11,8 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from pydantic import BaseModel
 
 from common.core.config import settings
+from common.utils.embedding_scheduler import online_embedding
+from common.utils.utils import SQLBotLogUtil
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -32,6 +38,10 @@ class EmbeddingModelCache:
 
     @staticmethod
     def _new_instance(config: EmbeddingModelInfo = local_embedding_model):
+        if settings.EMBEDDING_BACKEND == 'onnx':
+            from apps.ai_model.onnx_embedding import OnnxEmbeddings
+            return OnnxEmbeddings(model_path=config.name, quantize=settings.EMBEDDING_ONNX_QUANTIZE,
+                                  threads=settings.EMBEDDING_ONNX_THREADS)
         return HuggingFaceEmbeddings(model_name=config.name, cache_folder=config.folder,
                                      model_kwargs={'device': config.device},
                                      encode_kwargs={'normalize_embeddings': True}
@@ -62,3 +72,106 @@ class EmbeddingModelCache:
                     _embedding_model[key] = model_instance
 
         return model_instance
+
+
+# question vectors of the current request, set by embedding_scope
+_request_embeddings: ContextVar[Optional[dict]] = ContextVar('request_embeddings', default=None)
+
+# recent question vectors shared by all requests
+_query_cache: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+_query_cache_lock = threading.Lock()
+# questions being embedded
+_pending: dict[tuple[str, str], threading.Lock] = {}
+
+
+@contextmanager
+def embedding_scope(cache: Optional[dict] = None):
+    """Share question vectors inside the block, pass the same dict to reuse them across threads of one request."""
+    token = _request_embeddings.set(cache if cache is not None else {})
+    try:
+        yield
+    finally:
+        _request_embeddings.reset(token)
+
+
+def embed_query(text: str, key: str = settings.DEFAULT_EMBEDDING_MODEL) -> list[float]:
+    """EmbeddingModelCache.get_model(key).embed_query(text), computed once per request and kept in a small LRU."""
+    cache_key = (key, text)
+    scope = _request_embeddings.get()
+    if scope is not None and cache_key in scope:
+        return scope[cache_key]
+
+    with _query_cache_lock:
+        embedding = _query_cache.get(cache_key)
+        if embedding is not None:
+            _query_cache.move_to_end(cache_key)
+        else:
+            pending = _pending.setdefault(cache_key, threading.Lock())
+
+    if embedding is None:
+        # steps of a request running at once wait for the first one computing the vector
+        with pending:
+            embedding = scope.get(cache_key) if scope is not None else None
+            if embedding is None:
+                with _query_cache_lock:
+                    embedding = _query_cache.get(cache_key)
+            if embedding is None:
+                with online_embedding():
+                    embedding = EmbeddingModelCache.get_model(key).embed_query(text)
+                if settings.EMBEDDING_QUERY_CACHE_SIZE > 0:
+                    with _query_cache_lock:
+                        _query_cache[cache_key] = embedding
+                        _query_cache.move_to_end(cache_key)
+                        while len(_query_cache) > settings.EMBEDDING_QUERY_CACHE_SIZE:
+                            _query_cache.popitem(last=False)
+            if scope is not None:
+                scope[cache_key] = embedding
+        with _query_cache_lock:
+            if _pending.get(cache_key) is pending:
+                del _pending[cache_key]
+
+    if scope is not None:
+        scope[cache_key] = embedding
+    return embedding
+
+
+def warm_up_embedding_model():
+    """Load the model and run it once, so the first question does not pay for it."""
+    if not settings.EMBEDDING_ENABLED and not settings.TABLE_EMBEDDING_ENABLED:
+        return
+    start_time = time.time()
+    vector = EmbeddingModelCache.get_model().embed_query('SQLBot')
+    SQLBotLogUtil.info(f'embedding model ({settings.EMBEDDING_BACKEND}) warmed up in {time.time() - start_time:.2f}s')
+    check_embedding_dimension(len(vector))
+
+
+# vector columns of the current schema with their dimension (atttypmod of pgvector)
+vector_columns_sql = """
+SELECT c.relname AS table_name, a.attname AS column_name, a.atttypmod AS dimension
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_type t ON t.oid = a.atttypid
+WHERE t.typname = 'vector' AND c.relkind = 'r' AND n.nspname = current_schema()
+AND a.attnum > 0 AND NOT a.attisdropped
+"""
+
+
+def check_embedding_dimension(dimension: int):
+    """The vector columns are migrated with EMBEDDING_DIMENSION, fail clearly when the model returns vectors
+    of another size instead of failing every embedding write."""
+    from sqlalchemy import text
+
+    from common.core.db import engine
+    with engine.connect() as conn:
+        columns = conn.execute(text(vector_columns_sql)).fetchall()
+    wrong = [f'{c.table_name}.{c.column_name} vector({c.dimension})' for c in columns
+             if c.dimension > 0 and c.dimension != dimension]
+    if dimension != settings.EMBEDDING_DIMENSION or wrong:
+        message = (f'Embedding model {settings.DEFAULT_EMBEDDING_MODEL} returns {dimension}-dimensional vectors, '
+                   f'but EMBEDDING_DIMENSION is {settings.EMBEDDING_DIMENSION}'
+                   + (f' and the columns are {", ".join(wrong)}' if wrong else '')
+                   + f'. Set EMBEDDING_DIMENSION={dimension} and migrate the vector columns to that size, '
+                     f'or configure a model of the migrated size.')
+        SQLBotLogUtil.error(message)
+        raise ValueError(message)
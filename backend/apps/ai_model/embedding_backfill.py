@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from typing import Callable, Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, select
+
+from apps.ai_model.embedding_cache import embed_documents_cached
+from common.core.config import settings
+from common.utils.embedding_scheduler import wait_online_idle
+from common.utils.utils import SQLBotLogUtil
+
+# (session, ids) -> [(id, text)], ids without text are skipped
+TextLoader = Callable[..., List[tuple[int, str]]]
+
+
+def _chunks(ids: List[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _batch_size() -> int:
+    return max(settings.EMBEDDING_BATCH_SIZE, 1)
+
+
+def embed_and_write(session, model, items: List[tuple[int, str]]) -> int:
+    """Embed texts in one embed_documents call, texts found in the embedding cache are skipped,
+    and write the vectors with a single executemany."""
+    if not items:
+        return 0
+    embeddings = embed_documents_cached(session, [text for _, text in items])
+    table = model.__table__
+    stmt = table.update().where(table.c.id == bindparam('_id')).values(embedding=bindparam('_embedding'))
+    session.execute(stmt, [{'_id': _id, '_embedding': embedding} for (_id, _), embedding in zip(items, embeddings, strict=True)])
+    session.commit()
+    return len(items)
+
+
+def save_embeddings_in_batches(session, model, ids: List[int], load_texts: TextLoader) -> int:
+    done = 0
+    for chunk in _chunks(list(ids), _batch_size()):
+        done += embed_and_write(session, model, load_texts(session, chunk))
+    return done
+
+
+def clear_embeddings(session, model, where) -> int:
+    """Set the embedding of the rows matching where to NULL, the next backfill recomputes them."""
+    result = session.execute(model.__table__.update().where(where).values(embedding=None))
+    session.commit()
+    return result.rowcount
+
+
+def _checkpoint_file(name: str) -> str:
+    return os.path.join(settings.EMBEDDING_CHECKPOINT_PATH, f'{name}.json')
+
+
+def _read_checkpoint(name: str) -> int:
+    try:
+        with open(_checkpoint_file(name), 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('last_id') or 0)
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Read embedding checkpoint {name} failed: {e}")
+        return 0
+
+
+def _write_checkpoint(name: str, last_id: Optional[int]):
+    path = _checkpoint_file(name)
+    if last_id is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(settings.EMBEDDING_CHECKPOINT_PATH, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'last_id': last_id, 'time': int(time.time())}, f)
+    os.replace(tmp, path)
+
+
+def backfill_empty_embeddings(session, name: str, model, load_texts: TextLoader, where=None) -> int:
+    """Embed every row of model whose embedding is empty, walking the ids in batches.
+    The last written id is checkpointed after each batch, a restart continues from there."""
+    conditions = [model.embedding.is_(None)]
+    if where is not None:
+        conditions.append(where)
+    total = session.execute(select(func.count()).select_from(model).where(*conditions)).scalar() or 0
+    last_id = _read_checkpoint(name)
+    if total == 0:
+        _write_checkpoint(name, None)
+        return 0
+
+    SQLBotLogUtil.info(f"start {name} embedding backfill: {total} rows, from id {last_id}")
+    start_time = time.time()
+    done = 0
+    # after resuming, rows before the checkpoint (e.g. failed in an earlier run) are visited once more
+    for start_id in ([last_id, 0] if last_id > 0 else [0]):
+        last_id = start_id
+        while True:
+            ids = session.execute(select(model.id).where(*conditions, model.id > last_id)
+                                  .order_by(model.id).limit(_batch_size())).scalars().all()
+            if not ids:
+                break
+            # question embeddings of chat requests go first
+            wait_online_idle()
+            done += embed_and_write(session, model, load_texts(session, ids))
+            last_id = ids[-1]
+            _write_checkpoint(name, last_id)
+            SQLBotLogUtil.info(f"{name} embedding backfill: {done}/{total}, "
+                               f"{done / max(time.time() - start_time, 0.001):.1f} rows/s")
+
+    _write_checkpoint(name, None)
+    SQLBotLogUtil.info(f"{name} embedding backfill finished in: {time.time() - start_time:.1f} seconds")
+    return done
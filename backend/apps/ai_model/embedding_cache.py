@@ -0,0 +1,48 @@
+import datetime
+import hashlib
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.models.embedding_cache_model import EmbeddingCache
+from common.core.config import settings
+
+
+def get_model_id() -> str:
+    # quantized onnx vectors differ slightly from torch ones, they are cached apart
+    model_id = f'{settings.DEFAULT_EMBEDDING_MODEL}:{settings.EMBEDDING_BACKEND}'
+    if settings.EMBEDDING_BACKEND == 'onnx' and settings.EMBEDDING_ONNX_QUANTIZE:
+        model_id += ':int8'
+    return model_id
+
+
+def get_text_hash(model_id: str, text: str) -> str:
+    return hashlib.sha256(f'{model_id}\n{text}'.encode('utf-8')).hexdigest()
+
+
+def embed_documents_cached(session, texts: List[str]) -> List[List[float]]:
+    """embed_documents of the default model, texts embedded before (by any workspace, before a restart)
+    are read from the embedding_cache table, new vectors are added to it in the caller's transaction."""
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return EmbeddingModelCache.get_model().embed_documents(texts)
+
+    model_id = get_model_id()
+    hashes = [get_text_hash(model_id, text) for text in texts]
+    cached = {}
+    unique_hashes = list(dict.fromkeys(hashes))
+    for start in range(0, len(unique_hashes), 1000):
+        rows = session.execute(select(EmbeddingCache.hash, EmbeddingCache.embedding).where(
+            EmbeddingCache.hash.in_(unique_hashes[start:start + 1000]))).all()
+        cached.update({row.hash: list(map(float, row.embedding)) for row in rows})
+
+    missing = {h: text for h, text in zip(hashes, texts, strict=True) if h not in cached}
+    if missing:
+        embeddings = EmbeddingModelCache.get_model().embed_documents(list(missing.values()))
+        now = datetime.datetime.now()
+        values = [{'hash': h, 'embedding': embedding, 'create_time': now} for h, embedding in
+                  zip(missing.keys(), embeddings, strict=True)]
+        session.execute(insert(EmbeddingCache).values(values).on_conflict_do_nothing(index_elements=['hash']))
+        cached.update(zip(missing.keys(), embeddings, strict=True))
+    return [cached[h] for h in hashes]
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Hashable, Optional
+
+from common.core.config import settings
+from common.error import SingleMessageError
+from common.utils.utils import SQLBotLogUtil
+
+# seconds between queue position updates of a waiting call
+_POSITION_INTERVAL = 1.0
+
+
+class LLMQueueTimeoutError(SingleMessageError):
+    pass
+
+
+class _Waiter:
+    def __init__(self, model: Hashable, oid: Hashable, loop: asyncio.AbstractEventLoop):
+        self.model = model
+        self.oid = oid
+        self.loop = loop
+        self.future = loop.create_future()
+        self.admitted = False
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMLimiter:
+    """Admission control of llm calls: at most model_limit calls of a model and oid_limit calls of a
+    workspace run at once (0 means no limit). Later calls wait in one FIFO queue up to timeout seconds,
+    a call held back by its workspace limit does not hold up calls of other workspaces.
+    Callers on any event loop (the request loop or the loop of a chat worker thread) share the limits."""
+
+    def __init__(self, model_limit: int, oid_limit: int, timeout: float):
+        self.model_limit = model_limit
+        self.oid_limit = oid_limit
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._running_models: dict[Hashable, int] = {}
+        self._running_oids: dict[Hashable, int] = {}
+        self._waiters: list[_Waiter] = []
+        self._admitted = 0
+        self._queued = 0
+        self._timeouts = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _allowed(self, model: Hashable, oid: Hashable) -> bool:
+        return ((self.model_limit <= 0 or self._running_models.get(model, 0) < self.model_limit)
+                and (self.oid_limit <= 0 or self._running_oids.get(oid, 0) < self.oid_limit))
+
+    def _take(self, model: Hashable, oid: Hashable):
+        self._running_models[model] = self._running_models.get(model, 0) + 1
+        self._running_oids[oid] = self._running_oids.get(oid, 0) + 1
+
+    def _give_back(self, model: Hashable, oid: Hashable):
+        for running, key in ((self._running_models, model), (self._running_oids, oid)):
+            running[key] -= 1
+            if running[key] <= 0:
+                del running[key]
+
+    def _position(self, waiter: _Waiter) -> int:
+        # 1 for the next call of the model
+        position = 1
+        for item in self._waiters:
+            if item is waiter:
+                break
+            if item.model == waiter.model:
+                position += 1
+        return position
+
+    def _admit_waiters(self):
+        # keys with an earlier waiter still waiting, calls of one model and workspace keep their order
+        blocked = set()
+        for waiter in list(self._waiters):
+            key = (waiter.model, waiter.oid)
+            if key in blocked:
+                continue
+            if not self._allowed(waiter.model, waiter.oid):
+                blocked.add(key)
+                continue
+            self._waiters.remove(waiter)
+            try:
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            except RuntimeError:
+                # the loop of the waiter is closed, the call is gone
+                continue
+            waiter.admitted = True
+            self._take(waiter.model, waiter.oid)
+
+    async def acquire(self, model: Hashable, oid: Hashable,
+                      on_wait: Optional[Callable[[int], None]] = None):
+        """Wait for a slot, on_wait is called with the queue position while waiting.
+        Raises LLMQueueTimeoutError when no slot was free within timeout seconds."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._allowed(model, oid) and not any(
+                    w.model == model and w.oid == oid for w in self._waiters):
+                self._take(model, oid)
+                self._admitted += 1
+                return
+            waiter = _Waiter(model, oid, loop)
+            self._waiters.append(waiter)
+            self._queued += 1
+
+        position = None
+        try:
+            while not waiter.admitted:
+                with self._lock:
+                    current = None if waiter.admitted else self._position(waiter)
+                if current is not None and current != position and on_wait:
+                    position = current
+                    on_wait(current)
+                remaining = start + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), min(remaining, _POSITION_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                if waiter.admitted:
+                    self._give_back(model, oid)
+                    self._admit_waiters()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            if not waiter.admitted:
+                self._waiters.remove(waiter)
+                self._timeouts += 1
+                timed_out = True
+            else:
+                self._admitted += 1
+                self._waited += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                timed_out = False
+        if timed_out:
+            SQLBotLogUtil.warning(f"LLM call of model {model} in workspace {oid} waited {waited:.1f}s for a slot")
+            raise LLMQueueTimeoutError(f'The model is busy, no free slot within {self.timeout} seconds, '
+                                       f'please try again later')
+        SQLBotLogUtil.info(f"LLM call of model {model} in workspace {oid} admitted after {waited:.2f}s in queue")
+
+    def release(self, model: Hashable, oid: Hashable):
+        with self._lock:
+            self._give_back(model, oid)
+            self._admit_waiters()
+
+    @asynccontextmanager
+    async def slot(self, model: Hashable, oid: Hashable, on_wait: Optional[Callable[[int], None]] = None):
+        await self.acquire(model, oid, on_wait)
+        try:
+            yield
+        finally:
+            self.release(model, oid)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': {str(model): count for model, count in self._running_models.items()},
+                'waiting': len(self._waiters),
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'timeouts': self._timeouts,
+                'avg_queue_wait': self._wait_total / self._waited if self._waited else 0.0,
+                'max_queue_wait': self._wait_max,
+            }
+
+
+llm_limiter = LLMLimiter(settings.LLM_MODEL_CONCURRENCY, settings.LLM_WORKSPACE_CONCURRENCY,
+                         settings.LLM_QUEUE_TIMEOUT)
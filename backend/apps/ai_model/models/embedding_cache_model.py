@@ -0,0 +1,14 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import Column, DateTime, String
+from sqlmodel import Field, SQLModel
+
+
+class EmbeddingCache(SQLModel, table=True):
+    __tablename__ = "embedding_cache"
+    # sha256 of model and text
+    hash: str = Field(sa_column=Column(String(64), primary_key=True))
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=False))
+    create_time: Optional[datetime] = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
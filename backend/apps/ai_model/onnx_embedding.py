@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from common.utils.utils import SQLBotLogUtil
+
+_export_lock = threading.Lock()
+
+
+def _max_seq_length(model_path: str, default: int = 512) -> int:
+    # sentence-transformers truncates to this length, keep the same to get the same vectors
+    try:
+        with open(os.path.join(model_path, 'sentence_bert_config.json'), 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('max_seq_length') or default)
+    except Exception:
+        return default
+
+
+def export_onnx_model(model_path: str, onnx_dir: str, quantize: bool) -> str:
+    """Export the transformer of a local sentence-transformers model to onnx once,
+    optionally with int8 dynamic quantization, and return the model file to load."""
+    fp32_file = os.path.join(onnx_dir, 'model.onnx')
+    int8_file = os.path.join(onnx_dir, 'model.int8.onnx')
+    target = int8_file if quantize else fp32_file
+    with _export_lock:
+        if os.path.exists(target):
+            return target
+        os.makedirs(onnx_dir, exist_ok=True)
+        if not os.path.exists(fp32_file):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            SQLBotLogUtil.info(f'export embedding model {model_path} to onnx')
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+            model = AutoModel.from_pretrained(model_path)
+            model.eval()
+            sample = tokenizer(['SQLBot'], return_tensors='pt')
+            inputs = tuple(sample[name] for name in ('input_ids', 'attention_mask', 'token_type_ids'))
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in
+                            ('input_ids', 'attention_mask', 'token_type_ids', 'last_hidden_state')}
+            tmp_file = fp32_file + '.tmp'
+            with torch.no_grad():
+                torch.onnx.export(model, inputs, tmp_file,
+                                  input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+                                  output_names=['last_hidden_state'], dynamic_axes=dynamic_axes,
+                                  opset_version=17, do_constant_folding=True)
+            os.replace(tmp_file, fp32_file)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            SQLBotLogUtil.info(f'quantize onnx embedding model to {int8_file}')
+            tmp_file = int8_file + '.tmp'
+            quantize_dynamic(fp32_file, tmp_file, weight_type=QuantType.QInt8)
+            os.replace(tmp_file, int8_file)
+    return target
+
+
+class OnnxEmbeddings(Embeddings):
+    """The local text2vec model run by onnxruntime: mean pooling over the token embeddings
+    and L2 normalization, the same as the sentence-transformers pipeline."""
+
+    def __init__(self, model_path: str, quantize: bool = True, batch_size: int = 32, threads: int = 0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.max_length = _max_seq_length(model_path)
+        self.batch_size = max(batch_size, 1)
+        model_file = export_onnx_model(model_path, os.path.join(model_path, 'onnx'), quantize)
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_file, sess_options=options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        SQLBotLogUtil.info(f'load onnx embedding model: {model_file}')
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                 return_tensors='np')
+        feeds = {name: encoded[name].astype(np.int64) for name in encoded if name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        mask = encoded['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace('\n', ' ') for text in texts]
+        result = []
+        for start in range(0, len(texts), self.batch_size):
+            result.extend(self._encode(texts[start:start + self.batch_size]).tolist())
+        return result
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
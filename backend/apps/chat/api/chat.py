@@ -11,8 +11,10 @@ from sqlalchemy import and_, select
 from apps.chat.curd.chat import list_chats, get_chat_with_records, create_chat, rename_chat, \
     delete_chat, get_chat_chart_data, get_chat_predict_data, get_chat_with_records_with_data, get_chat_record_by_id, \
     format_json_data, format_json_list_data
+from apps.chat.curd.sql_cache import get_sql_cache_stats
 from apps.chat.models.chat_model import CreateChat, ChatRecord, RenameChat, ChatQuestion, ExcelData
 from apps.chat.task.llm import LLMService
+from apps.db.result_set import is_columnar, ColumnarResult
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
 
 router = APIRouter(tags=["Data Q&A"], prefix="/chat")
@@ -23,6 +25,14 @@ async def chats(session: SessionDep, current_user: CurrentUser):
     return list_chats(session, current_user)
 
 
+@router.get("/sql_cache/stats", include_in_schema=False)
+async def sql_cache_stats(current_user: CurrentUser, trans: Trans):
+    if not current_user.isAdmin:
+        raise HTTPException(status_code=403, detail=trans('i18n_permission.no_permission', url='',
+                                                          msg=trans('i18n_permission.only_admin')))
+    return get_sql_cache_stats()
+
+
 @router.get("/{chart_id}")
 async def get_chat(session: SessionDep, current_user: CurrentUser, chart_id: int, current_assistant: CurrentAssistant):
     def inner():
@@ -43,10 +53,10 @@ async def get_chat_with_data(session: SessionDep, current_user: CurrentUser, cha
 
 
 @router.get("/record/{chart_record_id}/data")
-async def chat_record_data(session: SessionDep, chart_record_id: int):
+async def chat_record_data(session: SessionDep, chart_record_id: int, columnar: bool = False):
     def inner():
         data = get_chat_chart_data(chart_record_id=chart_record_id, session=session)
-        return format_json_data(data)
+        return format_json_data(data, columnar)
 
     return await asyncio.to_thread(inner)
 
@@ -220,30 +230,35 @@ async def export_excel(excel_data: ExcelData, trans: Trans):
             _fields_list.append(field.name)
             col_formats[field_idx] = 'default'  # 默认不特殊处理
 
-        for _data in excel_data.data:
-            _row = []
-            for field_idx, field in enumerate(excel_data.axis):
-                value = _data.get(field.value)
+        if is_columnar(excel_data.data):
+            columnar = ColumnarResult.from_dict(excel_data.data)
+            columns = [columnar.column(field.value) if field.value in columnar.fields else [None] * len(columnar)
+                       for field in excel_data.axis]
+        else:
+            columns = [[_data.get(field.value) for _data in excel_data.data] for field in excel_data.axis]
+
+        for field_idx, values in enumerate(columns):
+            for row_idx, value in enumerate(values):
                 if value is not None:
                     # 检查是否为数字且需要特殊处理
                     if isinstance(value, (int, float)):
                         # 整数且超过15位 → 转字符串并标记为文本列
                         if isinstance(value, int) and len(str(abs(value))) > 15:
-                            value = str(value)
+                            values[row_idx] = str(value)
                             col_formats[field_idx] = 'text'
                         # 小数且超过15位有效数字 → 转字符串并标记为文本列
                         elif isinstance(value, float):
                             decimal_str = format(value, '.16f').rstrip('0').rstrip('.')
                             if len(decimal_str) > 15:
-                                value = str(value)
+                                values[row_idx] = str(value)
                                 col_formats[field_idx] = 'text'
                         # 其他数字列标记为数字格式（避免科学记数法）
                         elif col_formats[field_idx] != 'text':
                             col_formats[field_idx] = 'number'
-                _row.append(value)
-            data.append(_row)
+            data.append(values)
 
-        df = pd.DataFrame(data, columns=_fields_list)
+        df = pd.DataFrame(dict(enumerate(data)))
+        df.columns = _fields_list
 
         buffer = io.BytesIO()
 
@@ -9,6 +9,7 @@ from sqlalchemy.orm import aliased
 from apps.chat.models.chat_model import Chat, ChatRecord, CreateChat, ChatInfo, RenameChat, ChatQuestion, ChatLog, \
     TypeEnum, OperationEnum, ChatRecordResult
 from apps.datasource.models.datasource import CoreDatasource
+from apps.db.result_set import to_row_result, ColumnarResult, normalize_records
 from apps.system.crud.assistant import AssistantOutDsFactory
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser
 from common.utils.utils import extract_nested_json
@@ -86,35 +87,23 @@ def get_last_execute_sql_error(session: SessionDep, chart_id: int):
     return None
 
 
-def format_json_data(origin_data: dict):
+def format_json_data(origin_data: dict, columnar: bool = False):
+    origin_data = to_row_result(origin_data)
     result = {'fields': origin_data.get('fields') if origin_data.get('fields') else []}
     _list = origin_data.get('data') if origin_data.get('data') else []
-    data = format_json_list_data(_list)
-    result['data'] = data
+    # 新记录保存时已处理过精度
+    data = _list if origin_data.get('formatted') else format_json_list_data(_list)
+    if columnar:
+        result.update(ColumnarResult.from_rows(result['fields'], data).to_dict())
+    else:
+        result['data'] = data
 
     return result
 
 
 def format_json_list_data(origin_data: list[dict]):
-    data = []
-    for _data in origin_data if origin_data else []:
-        _row = {}
-        for key, value in _data.items():
-            if value is not None:
-                # 检查是否为数字且需要特殊处理
-                if isinstance(value, (int, float)):
-                    # 整数且超过15位 → 转字符串并标记为文本列
-                    if isinstance(value, int) and len(str(abs(value))) > 15:
-                        value = str(value)
-                    # 小数且超过15位有效数字 → 转字符串并标记为文本列
-                    elif isinstance(value, float):
-                        decimal_str = format(value, '.16f').rstrip('0').rstrip('.')
-                        if len(decimal_str) > 15:
-                            value = str(value)
-            _row[key] = value
-        data.append(_row)
-
-    return data
+    # 超过15位的整数/小数转字符串, 按列批量处理
+    return normalize_records(origin_data, precision_safe=True)
 
 
 def get_chat_chart_data(session: SessionDep, chart_record_id: int):
@@ -122,7 +111,7 @@ def get_chat_chart_data(session: SessionDep, chart_record_id: int):
     res = session.execute(stmt)
     for row in res:
         try:
-            return orjson.loads(row.data)
+            return to_row_result(orjson.loads(row.data))
         except Exception:
             pass
     return {}
@@ -287,7 +276,7 @@ def format_record(record: ChatRecordResult):
     if record.data and record.data.strip() != '':
         try:
             _obj = orjson.loads(record.data)
-            _dict['data'] = _obj
+            _dict['data'] = to_row_result(_obj)
         except Exception:
             pass
     if record.predict_data and record.predict_data.strip() != '':
@@ -489,6 +478,23 @@ def end_log(session: SessionDep, log: ChatLog, full_message: list[dict], reasoni
     return log
 
 
+def save_step_log(session: SessionDep, record_id: int, operate: OperationEnum, steps: list[dict],
+                  start_time: datetime.datetime) -> ChatLog:
+    """Log of a stage without llm call, steps holds the name and milliseconds of every step."""
+    log = ChatLog(type=TypeEnum.CHAT, operate=operate, pid=record_id, messages=steps, token_usage={},
+                  start_time=start_time, finish_time=datetime.datetime.now())
+
+    result = ChatLog(**log.model_dump())
+
+    session.add(log)
+    session.flush()
+    session.refresh(log)
+    result.id = log.id
+    session.commit()
+
+    return result
+
+
 def save_sql_answer(session: SessionDep, record_id: int, answer: str) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
@@ -0,0 +1,137 @@
+import datetime
+import hashlib
+import threading
+import traceback
+from typing import NamedTuple, Optional
+
+import orjson
+from sqlalchemy import and_, delete, or_, select, text, update
+
+from apps.ai_model.embedding import embed_query
+from apps.ai_model.embedding_cache import get_model_id
+from apps.chat.models.chat_model import ChatRecord, ChatSqlCache
+from common.core.config import settings
+from common.core.deps import SessionDep
+from common.utils.utils import SQLBotLogUtil
+
+
+class SqlCacheKey(NamedTuple):
+    datasource: int
+    schema_version: str
+    # sha256 of the user's permission key on the datasource
+    permission_key: str
+    # the sql prompt carries the current date, relative dates in answers are only valid on that day
+    day: datetime.date
+
+
+class CachedSql(NamedTuple):
+    id: int
+    record_id: int
+    answer: str
+    similarity: float
+    generate_ms: int
+
+
+# nearest neighbours first, so the hnsw index on embedding can be used
+cache_sql = """
+SELECT id, record_id, generate_ms, similarity
+FROM
+(SELECT id, record_id, generate_ms,
+( 1 - (embedding <=> CAST(:embedding_array AS vector)) ) AS similarity
+FROM chat_sql_cache
+WHERE datasource = :datasource AND schema_version = :schema_version AND permission_key = :permission_key
+AND embedding_model = :embedding_model AND create_time >= :min_time AND create_time < :max_time
+ORDER BY embedding <=> CAST(:embedding_array AS vector)
+LIMIT 5
+) TEMP
+WHERE similarity >= :similarity
+ORDER BY similarity DESC
+"""
+
+_stats_lock = threading.Lock()
+_lookups = 0
+_hits = 0
+_saved_ms = 0
+
+
+def _count(hit: Optional[CachedSql]):
+    global _lookups, _hits, _saved_ms
+    with _stats_lock:
+        _lookups += 1
+        if hit:
+            _hits += 1
+            _saved_ms += hit.generate_ms or 0
+
+
+def get_sql_cache_stats() -> dict:
+    """Lookups and hits of this process since start, saved_seconds sums the llm time of the reused answers."""
+    with _stats_lock:
+        return {
+            'lookups': _lookups,
+            'hits': _hits,
+            'hit_rate': _hits / _lookups if _lookups else 0.0,
+            'saved_seconds': _saved_ms / 1000,
+        }
+
+
+def build_sql_cache_key(datasource: int, schema_version: str, permission_key: str,
+                        day: Optional[datetime.date] = None) -> SqlCacheKey:
+    return SqlCacheKey(datasource, schema_version, hashlib.sha256(permission_key.encode('utf-8')).hexdigest(),
+                       day or datetime.date.today())
+
+
+def _time_range(key: SqlCacheKey) -> tuple[datetime.datetime, datetime.datetime]:
+    """Creation times of the entries usable under key: on its day and within CHAT_SQL_CACHE_MAX_AGE."""
+    start = datetime.datetime.combine(key.day, datetime.time.min)
+    min_time = datetime.datetime.now() - datetime.timedelta(seconds=settings.CHAT_SQL_CACHE_MAX_AGE)
+    return max(start, min_time), start + datetime.timedelta(days=1)
+
+
+def find_cached_sql(session: SessionDep, key: SqlCacheKey, question: str) -> Optional[CachedSql]:
+    """The sql answer of the most similar question cached under key, when it is similar enough."""
+    hit = None
+    with session.begin_nested():
+        try:
+            min_time, max_time = _time_range(key)
+            rows = session.execute(text(cache_sql), {
+                'embedding_array': str(embed_query(question)), 'datasource': key.datasource,
+                'schema_version': key.schema_version, 'permission_key': key.permission_key,
+                'embedding_model': get_model_id(), 'min_time': min_time, 'max_time': max_time,
+                'similarity': settings.CHAT_SQL_CACHE_SIMILARITY}).fetchall()
+            answers = dict(session.execute(select(ChatRecord.id, ChatRecord.sql_answer).where(
+                and_(ChatRecord.id.in_([row.record_id for row in rows]), ChatRecord.sql_answer.isnot(None)))).all()) \
+                if rows else {}
+            for row in rows:
+                # answers of deleted records are skipped
+                content = orjson.loads(answers[row.record_id]).get('content') if row.record_id in answers else None
+                if content:
+                    hit = CachedSql(row.id, row.record_id, content, row.similarity, row.generate_ms)
+                    break
+        except Exception:
+            traceback.print_exc()
+            session.rollback()
+    if hit:
+        session.execute(update(ChatSqlCache).where(ChatSqlCache.id == hit.id).values(
+            hit_count=ChatSqlCache.hit_count + 1, last_hit_time=datetime.datetime.now()))
+        session.commit()
+        SQLBotLogUtil.info(f"Reuse sql answer of record {hit.record_id} (similarity {hit.similarity:.3f}) "
+                           f"for question: {question}")
+    _count(hit)
+    return hit
+
+
+def save_cached_sql(session: SessionDep, key: SqlCacheKey, question: str, record_id: int, generate_ms: int):
+    """Cache the sql answer of a record whose sql executed, and drop expired entries (older ones or of
+    earlier days) and entries of older schema versions of the datasource."""
+    try:
+        min_time, _ = _time_range(key)
+        session.execute(delete(ChatSqlCache).where(and_(ChatSqlCache.datasource == key.datasource, or_(
+            ChatSqlCache.schema_version != key.schema_version, ChatSqlCache.create_time < min_time))))
+        session.add(ChatSqlCache(datasource=key.datasource, schema_version=key.schema_version,
+                                 permission_key=key.permission_key, embedding_model=get_model_id(),
+                                 question=question, embedding=embed_query(question), record_id=record_id,
+                                 generate_ms=generate_ms, hit_count=0, create_time=datetime.datetime.now()))
+        session.commit()
+    except Exception:
+        traceback.print_exc()
+        session.rollback()
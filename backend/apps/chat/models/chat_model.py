@@ -3,8 +3,9 @@ from enum import Enum
 from typing import List, Optional, Union
 
 from fastapi import Body
+from pgvector.sqlalchemy import VECTOR
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean
+from sqlalchemy import Column, Integer, String, Text, BigInteger, DateTime, Identity, Boolean
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import SQLModel, Field
@@ -40,6 +41,7 @@ class OperationEnum(Enum):
     GENERATE_SQL_WITH_PERMISSIONS = '5'
     CHOOSE_DATASOURCE = '6'
     GENERATE_DYNAMIC_SQL = '7'
+    PREPARE_CONTEXT = '8'
 
 
 class ChatFinishStep(Enum):
@@ -111,6 +113,24 @@ class ChatRecord(SQLModel, table=True):
     predict_record_id: int = Field(sa_column=Column(BigInteger, nullable=True))
 
 
+class ChatSqlCache(SQLModel, table=True):
+    """sql answers of first questions of chats, reused for similar questions on the same schema"""
+    __tablename__ = "chat_sql_cache"
+    id: Optional[int] = Field(sa_column=Column(BigInteger, Identity(always=True), primary_key=True))
+    datasource: int = Field(sa_column=Column(BigInteger, nullable=False))
+    schema_version: str = Field(sa_column=Column(String(64), nullable=False))
+    # sha256 of the permission key of the users who may reuse the answer
+    permission_key: str = Field(sa_column=Column(String(64), nullable=False))
+    embedding_model: str = Field(sa_column=Column(String(255), nullable=False))
+    question: str = Field(sa_column=Column(Text, nullable=True))
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=False))
+    record_id: int = Field(sa_column=Column(BigInteger, nullable=False))
+    generate_ms: int = Field(sa_column=Column(Integer, nullable=True))  # time the llm took for the answer
+    hit_count: int = Field(sa_column=Column(Integer, nullable=False, default=0))
+    create_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+    last_hit_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+
+
 class ChatRecordResult(BaseModel):
     id: Optional[int] = None
     chat_id: Optional[int] = None
@@ -257,6 +277,7 @@ class AiModelQuestion(BaseModel):
 
 class ChatQuestion(AiModelQuestion):
     chat_id: int
+    regenerate: bool = False  # generate the sql even when a similar question was answered before
 
 
 class ChatMcp(ChatQuestion):
@@ -283,7 +304,7 @@ class AxisObj(BaseModel):
 
 class ExcelData(BaseModel):
     axis: list[AxisObj] = []
-    data: list[dict] = []
+    data: list[dict] | dict = []  # row dicts, or a columnar result
     name: str = 'Excel'
 
 
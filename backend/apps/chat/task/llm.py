@@ -1,12 +1,15 @@
-import concurrent
+import asyncio
+import contextvars
+import functools
 import json
 import os
+import time
 import traceback
 import urllib.parse
 import warnings
 from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
-from typing import Any, List, Optional, Union, Dict, Iterator
+from typing import Any, AsyncIterator, List, Optional, Union, Dict, Iterator
 
 import orjson
 import pandas as pd
@@ -22,22 +25,27 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 # from sqlbot_xpack.license.license_manage import SQLBotLicenseUtil
 from sqlmodel import Session
 
+from apps.ai_model.embedding import embedding_scope
+from apps.ai_model.llm_limiter import llm_limiter
 from apps.ai_model.model_factory import LLMConfig, LLMFactory, get_default_config
 from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
     save_error_message, save_sql_exec_data, save_chart_answer, save_chart, \
     finish_record, save_analysis_answer, save_predict_answer, save_predict_data, \
     save_select_datasource_answer, save_recommend_question_answer, \
     get_old_questions, save_analysis_predict_record, rename_chat, get_chart_config, \
-    get_chat_chart_data, list_generate_sql_logs, list_generate_chart_logs, start_log, end_log, \
+    get_chat_chart_data, list_generate_sql_logs, list_generate_chart_logs, start_log, end_log, save_step_log, \
     get_last_execute_sql_error
+from apps.chat.curd.sql_cache import SqlCacheKey, build_sql_cache_key, find_cached_sql, save_cached_sql
 from apps.chat.models.chat_model import ChatQuestion, ChatRecord, Chat, RenameChat, ChatLog, OperationEnum, \
     ChatFinishStep
 from apps.data_training.curd.data_training import get_training_template
-from apps.datasource.crud.datasource import get_table_schema
-from apps.permission_alt.crud.permission_crud import get_row_permission_filters, is_normal_user
+from apps.datasource.crud.datasource import get_schema_version, get_table_schema
+from apps.permission_alt.crud.permission_crud import get_permission_key, get_row_permission_filters, is_normal_user
+from apps.permission_alt.utils.sql_rewriter import rewrite_sql_with_filters
 from apps.datasource.embedding.ds_embedding import get_ds_embedding
 from apps.datasource.models.datasource import CoreDatasource
 from apps.db.db import exec_sql, get_version, check_connection
+from apps.db.result_set import to_columnar_result
 from apps.system.crud.assistant import AssistantOutDs, AssistantOutDsFactory, get_assistant_ds
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from apps.terminology.curd.terminology import get_terminology_template
@@ -45,19 +53,40 @@ from common.core.config import settings
 from common.core.db import engine
 from common.core.deps import CurrentAssistant, CurrentUser
 from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError
-from common.utils.utils import SQLBotLogUtil, extract_nested_json, prepare_for_orjson
+from common.utils.utils import SQLBotLogUtil, extract_nested_json
 
 warnings.filterwarnings("ignore")
 
 base_message_count_limit = 6
 
+save_data_limit = 1000
+
 executor = ThreadPoolExecutor(max_workers=200)
+# steps of prepare_context, apart from executor: a chat task on its worker thread waits for them
+prepare_executor = ThreadPoolExecutor(max_workers=100)
+# chat tasks running as coroutines of the request loop at the same time, CHAT_ASYNC_PIPELINE_ENABLED
+_async_task_slots = asyncio.Semaphore(max(settings.CHAT_ASYNC_CONCURRENCY, 1))
 
 dynamic_ds_types = [1, 3]
 dynamic_subsql_prefix = 'select * from sqlbot_dynamic_temp_table_'
 
+
+def engine_name(ds: CoreDatasource | AssistantOutDsSchema, version: str) -> str:
+    if isinstance(ds, CoreDatasource):
+        return (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + version
+    return ds.type + version
+
+
+def _in_session(func, *args, **kwargs):
+    # steps running at once can not share a session
+    with Session(engine) as session:
+        return func(session, *args, **kwargs)
+
 session_maker = scoped_session(sessionmaker(bind=engine, class_=Session))
 
+# put after the last chunk of a task
+_STREAM_END = object()
+
 
 class LLMService:
     ds: CoreDatasource
@@ -79,15 +108,22 @@ class LLMService:
 
     current_logs: dict[OperationEnum, ChatLog] = {}
 
-    chunk_list: List[str] = []
-    future: Future
+    chunk_queue: asyncio.Queue
+    future: Union[Future, asyncio.Task]
 
     last_execute_sql_error: str = None
 
     def __init__(self, session: Session, current_user: CurrentUser, chat_question: ChatQuestion,
                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
                  embedding: bool = False, config: LLMConfig = None):
-        self.chunk_list = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_pipeline = settings.CHAT_ASYNC_PIPELINE_ENABLED
+        # queue position events are sent to chat clients (sse), not to mcp answers
+        self._queue_events = True
+        self._emit = None
+        # question vectors shared by every step of this request
+        self.embedding_cache = {}
+        self._schema_embedding = embedding
         self.current_user = current_user
         self.current_assistant = current_assistant
         chat_id = chat_question.chat_id
@@ -95,6 +131,7 @@ class LLMService:
         if not chat:
             raise SingleMessageError(f"Chat with id {chat_id} not found")
         ds: CoreDatasource | AssistantOutDsSchema | None = None
+        # engine and schema of the datasource are loaded by prepare_context
         if chat.datasource:
             # Get available datasource
             if current_assistant and current_assistant.type in dynamic_ds_types:
@@ -102,15 +139,10 @@ class LLMService:
                 ds = self.out_ds_instance.get_ds(chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = ds.type + get_version(ds)
-                chat_question.db_schema = self.out_ds_instance.get_db_schema(ds.id, chat_question.question)
             else:
                 ds = session.get(CoreDatasource, chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_version(ds)
-                chat_question.db_schema = get_table_schema(session=session, current_user=current_user, ds=ds,
-                                                           question=chat_question.question, embedding=embedding)
 
         self.generate_sql_logs = list_generate_sql_logs(session=session, chart_id=chat_id)
         self.generate_chart_logs = list_generate_chart_logs(session=session, chart_id=chat_id)
@@ -152,16 +184,6 @@ class LLMService:
         instance = cls(*args, **kwargs, config=config)
         return instance
 
-    def is_running(self, timeout=0.5):
-        try:
-            r = concurrent.futures.wait([self.future], timeout)
-            if len(r.not_done) > 0:
-                return True
-            else:
-                return False
-        except Exception as e:
-            return True
-
     def init_messages(self):
         last_sql_messages: List[dict[str, Any]] = self.generate_sql_logs[-1].messages if len(
             self.generate_sql_logs) > 0 else []
@@ -231,16 +253,16 @@ class LLMService:
                     fields.append(column_str)
         return fields
 
-    def generate_analysis(self, _session: Session):
-        fields = self.get_fields_from_chart(_session)
+    async def generate_analysis(self, _session: Session):
+        fields = await self._call(self.get_fields_from_chart, _session)
         self.chat_question.fields = orjson.dumps(fields).decode()
-        data = get_chat_chart_data(_session, self.record.id)
+        data = await self._call(get_chat_chart_data, _session, self.record.id)
         self.chat_question.data = orjson.dumps(data.get('data')).decode()
         analysis_msg: List[Union[BaseMessage, dict[str, Any]]] = []
 
         ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-        self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
-                                                                    self.current_user.oid, ds_id)
+        self.chat_question.terminologies = await self._call(get_terminology_template, _session,
+                                                            self.chat_question.question, self.current_user.oid, ds_id)
         # if SQLBotLicenseUtil.valid():
         #     self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.ANALYSIS,
         #                                                            self.current_user.oid, ds_id)
@@ -248,21 +270,20 @@ class LLMService:
         analysis_msg.append(SystemMessage(content=self.chat_question.analysis_sys_question()))
         analysis_msg.append(HumanMessage(content=self.chat_question.analysis_user_question()))
 
-        self.current_logs[OperationEnum.ANALYSIS] = start_log(session=_session,
-                                                              ai_modal_id=self.chat_question.ai_modal_id,
-                                                              ai_modal_name=self.chat_question.ai_modal_name,
-                                                              operate=OperationEnum.ANALYSIS,
-                                                              record_id=self.record.id,
-                                                              full_message=[
-                                                                  {'type': msg.type,
-                                                                   'content': msg.content} for
-                                                                  msg
-                                                                  in analysis_msg])
+        self.current_logs[OperationEnum.ANALYSIS] = await self._call(start_log, session=_session,
+                                                                     ai_modal_id=self.chat_question.ai_modal_id,
+                                                                     ai_modal_name=self.chat_question.ai_modal_name,
+                                                                     operate=OperationEnum.ANALYSIS,
+                                                                     record_id=self.record.id,
+                                                                     full_message=[
+                                                                         {'type': msg.type,
+                                                                          'content': msg.content} for
+                                                                         msg
+                                                                         in analysis_msg])
         full_thinking_text = ''
         full_analysis_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(analysis_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(analysis_msg, token_usage):
             if chunk.get('content'):
                 full_analysis_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -271,22 +292,22 @@ class LLMService:
 
         analysis_msg.append(AIMessage(full_analysis_text))
 
-        self.current_logs[OperationEnum.ANALYSIS] = end_log(session=_session,
-                                                            log=self.current_logs[
-                                                                OperationEnum.ANALYSIS],
-                                                            full_message=[
-                                                                {'type': msg.type,
-                                                                 'content': msg.content}
-                                                                for msg in analysis_msg],
-                                                            reasoning_content=full_thinking_text,
-                                                            token_usage=token_usage)
-        self.record = save_analysis_answer(session=_session, record_id=self.record.id,
-                                           answer=orjson.dumps({'content': full_analysis_text}).decode())
-
-    def generate_predict(self, _session: Session):
-        fields = self.get_fields_from_chart(_session)
+        self.current_logs[OperationEnum.ANALYSIS] = await self._call(end_log, session=_session,
+                                                                     log=self.current_logs[
+                                                                         OperationEnum.ANALYSIS],
+                                                                     full_message=[
+                                                                         {'type': msg.type,
+                                                                          'content': msg.content}
+                                                                         for msg in analysis_msg],
+                                                                     reasoning_content=full_thinking_text,
+                                                                     token_usage=token_usage)
+        self.record = await self._call(save_analysis_answer, session=_session, record_id=self.record.id,
+                                       answer=orjson.dumps({'content': full_analysis_text}).decode())
+
+    async def generate_predict(self, _session: Session):
+        fields = await self._call(self.get_fields_from_chart, _session)
         self.chat_question.fields = orjson.dumps(fields).decode()
-        data = get_chat_chart_data(_session, self.record.id)
+        data = await self._call(get_chat_chart_data, _session, self.record.id)
         self.chat_question.data = orjson.dumps(data.get('data')).decode()
 
         # if SQLBotLicenseUtil.valid():
@@ -298,21 +319,20 @@ class LLMService:
         predict_msg.append(SystemMessage(content=self.chat_question.predict_sys_question()))
         predict_msg.append(HumanMessage(content=self.chat_question.predict_user_question()))
 
-        self.current_logs[OperationEnum.PREDICT_DATA] = start_log(session=_session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.PREDICT_DATA,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type,
-                                                                       'content': msg.content} for
-                                                                      msg
-                                                                      in predict_msg])
+        self.current_logs[OperationEnum.PREDICT_DATA] = await self._call(start_log, session=_session,
+                                                                         ai_modal_id=self.chat_question.ai_modal_id,
+                                                                         ai_modal_name=self.chat_question.ai_modal_name,
+                                                                         operate=OperationEnum.PREDICT_DATA,
+                                                                         record_id=self.record.id,
+                                                                         full_message=[
+                                                                             {'type': msg.type,
+                                                                              'content': msg.content} for
+                                                                             msg
+                                                                             in predict_msg])
         full_thinking_text = ''
         full_predict_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(predict_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(predict_msg, token_usage):
             if chunk.get('content'):
                 full_predict_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -320,24 +340,26 @@ class LLMService:
             yield chunk
 
         predict_msg.append(AIMessage(full_predict_text))
-        self.record = save_predict_answer(session=_session, record_id=self.record.id,
-                                          answer=orjson.dumps({'content': full_predict_text}).decode())
-        self.current_logs[OperationEnum.PREDICT_DATA] = end_log(session=_session,
-                                                                log=self.current_logs[
-                                                                    OperationEnum.PREDICT_DATA],
-                                                                full_message=[
-                                                                    {'type': msg.type,
-                                                                     'content': msg.content}
-                                                                    for msg in predict_msg],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
-
-    def generate_recommend_questions_task(self, _session: Session):
+        self.record = await self._call(save_predict_answer, session=_session, record_id=self.record.id,
+                                       answer=orjson.dumps({'content': full_predict_text}).decode())
+        self.current_logs[OperationEnum.PREDICT_DATA] = await self._call(end_log, session=_session,
+                                                                         log=self.current_logs[
+                                                                             OperationEnum.PREDICT_DATA],
+                                                                         full_message=[
+                                                                             {'type': msg.type,
+                                                                              'content': msg.content}
+                                                                             for msg in predict_msg],
+                                                                         reasoning_content=full_thinking_text,
+                                                                         token_usage=token_usage)
+
+    async def generate_recommend_questions_task(self, _session: Session):
 
         # get schema
         if self.ds and not self.chat_question.db_schema:
-            self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
-                self.ds.id, self.chat_question.question) if self.out_ds_instance else get_table_schema(
+            self.chat_question.db_schema = await self._call(
+                self.out_ds_instance.get_db_schema, self.ds.id,
+                self.chat_question.question) if self.out_ds_instance else await self._call(
+                get_table_schema,
                 session=_session,
                 current_user=self.current_user, ds=self.ds,
                 question=self.chat_question.question,
@@ -346,25 +368,22 @@ class LLMService:
         guess_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         guess_msg.append(SystemMessage(content=self.chat_question.guess_sys_question()))
 
-        old_questions = list(map(lambda q: q.strip(), get_old_questions(_session, self.record.datasource)))
+        old_questions = list(map(lambda q: q.strip(),
+                                 await self._call(get_old_questions, _session, self.record.datasource)))
         guess_msg.append(
             HumanMessage(content=self.chat_question.guess_user_question(orjson.dumps(old_questions).decode())))
 
-        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = start_log(session=_session,
-                                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                    operate=OperationEnum.GENERATE_RECOMMENDED_QUESTIONS,
-                                                                                    record_id=self.record.id,
-                                                                                    full_message=[
-                                                                                        {'type': msg.type,
-                                                                                         'content': msg.content} for
-                                                                                        msg
-                                                                                        in guess_msg])
+        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = await self._call(
+            start_log, session=_session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_RECOMMENDED_QUESTIONS,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in guess_msg])
         full_thinking_text = ''
         full_guess_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(guess_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(guess_msg, token_usage):
             if chunk.get('content'):
                 full_guess_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -373,36 +392,35 @@ class LLMService:
 
         guess_msg.append(AIMessage(full_guess_text))
 
-        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = end_log(session=_session,
-                                                                                  log=self.current_logs[
-                                                                                      OperationEnum.GENERATE_RECOMMENDED_QUESTIONS],
-                                                                                  full_message=[
-                                                                                      {'type': msg.type,
-                                                                                       'content': msg.content}
-                                                                                      for msg in guess_msg],
-                                                                                  reasoning_content=full_thinking_text,
-                                                                                  token_usage=token_usage)
-        self.record = save_recommend_question_answer(session=_session, record_id=self.record.id,
-                                                     answer={'content': full_guess_text})
+        self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS] = await self._call(
+            end_log, session=_session,
+            log=self.current_logs[OperationEnum.GENERATE_RECOMMENDED_QUESTIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in guess_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
+        self.record = await self._call(save_recommend_question_answer, session=_session, record_id=self.record.id,
+                                       answer={'content': full_guess_text})
 
         yield {'recommended_question': self.record.recommended_question}
 
-    def select_datasource(self, _session: Session):
+    def list_datasource(self, _session: Session) -> list:
+        if self.current_assistant and self.current_assistant.type != 4:
+            return get_assistant_ds(session=_session, llm_service=self)
+        stmt = select(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description).where(
+            and_(CoreDatasource.oid == self.current_user.oid))
+        return [
+            {
+                "id": ds.id,
+                "name": ds.name,
+                "description": ds.description
+            }
+            for ds in _session.exec(stmt)
+        ]
+
+    async def select_datasource(self, _session: Session):
         datasource_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         datasource_msg.append(SystemMessage(self.chat_question.datasource_sys_question()))
-        if self.current_assistant and self.current_assistant.type != 4:
-            _ds_list = get_assistant_ds(session=_session, llm_service=self)
-        else:
-            stmt = select(CoreDatasource.id, CoreDatasource.name, CoreDatasource.description).where(
-                and_(CoreDatasource.oid == self.current_user.oid))
-            _ds_list = [
-                {
-                    "id": ds.id,
-                    "name": ds.name,
-                    "description": ds.description
-                }
-                for ds in _session.exec(stmt)
-            ]
+        _ds_list = await self._call(self.list_datasource, _session)
         if not _ds_list:
             raise SingleMessageError('No available datasource configuration found')
         ignore_auto_select = _ds_list and len(_ds_list) == 1
@@ -413,8 +431,9 @@ class LLMService:
         if not ignore_auto_select:
             if settings.TABLE_EMBEDDING_ENABLED and (
                     not self.current_assistant or (self.current_assistant and self.current_assistant.type != 1)):
-                _ds_list = get_ds_embedding(_session, self.current_user, _ds_list, self.out_ds_instance,
-                                      self.chat_question.question, self.current_assistant)
+                _ds_list = await self._call(get_ds_embedding, _session, self.current_user, _ds_list,
+                                            self.out_ds_instance, self.chat_question.question,
+                                            self.current_assistant)
                 # yield {'content': '{"id":' + str(ds.get('id')) + '}'}
 
             _ds_list_dict = []
@@ -423,19 +442,16 @@ class LLMService:
             datasource_msg.append(
                 HumanMessage(self.chat_question.datasource_user_question(orjson.dumps(_ds_list_dict).decode())))
 
-            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = start_log(session=_session,
-                                                                           ai_modal_id=self.chat_question.ai_modal_id,
-                                                                           ai_modal_name=self.chat_question.ai_modal_name,
-                                                                           operate=OperationEnum.CHOOSE_DATASOURCE,
-                                                                           record_id=self.record.id,
-                                                                           full_message=[{'type': msg.type,
-                                                                                          'content': msg.content}
-                                                                                         for
-                                                                                         msg in datasource_msg])
+            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = await self._call(
+                start_log, session=_session,
+                ai_modal_id=self.chat_question.ai_modal_id,
+                ai_modal_name=self.chat_question.ai_modal_name,
+                operate=OperationEnum.CHOOSE_DATASOURCE,
+                record_id=self.record.id,
+                full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg])
 
             token_usage = {}
-            res = process_stream(self.llm.stream(datasource_msg), token_usage)
-            for chunk in res:
+            async for chunk in self._llm_stream(datasource_msg, token_usage):
                 if chunk.get('content'):
                     full_text += chunk.get('content')
                 if chunk.get('reasoning_content'):
@@ -443,27 +459,27 @@ class LLMService:
                 yield chunk
             datasource_msg.append(AIMessage(full_text))
 
-            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = end_log(session=_session,
-                                                                         log=self.current_logs[
-                                                                             OperationEnum.CHOOSE_DATASOURCE],
-                                                                         full_message=[
-                                                                             {'type': msg.type,
-                                                                              'content': msg.content}
-                                                                             for msg in datasource_msg],
-                                                                         reasoning_content=full_thinking_text,
-                                                                         token_usage=token_usage)
+            self.current_logs[OperationEnum.CHOOSE_DATASOURCE] = await self._call(
+                end_log, session=_session,
+                log=self.current_logs[OperationEnum.CHOOSE_DATASOURCE],
+                full_message=[{'type': msg.type, 'content': msg.content} for msg in datasource_msg],
+                reasoning_content=full_thinking_text,
+                token_usage=token_usage)
 
             json_str = extract_nested_json(full_text)
             if json_str is None:
                 raise SingleMessageError(f'Cannot parse datasource from answer: {full_text}')
             ds = orjson.loads(json_str)
 
+        await self._call(self.use_datasource, _session, _ds_list[0] if ignore_auto_select else ds,
+                         None if ignore_auto_select or settings.TABLE_EMBEDDING_ENABLED else full_text)
+
+    def use_datasource(self, _session: Session, data: dict, answer: Optional[str]):
+        """Save the datasource chosen for the chat, answer is the llm output to record."""
         _error: Exception | None = None
         _datasource: int | None = None
         _engine_type: str | None = None
         try:
-            data: dict = _ds_list[0] if ignore_auto_select else ds
-
             if data.get('id') and data.get('id') != 0:
                 _datasource = data['id']
                 _chat = _session.get(Chat, self.record.chat_id)
@@ -471,9 +487,7 @@ class LLMService:
                 if self.current_assistant and self.current_assistant.type in dynamic_ds_types:
                     _ds = self.out_ds_instance.get_ds(data['id'])
                     self.ds = _ds
-                    self.chat_question.engine = _ds.type + get_version(self.ds)
-                    self.chat_question.db_schema = self.out_ds_instance.get_db_schema(self.ds.id,
-                                                                                      self.chat_question.question)
+                    self.chat_question.engine = engine_name(self.ds, get_version(self.ds))
                     _engine_type = self.chat_question.engine
                     _chat.engine_type = _ds.type
                 else:
@@ -482,11 +496,9 @@ class LLMService:
                         _datasource = None
                         raise SingleMessageError(f"Datasource configuration with id {_datasource} not found")
                     self.ds = CoreDatasource(**_ds.model_dump())
-                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + get_version(
-                        self.ds)
-                    self.chat_question.db_schema = get_table_schema(session=_session,
-                                                                    current_user=self.current_user, ds=self.ds,
-                                                                    question=self.chat_question.question)
+                    self.chat_question.engine = engine_name(self.ds, get_version(self.ds))
+                    # tables of a chosen datasource are always narrowed down to the question
+                    self._schema_embedding = True
                     _engine_type = self.chat_question.engine
                     _chat.engine_type = _ds.type_name
                 # save chat
@@ -509,46 +521,92 @@ class LLMService:
         except Exception as e:
             _error = e
 
-        if not ignore_auto_select and not settings.TABLE_EMBEDDING_ENABLED:
+        if answer is not None:
             self.record = save_select_datasource_answer(session=_session, record_id=self.record.id,
-                                                        answer=orjson.dumps({'content': full_text}).decode(),
+                                                        answer=orjson.dumps({'content': answer}).decode(),
                                                         datasource=_datasource,
                                                         engine_type=_engine_type)
-        if self.ds:
-            oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-            ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-
-            self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question, oid,
-                                                                        ds_id)
-            self.chat_question.data_training = get_training_template(_session, self.chat_question.question, ds_id,
-                                                                     oid)
-            # if SQLBotLicenseUtil.valid():
-            #     self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.GENERATE_SQL,
-            #                                                            oid, ds_id)
-
-            self.init_messages()
 
         if _error:
             raise _error
 
-    def generate_sql(self, _session: Session):
+    async def prepare_context(self, _session: Session) -> bool:
+        """Load what the sql prompt needs from the datasource (version, schema, terminologies, data training)
+        and check its connection. The steps do not depend on each other and run at once, at most
+        CHAT_PREPARE_CONCURRENCY of them, their timings are logged. Returns whether the datasource connected."""
+        ds = self.ds
+        question = self.chat_question.question
+        oid = ds.oid if isinstance(ds, CoreDatasource) else 1
+        ds_id = ds.id if isinstance(ds, CoreDatasource) else None
+        steps = {
+            'terminology': functools.partial(_in_session, get_terminology_template, question, oid, ds_id),
+            'data_training': functools.partial(_in_session, get_training_template, question, ds_id, oid),
+            'connection': functools.partial(check_connection, trans=None, ds=ds),
+        }
+        if not self.chat_question.engine:
+            steps['version'] = functools.partial(get_version, ds)
+        if not self.chat_question.db_schema:
+            steps['schema'] = functools.partial(self.out_ds_instance.get_db_schema, ds.id, question) \
+                if self.out_ds_instance else functools.partial(_in_session, get_table_schema,
+                                                               current_user=self.current_user, ds=ds,
+                                                               question=question, embedding=self._schema_embedding)
+
+        slots = asyncio.Semaphore(max(settings.CHAT_PREPARE_CONCURRENCY, 1))
+        loop = asyncio.get_running_loop()
+        timings = {}
+
+        def timed(name, step):
+            start = time.monotonic()
+            try:
+                return step()
+            finally:
+                timings[name] = int((time.monotonic() - start) * 1000)
+
+        async def run(name, step):
+            async with slots:
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(prepare_executor, functools.partial(context.run, timed, name, step))
+
+        start_time = datetime.now()
+        results = dict(zip(steps, await asyncio.gather(*(run(name, step) for name, step in steps.items()),
+                                                       return_exceptions=True)))
+        await self._call(save_step_log, _session, self.record.id, OperationEnum.PREPARE_CONTEXT,
+                         [{'step': name, 'ms': timings.get(name),
+                           'error': str(result) if isinstance(result, BaseException) else None}
+                          for name, result in results.items()], start_time)
+        for result in results.values():
+            if isinstance(result, BaseException):
+                raise result
+
+        self.chat_question.terminologies = results['terminology']
+        self.chat_question.data_training = results['data_training']
+        # if SQLBotLicenseUtil.valid():
+        #     self.chat_question.custom_prompt = find_custom_prompts(_session, CustomPromptTypeEnum.GENERATE_SQL,
+        #                                                            oid, ds_id)
+        if 'version' in results:
+            self.chat_question.engine = engine_name(ds, results['version'])
+        if 'schema' in results:
+            self.chat_question.db_schema = results['schema']
+        return results['connection']
+
+    async def generate_sql(self, _session: Session):
         # append current question
         self.sql_message.append(HumanMessage(
             self.chat_question.sql_user_question(current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = start_log(session=_session,
-                                                                  ai_modal_id=self.chat_question.ai_modal_id,
-                                                                  ai_modal_name=self.chat_question.ai_modal_name,
-                                                                  operate=OperationEnum.GENERATE_SQL,
-                                                                  record_id=self.record.id,
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content} for msg
-                                                                      in self.sql_message])
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self._call(start_log, session=_session,
+                                                                         ai_modal_id=self.chat_question.ai_modal_id,
+                                                                         ai_modal_name=self.chat_question.ai_modal_name,
+                                                                         operate=OperationEnum.GENERATE_SQL,
+                                                                         record_id=self.record.id,
+                                                                         full_message=[
+                                                                             {'type': msg.type,
+                                                                              'content': msg.content} for msg
+                                                                             in self.sql_message])
         full_thinking_text = ''
         full_sql_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.sql_message), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(self.sql_message, token_usage):
             if chunk.get('content'):
                 full_sql_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -557,16 +615,42 @@ class LLMService:
 
         self.sql_message.append(AIMessage(full_sql_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL] = end_log(session=_session,
-                                                                log=self.current_logs[OperationEnum.GENERATE_SQL],
-                                                                full_message=[{'type': msg.type, 'content': msg.content}
-                                                                              for msg in self.sql_message],
-                                                                reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_SQL] = await self._call(end_log, session=_session,
+                                                                         log=self.current_logs[
+                                                                             OperationEnum.GENERATE_SQL],
+                                                                         full_message=[
+                                                                             {'type': msg.type,
+                                                                              'content': msg.content}
+                                                                             for msg in self.sql_message],
+                                                                         reasoning_content=full_thinking_text,
+                                                                         token_usage=token_usage)
+        self.record = await self._call(save_sql_answer, session=_session, record_id=self.record.id,
+                                       answer=orjson.dumps({'content': full_sql_text}).decode())
+
+    def sql_cache_key(self, _session: Session) -> Optional[SqlCacheKey]:
+        """Key of the sql answer cache (datasource, schema version, permissions and today's date, which the sql
+        prompt carries), None when the answer can not be shared: follow-up questions depend on the chat history,
+        and datasources of assistants have no schema version."""
+        if (not settings.CHAT_SQL_CACHE_ENABLED or not settings.EMBEDDING_ENABLED or self.chat_question.regenerate
+                or not isinstance(self.ds, CoreDatasource) or self.generate_sql_logs or self.chat_question.error_msg):
+            return None
+        return build_sql_cache_key(self.ds.id, get_schema_version(_session, self.ds),
+                                   get_permission_key(_session, self.current_user, self.ds))
+
+    def use_cached_sql(self, _session: Session, answer: str):
+        """Save a cached sql answer as the answer of this question, with the log generate_sql would write."""
+        self.sql_message.append(HumanMessage(
+            self.chat_question.sql_user_question(current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
+        self.sql_message.append(AIMessage(answer))
+        full_message = [{'type': msg.type, 'content': msg.content} for msg in self.sql_message]
+        log = start_log(session=_session, ai_modal_id=self.chat_question.ai_modal_id,
+                        ai_modal_name=self.chat_question.ai_modal_name, operate=OperationEnum.GENERATE_SQL,
+                        record_id=self.record.id, full_message=full_message)
+        self.current_logs[OperationEnum.GENERATE_SQL] = end_log(session=_session, log=log, full_message=full_message)
         self.record = save_sql_answer(session=_session, record_id=self.record.id,
-                                      answer=orjson.dumps({'content': full_sql_text}).decode())
+                                      answer=orjson.dumps({'content': answer}).decode())
 
-    def generate_with_sub_sql(self, session: Session, sql, sub_mappings: list):
+    async def generate_with_sub_sql(self, session: Session, sql, sub_mappings: list):
         sub_query = json.dumps(sub_mappings, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.sub_query = sub_query
@@ -574,21 +658,18 @@ class LLMService:
         dynamic_sql_msg.append(SystemMessage(content=self.chat_question.dynamic_sys_question()))
         dynamic_sql_msg.append(HumanMessage(content=self.chat_question.dynamic_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = start_log(session=session,
-                                                                          ai_modal_id=self.chat_question.ai_modal_id,
-                                                                          ai_modal_name=self.chat_question.ai_modal_name,
-                                                                          operate=OperationEnum.GENERATE_DYNAMIC_SQL,
-                                                                          record_id=self.record.id,
-                                                                          full_message=[{'type': msg.type,
-                                                                                         'content': msg.content}
-                                                                                        for
-                                                                                        msg in dynamic_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self._call(
+            start_log, session=session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_DYNAMIC_SQL,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg])
 
         full_thinking_text = ''
         full_dynamic_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(dynamic_sql_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(dynamic_sql_msg, token_usage):
             if chunk.get('content'):
                 full_dynamic_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -596,20 +677,17 @@ class LLMService:
 
         dynamic_sql_msg.append(AIMessage(full_dynamic_text))
 
-        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = end_log(session=session,
-                                                                        log=self.current_logs[
-                                                                            OperationEnum.GENERATE_DYNAMIC_SQL],
-                                                                        full_message=[
-                                                                            {'type': msg.type,
-                                                                             'content': msg.content}
-                                                                            for msg in dynamic_sql_msg],
-                                                                        reasoning_content=full_thinking_text,
-                                                                        token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL] = await self._call(
+            end_log, session=session,
+            log=self.current_logs[OperationEnum.GENERATE_DYNAMIC_SQL],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in dynamic_sql_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
         SQLBotLogUtil.info(full_dynamic_text)
         return full_dynamic_text
 
-    def generate_assistant_dynamic_sql(self, _session: Session, sql, tables: List):
+    async def generate_assistant_dynamic_sql(self, _session: Session, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         sub_query = []
         result_dict = {}
@@ -620,11 +698,11 @@ class LLMService:
                 sub_query.append({"table": table.name, "query": f'{dynamic_subsql_prefix}{table.name}'})
         if not sub_query:
             return None
-        temp_sql_text = self.generate_with_sub_sql(session=_session, sql=sql, sub_mappings=sub_query)
+        temp_sql_text = await self.generate_with_sub_sql(session=_session, sql=sql, sub_mappings=sub_query)
         result_dict['sqlbot_temp_sql_text'] = temp_sql_text
         return result_dict
 
-    def build_table_filter(self, session: Session, sql: str, filters: list):
+    async def build_table_filter(self, session: Session, sql: str, filters: list):
         filter = json.dumps(filters, ensure_ascii=False)
         self.chat_question.sql = sql
         self.chat_question.filter = filter
@@ -632,21 +710,17 @@ class LLMService:
         permission_sql_msg.append(SystemMessage(content=self.chat_question.filter_sys_question()))
         permission_sql_msg.append(HumanMessage(content=self.chat_question.filter_user_question()))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = start_log(session=session,
-                                                                                   ai_modal_id=self.chat_question.ai_modal_id,
-                                                                                   ai_modal_name=self.chat_question.ai_modal_name,
-                                                                                   operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
-                                                                                   record_id=self.record.id,
-                                                                                   full_message=[
-                                                                                       {'type': msg.type,
-                                                                                        'content': msg.content} for
-                                                                                       msg
-                                                                                       in permission_sql_msg])
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self._call(
+            start_log, session=session,
+            ai_modal_id=self.chat_question.ai_modal_id,
+            ai_modal_name=self.chat_question.ai_modal_name,
+            operate=OperationEnum.GENERATE_SQL_WITH_PERMISSIONS,
+            record_id=self.record.id,
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg])
         full_thinking_text = ''
         full_filter_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(permission_sql_msg), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(permission_sql_msg, token_usage):
             if chunk.get('content'):
                 full_filter_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -654,27 +728,31 @@ class LLMService:
 
         permission_sql_msg.append(AIMessage(full_filter_text))
 
-        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = end_log(session=session,
-                                                                                 log=self.current_logs[
-                                                                                     OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
-                                                                                 full_message=[
-                                                                                     {'type': msg.type,
-                                                                                      'content': msg.content}
-                                                                                     for msg in permission_sql_msg],
-                                                                                 reasoning_content=full_thinking_text,
-                                                                                 token_usage=token_usage)
+        self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS] = await self._call(
+            end_log, session=session,
+            log=self.current_logs[OperationEnum.GENERATE_SQL_WITH_PERMISSIONS],
+            full_message=[{'type': msg.type, 'content': msg.content} for msg in permission_sql_msg],
+            reasoning_content=full_thinking_text,
+            token_usage=token_usage)
 
         SQLBotLogUtil.info(full_filter_text)
         return full_filter_text
 
-    def generate_filter(self, _session: Session, sql: str, tables: List):
-        filters = get_row_permission_filters(session=_session, current_user=self.current_user, ds=self.ds,
-                                             tables=tables)
+    async def apply_table_filter(self, session: Session, sql: str, filters: list):
+        # filters are merged into the sql directly, the llm only handles sql the rewriter cannot parse
+        rewritten = rewrite_sql_with_filters(sql, filters, self.ds.type)
+        if rewritten is not None:
+            return orjson.dumps({'success': True, 'sql': rewritten}).decode()
+        return await self.build_table_filter(session=session, sql=sql, filters=filters)
+
+    async def generate_filter(self, _session: Session, sql: str, tables: List):
+        filters = await self._call(get_row_permission_filters, session=_session, current_user=self.current_user,
+                                   ds=self.ds, tables=tables)
         if not filters:
             return None
-        return self.build_table_filter(session=_session, sql=sql, filters=filters)
+        return await self.apply_table_filter(session=_session, sql=sql, filters=filters)
 
-    def generate_assistant_filter(self, _session: Session, sql, tables: List):
+    async def generate_assistant_filter(self, _session: Session, sql, tables: List):
         ds: AssistantOutDsSchema = self.ds
         filters = []
         for table in ds.tables:
@@ -682,26 +760,26 @@ class LLMService:
                 filters.append({"table": table.name, "filter": table.rule})
         if not filters:
             return None
-        return self.build_table_filter(session=_session, sql=sql, filters=filters)
+        return await self.apply_table_filter(session=_session, sql=sql, filters=filters)
 
-    def generate_chart(self, _session: Session, chart_type: Optional[str] = ''):
+    async def generate_chart(self, _session: Session, chart_type: Optional[str] = ''):
         # append current question
         self.chart_message.append(HumanMessage(self.chat_question.chart_user_question(chart_type)))
 
-        self.current_logs[OperationEnum.GENERATE_CHART] = start_log(session=_session,
-                                                                    ai_modal_id=self.chat_question.ai_modal_id,
-                                                                    ai_modal_name=self.chat_question.ai_modal_name,
-                                                                    operate=OperationEnum.GENERATE_CHART,
-                                                                    record_id=self.record.id,
-                                                                    full_message=[
-                                                                        {'type': msg.type, 'content': msg.content} for
-                                                                        msg
-                                                                        in self.chart_message])
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self._call(start_log, session=_session,
+                                                                           ai_modal_id=self.chat_question.ai_modal_id,
+                                                                           ai_modal_name=self.chat_question.ai_modal_name,
+                                                                           operate=OperationEnum.GENERATE_CHART,
+                                                                           record_id=self.record.id,
+                                                                           full_message=[
+                                                                               {'type': msg.type,
+                                                                                'content': msg.content} for
+                                                                               msg
+                                                                               in self.chart_message])
         full_thinking_text = ''
         full_chart_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.chart_message), token_usage)
-        for chunk in res:
+        async for chunk in self._llm_stream(self.chart_message, token_usage):
             if chunk.get('content'):
                 full_chart_text += chunk.get('content')
             if chunk.get('reasoning_content'):
@@ -710,15 +788,17 @@ class LLMService:
 
         self.chart_message.append(AIMessage(full_chart_text))
 
-        self.record = save_chart_answer(session=_session, record_id=self.record.id,
-                                        answer=orjson.dumps({'content': full_chart_text}).decode())
-        self.current_logs[OperationEnum.GENERATE_CHART] = end_log(session=_session,
-                                                                  log=self.current_logs[OperationEnum.GENERATE_CHART],
-                                                                  full_message=[
-                                                                      {'type': msg.type, 'content': msg.content}
-                                                                      for msg in self.chart_message],
-                                                                  reasoning_content=full_thinking_text,
-                                                                  token_usage=token_usage)
+        self.record = await self._call(save_chart_answer, session=_session, record_id=self.record.id,
+                                       answer=orjson.dumps({'content': full_chart_text}).decode())
+        self.current_logs[OperationEnum.GENERATE_CHART] = await self._call(end_log, session=_session,
+                                                                           log=self.current_logs[
+                                                                               OperationEnum.GENERATE_CHART],
+                                                                           full_message=[
+                                                                               {'type': msg.type,
+                                                                                'content': msg.content}
+                                                                               for msg in self.chart_message],
+                                                                           reasoning_content=full_thinking_text,
+                                                                           token_usage=token_usage)
 
     @staticmethod
     def check_sql(res: str) -> tuple[str, Optional[list]]:
@@ -838,16 +918,18 @@ class LLMService:
     def save_sql_data(self, session: Session, data_obj: Dict[str, Any]):
         try:
             data_result = data_obj.get('data')
-            limit = 1000
+            limit = save_data_limit
             if data_result:
-                data_result = prepare_for_orjson(data_result)
-                if data_result and len(data_result) > limit:
+                # rows are already normalized by exec_sql
+                if len(data_result) > limit:
                     data_obj['data'] = data_result[:limit]
                     data_obj['limit'] = limit
                 else:
                     data_obj['data'] = data_result
+                    if data_obj.get('truncated'):
+                        data_obj['limit'] = limit
             return save_sql_exec_data(session=session, record_id=self.record.id,
-                                      data=orjson.dumps(data_obj).decode())
+                                      data=orjson.dumps(to_columnar_result(data_obj, precision_safe=True)).decode())
         except Exception as e:
             raise e
 
@@ -866,7 +948,8 @@ class LLMService:
         """
         SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
         try:
-            return exec_sql(ds=self.ds, sql=sql, origin_column=False)
+            # only save_data_limit rows are kept, do not read more from the datasource
+            return exec_sql(ds=self.ds, sql=sql, origin_column=False, max_rows=save_data_limit)
         except Exception as e:
             if isinstance(e, ParseSQLResultError):
                 raise e
@@ -874,56 +957,96 @@ class LLMService:
                 err = traceback.format_exc(limit=1, chain=True)
                 raise SQLBotDBError(err)
 
-    def pop_chunk(self):
-        try:
-            chunk = self.chunk_list.pop(0)
-            return chunk
-        except IndexError as e:
-            return None
-
-    def await_result(self):
-        while self.is_running():
-            while True:
-                chunk = self.pop_chunk()
-                if chunk is not None:
-                    yield chunk
-                else:
-                    break
+    async def await_result(self):
+        """Chunks of the running task, each one handed over as soon as the task produced it."""
         while True:
-            chunk = self.pop_chunk()
-            if chunk is None:
+            chunk = await self.chunk_queue.get()
+            if chunk is _STREAM_END:
                 break
             yield chunk
 
+    async def _call(self, func, *args, **kwargs):
+        """Blocking step of a task (database, datasource driver, embedding), run on the executor when
+        the task is a coroutine of the request loop, and inline on the task's own worker thread otherwise."""
+        if not self._async_pipeline:
+            return func(*args, **kwargs)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def _llm_stream(self, messages: List[Union[BaseMessage, dict[str, Any]]], token_usage: Dict[str, Any]) \
+            -> AsyncIterator[dict]:
+        model = self.config.model_id or self.config.model_name
+        async with llm_limiter.slot(model, self.current_user.oid, self._queue_position):
+            if self._async_pipeline:
+                res = aprocess_stream(self.llm.astream(messages), token_usage)
+            else:
+                res = _iterate_async(process_stream(self.llm.stream(messages), token_usage))
+            async for chunk in res:
+                yield chunk
+
+    def _queue_position(self, position: int):
+        # sent directly, the step waiting for the model has nothing in the stream yet
+        if self._queue_events and self._emit:
+            self._emit('data:' + orjson.dumps({'type': 'queue', 'position': position}).decode() + '\n\n')
+
+    def _open_session(self) -> Session:
+        # scoped sessions belong to a thread, every coroutine of the request loop would share one
+        return Session(engine) if self._async_pipeline else session_maker()
+
+    async def _close_session(self, session: Optional[Session]):
+        if not self._async_pipeline:
+            session_maker.remove()
+        elif session:
+            await self._call(session.close)
+
+    def _submit(self, task, *args):
+        # called from the request coroutine, chunks are handed back to its loop
+        self._loop = asyncio.get_running_loop()
+        self.chunk_queue = asyncio.Queue()
+        if self._async_pipeline:
+            self.future = self._loop.create_task(self._produce_async(task, *args))
+        else:
+            self.future = executor.submit(self._produce, task, *args)
+
+    def _produce(self, task, *args):
+        # the task runs on a loop of this worker thread, its blocking steps inline
+        try:
+            self._emit = self._put_chunk
+            with embedding_scope(self.embedding_cache):
+                asyncio.run(_drain(task(*args), self._put_chunk))
+        finally:
+            self._put_chunk(_STREAM_END)
+
+    async def _produce_async(self, task, *args):
+        try:
+            self._emit = self.chunk_queue.put_nowait
+            async with _async_task_slots:
+                with embedding_scope(self.embedding_cache):
+                    await _drain(task(*args), self.chunk_queue.put_nowait)
+        finally:
+            self.chunk_queue.put_nowait(_STREAM_END)
+
+    def _put_chunk(self, chunk):
+        try:
+            self._loop.call_soon_threadsafe(self.chunk_queue.put_nowait, chunk)
+        except RuntimeError:
+            # the event loop is closed, nobody reads the stream any more
+            pass
+
     def run_task_async(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
-        self.future = executor.submit(self.run_task_cache, in_chat, stream, finish_step)
+        self._queue_events = in_chat
+        self._submit(self.run_task, in_chat, stream, finish_step)
 
-    def run_task_cache(self, in_chat: bool = True, stream: bool = True,
+    async def run_task(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.run_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
-
-    def run_task(self, in_chat: bool = True, stream: bool = True,
-                 finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         json_result: Dict[str, Any] = {'success': True}
         _session = None
         try:
-            _session = session_maker()
-            if self.ds:
-                oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-                ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-                self.chat_question.terminologies = get_terminology_template(_session, self.chat_question.question,
-                                                                            oid, ds_id)
-                self.chat_question.data_training = get_training_template(_session, self.chat_question.question,
-                                                                         ds_id, oid)
-                # if SQLBotLicenseUtil.valid():
-                #     self.chat_question.custom_prompt = find_custom_prompts(_session,
-                #                                                            CustomPromptTypeEnum.GENERATE_SQL,
-                #                                                            oid, ds_id)
-                self.init_messages()
+            _session = self._open_session()
 
             # return id
             if in_chat:
@@ -934,9 +1057,9 @@ class LLMService:
             # return title
             if self.change_title:
                 if self.chat_question.question or self.chat_question.question.strip() != '':
-                    brief = rename_chat(session=_session,
-                                        rename_object=RenameChat(id=self.get_record().chat_id,
-                                                                 brief=self.chat_question.question.strip()[:20]))
+                    brief = await self._call(rename_chat, session=_session,
+                                             rename_object=RenameChat(id=self.get_record().chat_id,
+                                                                      brief=self.chat_question.question.strip()[:20]))
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'brief', 'brief': brief}).decode() + '\n\n'
                     if not stream:
@@ -946,7 +1069,7 @@ class LLMService:
             if not self.ds:
                 ds_res = self.select_datasource(_session)
 
-                for chunk in ds_res:
+                async for chunk in ds_res:
                     SQLBotLogUtil.info(chunk)
                     if in_chat:
                         yield 'data:' + orjson.dumps(
@@ -956,30 +1079,38 @@ class LLMService:
                     yield 'data:' + orjson.dumps({'id': self.ds.id, 'datasource_name': self.ds.name,
                                                   'engine_type': self.ds.type_name or self.ds.type,
                                                   'type': 'datasource'}).decode() + '\n\n'
-
-                self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
-                    self.ds.id, self.chat_question.question) if self.out_ds_instance else get_table_schema(
-                    session=_session,
-                    current_user=self.current_user,
-                    ds=self.ds,
-                    question=self.chat_question.question)
             else:
-                self.validate_history_ds(_session)
+                await self._call(self.validate_history_ds, _session)
 
-            # check connection
-            connected = check_connection(ds=self.ds, trans=None)
+            # load the datasource context and check connection
+            connected = await self.prepare_context(_session)
+            self.init_messages()
             if not connected:
                 raise SQLBotDBConnectionError('Connect DB failed')
 
-            # generate sql
-            sql_res = self.generate_sql(_session)
+            # generate sql, or reuse the answer of a similar question asked on the same schema
+            cache_key = await self._call(self.sql_cache_key, _session)
+            cached_sql = await self._call(find_cached_sql, _session, cache_key,
+                                          self.chat_question.question) if cache_key else None
             full_sql_text = ''
-            for chunk in sql_res:
-                full_sql_text += chunk.get('content')
+            generate_ms = 0
+            if cached_sql:
+                full_sql_text = cached_sql.answer
+                await self._call(self.use_cached_sql, _session, full_sql_text)
                 if in_chat:
-                    yield 'data:' + orjson.dumps(
-                        {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
-                         'type': 'sql-result'}).decode() + '\n\n'
+                    yield 'data:' + orjson.dumps({'content': full_sql_text, 'reasoning_content': '',
+                                                  'type': 'sql-result'}).decode() + '\n\n'
+                    yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'sql reused'}).decode() + '\n\n'
+            else:
+                generate_start = time.monotonic()
+                sql_res = self.generate_sql(_session)
+                async for chunk in sql_res:
+                    full_sql_text += chunk.get('content')
+                    if in_chat:
+                        yield 'data:' + orjson.dumps(
+                            {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
+                             'type': 'sql-result'}).decode() + '\n\n'
+                generate_ms = int((time.monotonic() - generate_start) * 1000)
             if in_chat:
                 yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'sql generated'}).decode() + '\n\n'
             # filter sql
@@ -999,22 +1130,23 @@ class LLMService:
                 sql_result = None
 
                 if use_dynamic_ds:
-                    dynamic_sql_result = self.generate_assistant_dynamic_sql(_session, sql, tables)
+                    dynamic_sql_result = await self.generate_assistant_dynamic_sql(_session, sql, tables)
                     sqlbot_temp_sql_text = dynamic_sql_result.get(
                         'sqlbot_temp_sql_text') if dynamic_sql_result else None
                     # sql_result = self.generate_assistant_filter(sql, tables)
                 else:
-                    sql_result = self.generate_filter(_session, sql, tables)  # maybe no sql and tables
+                    sql_result = await self.generate_filter(_session, sql, tables)  # maybe no sql and tables
 
                 if sql_result:
                     SQLBotLogUtil.info(sql_result)
-                    sql = self.check_save_sql(session=_session, res=sql_result)
+                    sql = await self._call(self.check_save_sql, session=_session, res=sql_result)
                 elif dynamic_sql_result and sqlbot_temp_sql_text:
-                    assistant_dynamic_sql = self.check_save_sql(session=_session, res=sqlbot_temp_sql_text)
+                    assistant_dynamic_sql = await self._call(self.check_save_sql, session=_session,
+                                                             res=sqlbot_temp_sql_text)
                 else:
-                    sql = self.check_save_sql(session=_session, res=full_sql_text)
+                    sql = await self._call(self.check_save_sql, session=_session, res=full_sql_text)
             else:
-                sql = self.check_save_sql(session=_session, res=full_sql_text)
+                sql = await self._call(self.check_save_sql, session=_session, res=full_sql_text)
 
             SQLBotLogUtil.info('sql: ' + sql)
 
@@ -1044,8 +1176,12 @@ class LLMService:
                     yield json_result
                 return
 
-            result = self.execute_sql(sql=real_execute_sql)
-            self.save_sql_data(session=_session, data_obj=result)
+            result = await self._call(self.execute_sql, sql=real_execute_sql)
+            await self._call(self.save_sql_data, session=_session, data_obj=result)
+            if cache_key and not cached_sql:
+                # the sql executed, its answer can be reused
+                await self._call(save_cached_sql, _session, cache_key, self.chat_question.question, self.record.id,
+                                 generate_ms)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': 'execute-success', 'type': 'sql-data'}).decode() + '\n\n'
             if not stream:
@@ -1081,7 +1217,7 @@ class LLMService:
             # generate chart
             chart_res = self.generate_chart(_session, chart_type)
             full_chart_text = ''
-            for chunk in chart_res:
+            async for chunk in chart_res:
                 full_chart_text += chunk.get('content')
                 if in_chat:
                     yield 'data:' + orjson.dumps(
@@ -1092,7 +1228,7 @@ class LLMService:
 
             # filter chart
             SQLBotLogUtil.info(full_chart_text)
-            chart = self.check_save_chart(session=_session, res=full_chart_text)
+            chart = await self._call(self.check_save_chart, session=_session, res=full_chart_text)
             SQLBotLogUtil.info(chart)
 
             if not stream:
@@ -1141,7 +1277,7 @@ class LLMService:
                 # todo generate picture
                 if chart['type'] != 'table':
                     yield '### generated chart picture\n\n'
-                    image_url = request_picture(self.record.chat_id, self.record.id, chart, result)
+                    image_url = await self._call(request_picture, self.record.chat_id, self.record.id, chart, result)
                     SQLBotLogUtil.info(image_url)
                     if stream:
                         yield f'![{chart["type"]}]({image_url})'
@@ -1165,7 +1301,7 @@ class LLMService:
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
             if _session:
-                self.save_error(session=_session, message=error_msg)
+                await self._call(self.save_error, session=_session, message=error_msg)
             if in_chat:
                 yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
             else:
@@ -1176,22 +1312,19 @@ class LLMService:
                     json_result['message'] = error_msg
                     yield json_result
         finally:
-            self.finish(_session)
-            session_maker.remove()
+            await self._call(self.finish, _session)
+            await self._close_session(_session)
 
     def run_recommend_questions_task_async(self):
-        self.future = executor.submit(self.run_recommend_questions_task_cache)
-
-    def run_recommend_questions_task_cache(self):
-        for chunk in self.run_recommend_questions_task():
-            self.chunk_list.append(chunk)
+        self._submit(self.run_recommend_questions_task)
 
-    def run_recommend_questions_task(self):
+    async def run_recommend_questions_task(self):
+        _session = None
         try:
-            _session = session_maker()
+            _session = self._open_session()
             res = self.generate_recommend_questions_task(_session)
 
-            for chunk in res:
+            async for chunk in res:
                 if chunk.get('recommended_question'):
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('recommended_question'),
@@ -1203,26 +1336,22 @@ class LLMService:
         except Exception:
             traceback.print_exc()
         finally:
-            session_maker.remove()
+            await self._close_session(_session)
 
     def run_analysis_or_predict_task_async(self, session: Session, action_type: str, base_record: ChatRecord):
         self.set_record(save_analysis_predict_record(session, base_record, action_type))
-        self.future = executor.submit(self.run_analysis_or_predict_task_cache, action_type)
-
-    def run_analysis_or_predict_task_cache(self, action_type: str):
-        for chunk in self.run_analysis_or_predict_task(action_type):
-            self.chunk_list.append(chunk)
+        self._submit(self.run_analysis_or_predict_task, action_type)
 
-    def run_analysis_or_predict_task(self, action_type: str):
+    async def run_analysis_or_predict_task(self, action_type: str):
         _session = None
         try:
-            _session = session_maker()
+            _session = self._open_session()
             yield 'data:' + orjson.dumps({'type': 'id', 'id': self.get_record().id}).decode() + '\n\n'
 
             if action_type == 'analysis':
                 # generate analysis
                 analysis_res = self.generate_analysis(_session)
-                for chunk in analysis_res:
+                async for chunk in analysis_res:
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
                          'type': 'analysis-result'}).decode() + '\n\n'
@@ -1234,14 +1363,14 @@ class LLMService:
                 # generate predict
                 analysis_res = self.generate_predict(_session)
                 full_text = ''
-                for chunk in analysis_res:
+                async for chunk in analysis_res:
                     yield 'data:' + orjson.dumps(
                         {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
                          'type': 'predict-result'}).decode() + '\n\n'
                     full_text += chunk.get('content')
                 yield 'data:' + orjson.dumps({'type': 'info', 'msg': 'predict generated'}).decode() + '\n\n'
 
-                _data = self.check_save_predict_data(session=_session, res=full_text)
+                _data = await self._call(self.check_save_predict_data, session=_session, res=full_text)
                 if _data:
                     yield 'data:' + orjson.dumps({'type': 'predict-success'}).decode() + '\n\n'
                 else:
@@ -1249,7 +1378,7 @@ class LLMService:
 
                 yield 'data:' + orjson.dumps({'type': 'predict_finish'}).decode() + '\n\n'
 
-            self.finish(_session)
+            await self._call(self.finish, _session)
         except Exception as e:
             error_msg: str
             if isinstance(e, SingleMessageError):
@@ -1257,11 +1386,11 @@ class LLMService:
             else:
                 error_msg = orjson.dumps({'message': str(e), 'traceback': traceback.format_exc(limit=1)}).decode()
             if _session:
-                self.save_error(session=_session, message=error_msg)
+                await self._call(self.save_error, session=_session, message=error_msg)
             yield 'data:' + orjson.dumps({'content': error_msg, 'type': 'error'}).decode() + '\n\n'
         finally:
             # end
-            session_maker.remove()
+            await self._close_session(_session)
 
     def validate_history_ds(self, session: Session):
         _ds = self.ds
@@ -1456,6 +1585,46 @@ def process_stream(res: Iterator[BaseMessageChunk],
         get_token_usage(chunk, token_usage)
 
 
+class _ChunkFeed:
+    """Iterator of at most one message chunk, process_stream reads exactly one chunk for every
+    parsed chunk it yields, so it can parse a stream that arrives asynchronously."""
+
+    def __init__(self):
+        self.chunk: Optional[BaseMessageChunk] = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> BaseMessageChunk:
+        if self.chunk is None:
+            raise StopIteration
+        chunk, self.chunk = self.chunk, None
+        return chunk
+
+
+async def aprocess_stream(res: AsyncIterator[BaseMessageChunk], token_usage: Dict[str, Any] = None):
+    """process_stream of an astream response."""
+    if token_usage is None:
+        token_usage = {}
+    feed = _ChunkFeed()
+    parser = process_stream(feed, token_usage)
+    async for chunk in res:
+        feed.chunk = chunk
+        yield next(parser)
+    # the parser records the token usage of the last chunk before it finishes
+    next(parser, None)
+
+
+async def _iterate_async(res: Iterator):
+    for item in res:
+        yield item
+
+
+async def _drain(chunks: AsyncIterator, put):
+    async for chunk in chunks:
+        put(chunk)
+
+
 def get_lang_name(lang: str):
     if not lang:
         return '简体中文'
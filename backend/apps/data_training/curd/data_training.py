@@ -8,7 +8,8 @@ import dicttoxml
 from sqlalchemy import and_, select, func, delete, update, or_
 from sqlalchemy import text
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import embed_query
+from apps.ai_model.embedding_backfill import backfill_empty_embeddings, save_embeddings_in_batches
 from apps.data_training.models.data_training_model import DataTrainingInfo, DataTraining
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_data_training_template
@@ -159,16 +160,18 @@ def delete_training(session: SessionDep, ids: list[int]):
 #     executor.submit(run_fill_empty_embeddings)
 
 
+def load_training_texts(session, ids: List[int]) -> List[tuple[int, str]]:
+    rows = session.query(DataTraining.id, DataTraining.question).filter(DataTraining.id.in_(ids)).all()
+    return [(row.id, row.question) for row in rows]
+
+
 def run_fill_empty_embeddings(session_maker):
     try:
         if not settings.EMBEDDING_ENABLED:
             return
 
         session = session_maker()
-        stmt = select(DataTraining.id).where(and_(DataTraining.embedding.is_(None)))
-        results = session.execute(stmt).scalars().all()
-
-        save_embeddings(session_maker, results)
+        backfill_empty_embeddings(session, 'data_training', DataTraining, load_training_texts)
     except Exception:
         traceback.print_exc()
     finally:
@@ -183,36 +186,26 @@ def save_embeddings(session_maker, ids: List[int]):
         return
     try:
         session = session_maker()
-        _list = session.query(DataTraining).filter(and_(DataTraining.id.in_(ids))).all()
-
-        _question_list = [item.question for item in _list]
-
-        model = EmbeddingModelCache.get_model()
-
-        results = model.embed_documents(_question_list)
-
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(DataTraining).where(and_(DataTraining.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
-            session.commit()
-
+        save_embeddings_in_batches(session, DataTraining, ids, load_training_texts)
     except Exception:
         traceback.print_exc()
     finally:
         session_maker.remove()
 
 
+# nearest neighbours first, so the hnsw index on embedding can be used, oid/datasource are pre-filters
 embedding_sql = f"""
 SELECT id, datasource, question, similarity
 FROM
-(SELECT id, datasource, question, oid,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
-FROM data_training AS child
+(SELECT id, datasource, question,
+( 1 - (embedding <=> CAST(:embedding_array AS vector)) ) AS similarity
+FROM data_training
+WHERE embedding IS NOT NULL AND oid = :oid AND datasource = :datasource
+ORDER BY embedding <=> CAST(:embedding_array AS vector)
+LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 ) TEMP
-WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY} and oid = :oid and datasource = :datasource
+WHERE similarity > {settings.EMBEDDING_DATA_TRAINING_SIMILARITY}
 ORDER BY similarity DESC
-LIMIT {settings.EMBEDDING_DATA_TRAINING_TOP_COUNT}
 """
 
 
@@ -242,9 +235,7 @@ def select_training_by_question(session: SessionDep, question: str, oid: int, da
 
     if settings.EMBEDDING_ENABLED:
         try:
-            model = EmbeddingModelCache.get_model()
-
-            embedding = model.embed_query(question)
+            embedding = embed_query(question)
 
             results = session.execute(text(embedding_sql),
                                       {'embedding_array': str(embedding), 'oid': oid, 'datasource': datasource})
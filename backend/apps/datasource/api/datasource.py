@@ -4,7 +4,7 @@ import os
 import traceback
 import uuid
 from io import StringIO
-from typing import List
+from typing import List, Optional
 
 import orjson
 import pandas as pd
@@ -12,6 +12,7 @@ from fastapi import APIRouter, File, UploadFile, HTTPException
 
 from apps.db.db import get_schema
 from apps.db.engine import get_engine_conn
+from apps.db.engine_pool import get_engine_pool_status
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
 from common.utils.utils import SQLBotLogUtil
@@ -20,6 +21,7 @@ from ..crud.datasource import get_datasource_list, check_status, create_ds, upda
     execSql, update_table_and_fields, getTablesByDs, chooseTables, preview, updateTable, updateField, get_ds, fieldEnum, \
     check_status_by_id
 from ..crud.field import get_fields_by_table_id
+from ..crud.sync_job import get_sync_job, get_latest_sync_job, cancel_sync_job
 from ..crud.table import get_tables_by_ds_id
 from ..models.datasource import CoreDatasource, CreateDatasource, TableObj, CoreTable, CoreField
 
@@ -60,6 +62,32 @@ async def check_by_id(session: SessionDep, trans: Trans, ds_id: int):
     return await asyncio.to_thread(inner)
 
 
+def _workspace_ds_ids(session: SessionDep, user: CurrentUser) -> Optional[set]:
+    """Ids of the datasources in the current workspace, None for a system admin who sees them all."""
+    if user.isAdmin:
+        return None
+    return {ds.id for ds in get_datasource_list(session, user)}
+
+
+def _check_workspace_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds_id: int):
+    ds_ids = _workspace_ds_ids(session, user)
+    if ds_ids is not None and ds_id not in ds_ids:
+        raise HTTPException(status_code=403, detail=trans('i18n_permission.no_permission', url='', msg=''))
+
+
+@router.get("/pool/status", include_in_schema=False)
+@require_space_admin
+async def pool_status(session: SessionDep, trans: Trans, user: CurrentUser, ds_id: int = None):
+    status = get_engine_pool_status(ds_id)
+    # a space admin only sees the pools of the datasources in the current workspace
+    ds_ids = _workspace_ds_ids(session, user)
+    if ds_ids is None:
+        return status
+    if ds_id is not None:
+        _check_workspace_ds(session, trans, user, ds_id)
+    return [item for item in status if item['ds_id'] in ds_ids]
+
+
 @router.post("/add", response_model=CoreDatasource)
 @require_space_admin
 async def add(session: SessionDep, trans: Trans, user: CurrentUser, ds: CreateDatasource):
@@ -70,11 +98,35 @@ async def add(session: SessionDep, trans: Trans, user: CurrentUser, ds: CreateDa
 
 
 @router.post("/chooseTables/{id}")
-async def choose_tables(session: SessionDep, trans: Trans, id: int, tables: List[CoreTable]):
+async def choose_tables(session: SessionDep, trans: Trans, user: CurrentUser, id: int, tables: List[CoreTable]):
     def inner():
-        chooseTables(session, trans, id, tables)
+        return chooseTables(session, trans, id, tables, user.id)
 
-    await asyncio.to_thread(inner)
+    return await asyncio.to_thread(inner)
+
+
+@router.get("/syncJob/{job_id}")
+async def sync_job_status(session: SessionDep, trans: Trans, user: CurrentUser, job_id: int):
+    job = get_sync_job(session, job_id)
+    if job is not None:
+        _check_workspace_ds(session, trans, user, job.ds_id)
+    return job
+
+
+@router.get("/syncJob/latest/{ds_id}")
+async def latest_sync_job(session: SessionDep, trans: Trans, user: CurrentUser, ds_id: int):
+    _check_workspace_ds(session, trans, user, ds_id)
+    return get_latest_sync_job(session, ds_id)
+
+
+@router.post("/syncJob/cancel/{job_id}")
+@require_space_admin
+async def cancel_sync(session: SessionDep, trans: Trans, user: CurrentUser, job_id: int):
+    job = get_sync_job(session, job_id)
+    if job is None:
+        return False
+    _check_workspace_ds(session, trans, user, job.ds_id)
+    return cancel_sync_job(session, job_id)
 
 
 @router.post("/update", response_model=CoreDatasource)
@@ -143,13 +195,14 @@ from pydantic import BaseModel
 
 class TestObj(BaseModel):
     sql: str = None
+    use_cache: bool = True
 
 
 # not used, just do test
 @router.post("/execSql/{id}")
 async def exec_sql(session: SessionDep, id: int, obj: TestObj):
     def inner():
-        data = execSql(session, id, obj.sql)
+        data = execSql(session, id, obj.sql, obj.use_cache)
         try:
             data_obj = data.get('data')
             # print(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode())
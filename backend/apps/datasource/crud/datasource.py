@@ -1,29 +1,40 @@
 import datetime
+import hashlib
 import json
+from functools import partial
 from typing import List, Optional
 
 from fastapi import HTTPException
-from sqlalchemy import and_, text
+from sqlalchemy import BigInteger, Text, all_, and_, any_, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.orm import defer
 # from sqlbot_xpack.permissions.models.ds_rules import DsRules
-from apps.permission_alt.models.permission_models import DsRules  
 from apps.permission_alt.crud.permission_crud import get_column_permission_fields, get_row_permission_filters, is_normal_user
+from apps.permission_alt.utils.permission_index import invalidate_permission_index
 from sqlmodel import select
 
 from apps.datasource.embedding.table_embedding import calc_table_embedding
+from apps.datasource.utils.schema_cache import get_catalog, get_fragment, invalidate_schema_cache
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB
-from apps.db.db import get_tables, get_fields, exec_sql, check_connection
+from apps.db.db import get_tables, get_fields, get_fields_by_tables, exec_sql, check_connection, \
+    invalidate_ds_connections
+from apps.db.result_cache import invalidate_ds_result_cache
 from apps.db.engine import get_engine_config, get_engine_conn
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
 from common.utils.embedding_threads import run_save_table_embeddings, run_save_ds_embeddings
 from common.utils.utils import deepcopy_ignore_extra
-from .table import get_tables_by_ds_id
+from .sync_job import submit_sync_job
+from .table import get_tables_by_ds_id, get_table_schema_text
 from ..crud.field import delete_field_by_ds_id, update_field
 from ..crud.table import delete_table_by_ds_id, update_table
 from ..models.datasource import CoreDatasource, CreateDatasource, CoreTable, CoreField, ColumnSchema, TableObj, \
     DatasourceConf, TableAndFields
 
+# rows per INSERT ... ON CONFLICT statement when syncing tables and fields
+SYNC_BATCH_SIZE = 500
+
 
 def get_datasource_list(session: SessionDep, user: CurrentUser, oid: Optional[int] = None) -> List[CoreDatasource]:
     current_oid = user.oid if user.oid is not None else 1
@@ -82,17 +93,15 @@ def create_ds(session: SessionDep, trans: Trans, user: CurrentUser, create_ds: C
     ds.id = record.id
     session.commit()
 
-    # save tables and fields
-    sync_table(session, ds, create_ds.tables)
-    updateNum(session, ds)
+    # save tables and fields in the background, progress is read from the latest sync job
+    submit_sync_job(session, ds.id, create_ds.tables, user.id)
     return ds
 
 
-def chooseTables(session: SessionDep, trans: Trans, id: int, tables: List[CoreTable]):
+def chooseTables(session: SessionDep, trans: Trans, id: int, tables: List[CoreTable], user_id: int = None):
     ds = session.query(CoreDatasource).filter(CoreDatasource.id == id).first()
     check_status(session, trans, ds, True)
-    sync_table(session, ds, tables)
-    updateNum(session, ds)
+    return submit_sync_job(session, ds.id, tables, user_id)
 
 
 def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreDatasource):
@@ -106,6 +115,8 @@ def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreData
         setattr(record, field, value)
     session.add(record)
     session.commit()
+    invalidate_ds_connections(ds.id)
+    invalidate_schema_cache(ds.id)
 
     run_save_ds_embeddings([ds.id])
     return ds
@@ -124,6 +135,8 @@ def delete_ds(session: SessionDep, id: int):
 
     session.delete(term)
     session.commit()
+    invalidate_ds_connections(id)
+    invalidate_schema_cache(id)
     delete_table_by_ds_id(session, id)
     delete_field_by_ds_id(session, id)
     return {
@@ -154,91 +167,107 @@ def getFieldsByDs(session: SessionDep, ds: CoreDatasource, table_name: str):
     return fields
 
 
-def execSql(session: SessionDep, id: int, sql: str):
+def execSql(session: SessionDep, id: int, sql: str, use_cache: bool = True):
     ds = session.exec(select(CoreDatasource).where(CoreDatasource.id == id)).first()
-    return exec_sql(ds, sql, True)
+    return exec_sql(ds, sql, True, use_cache=use_cache)
 
 
 def sync_table(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable]):
-    id_list = []
-    for item in tables:
-        statement = select(CoreTable).where(and_(CoreTable.ds_id == ds.id, CoreTable.table_name == item.table_name))
-        record = session.exec(statement).first()
-        # update exist table, only update table_comment
-        if record is not None:
-            item.id = record.id
-            id_list.append(record.id)
-
-            record.table_comment = item.table_comment
-            session.add(record)
-            session.commit()
-        else:
-            # save new table
-            table = CoreTable(ds_id=ds.id, checked=True, table_name=item.table_name, table_comment=item.table_comment,
-                              custom_comment=item.table_comment)
-            session.add(table)
-            session.flush()
-            session.refresh(table)
-            item.id = table.id
-            id_list.append(table.id)
-            session.commit()
-
-        # sync field
-        fields = getFieldsByDs(session, ds, item.table_name)
-        sync_fields(session, ds, item, fields)
-
-    if len(id_list) > 0:
-        session.query(CoreTable).filter(and_(CoreTable.ds_id == ds.id, CoreTable.id.not_in(id_list))).delete(
-            synchronize_session=False)
-        session.query(CoreField).filter(and_(CoreField.ds_id == ds.id, CoreField.table_id.not_in(id_list))).delete(
-            synchronize_session=False)
-        session.commit()
-    else:  # delete all tables and fields in this ds
-        session.query(CoreTable).filter(CoreTable.ds_id == ds.id).delete(synchronize_session=False)
-        session.query(CoreField).filter(CoreField.ds_id == ds.id).delete(synchronize_session=False)
-        session.commit()
+    sync_table_batch(session, ds, tables)
+    finish_sync_table(session, ds, [item.table_name for item in tables])
+
+
+def sync_table_batch(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable],
+                     fields_by_table: dict[str, List[ColumnSchema]] = None) -> List[int]:
+    if fields_by_table is None:
+        fields_by_table = get_fields_by_tables(ds, [item.table_name for item in tables]) if tables else {}
+    return save_tables_and_fields(session, ds, tables, fields_by_table)
+
+
+def finish_sync_table(session: SessionDep, ds: CoreDatasource, table_names: List[str]):
+    """Remove the tables no longer chosen and their fields, then refresh caches and embeddings."""
+    session.query(CoreTable).filter(
+        and_(CoreTable.ds_id == ds.id, CoreTable.table_name != all_(_array_param(table_names, Text)))).delete(
+        synchronize_session=False)
+    session.query(CoreField).filter(
+        and_(CoreField.ds_id == ds.id, CoreField.table_id.not_in(select(CoreTable.id).where(CoreTable.ds_id == ds.id)))
+    ).delete(synchronize_session=False)
+    session.commit()
+    id_list = session.exec(select(CoreTable.id).where(CoreTable.ds_id == ds.id)).all()
+
+    # tables re-synced, results cached before may come from a changed schema
+    invalidate_ds_result_cache(ds.id)
+    invalidate_schema_cache(ds.id)
+    invalidate_permission_index()
 
     # do table embedding
     run_save_table_embeddings(id_list)
     run_save_ds_embeddings([ds.id])
 
 
-def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, fields: List[ColumnSchema]):
+def _upsert(session: SessionDep, model, rows: List[dict], keys: List[str], update_columns: List[str],
+            returning: List[str]) -> list:
+    table = model.__table__
+    result = []
+    for start in range(0, len(rows), SYNC_BATCH_SIZE):
+        stmt = pg_insert(table).values(rows[start:start + SYNC_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(index_elements=keys,
+                                          set_={column: stmt.excluded[column] for column in update_columns})
+        result.extend(session.execute(stmt.returning(*[table.c[column] for column in returning])).all())
+    return result
+
+
+def _array_param(values: list, item_type=BigInteger):
+    # one array parameter instead of an IN list, large catalogs exceed the bind parameter limit
+    return bindparam(None, values, type_=ARRAY(item_type))
+
+
+def save_tables_and_fields(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable],
+                           fields_by_table: dict[str, List[ColumnSchema]]) -> List[int]:
+    """Upsert a batch of chosen tables and their fields in one transaction, fields no longer in these
+    tables are removed. Existing tables only update table_comment, existing fields keep checked
+    and custom_comment."""
+    tables = list({item.table_name: item for item in tables}.values())
+    table_rows = [{"ds_id": ds.id, "checked": True, "table_name": item.table_name,
+                   "table_comment": item.table_comment, "custom_comment": item.table_comment} for item in tables]
+    table_ids = {name: _id for _id, name in _upsert(session, CoreTable, table_rows, ["ds_id", "table_name"],
+                                                    ["table_comment"], ["id", "table_name"])}
     id_list = []
-    for index, item in enumerate(fields):
-        statement = select(CoreField).where(
-            and_(CoreField.table_id == table.id, CoreField.field_name == item.fieldName))
-        record = session.exec(statement).first()
-        if record is not None:
-            item.id = record.id
-            id_list.append(record.id)
-
-            record.field_comment = item.fieldComment
-            record.field_index = index
-            record.field_type = item.fieldType
-            session.add(record)
-            session.commit()
-        else:
-            field = CoreField(ds_id=ds.id, table_id=table.id, checked=True, field_name=item.fieldName,
-                              field_type=item.fieldType, field_comment=item.fieldComment,
-                              custom_comment=item.fieldComment, field_index=index)
-            session.add(field)
-            session.flush()
-            session.refresh(field)
-            item.id = field.id
-            id_list.append(field.id)
-            session.commit()
-
-    if len(id_list) > 0:
-        session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.id.not_in(id_list))).delete(
-            synchronize_session=False)
-        session.commit()
+    field_rows = []
+    # tables without fields in this sync keep the ones saved before
+    field_table_ids = []
+    for item in tables:
+        item.id = table_ids[item.table_name]
+        id_list.append(item.id)
+        fields = fields_by_table.get(item.table_name)
+        if not fields:
+            continue
+        field_table_ids.append(item.id)
+        names = set()
+        for index, field in enumerate(fields):
+            if field.fieldName in names:
+                continue
+            names.add(field.fieldName)
+            field_rows.append({"ds_id": ds.id, "table_id": item.id, "checked": True, "field_name": field.fieldName,
+                               "field_type": field.fieldType, "field_comment": field.fieldComment,
+                               "custom_comment": field.fieldComment, "field_index": index})
+    field_ids = [row[0] for row in _upsert(session, CoreField, field_rows, ["table_id", "field_name"],
+                                           ["field_comment", "field_index", "field_type"], ["id"])]
+
+    session.query(CoreField).filter(and_(CoreField.table_id == any_(_array_param(field_table_ids)),
+                                         CoreField.id != all_(_array_param(field_ids)))).delete(
+        synchronize_session=False)
+    session.commit()
+    # compiled row filters refer to the fields by id
+    invalidate_permission_index()
+    return id_list
 
 
 def update_table_and_fields(session: SessionDep, data: TableObj):
     update_table(session, data.table)
     for field in data.fields:
         update_field(session, field)
+    invalidate_schema_cache(data.table.ds_id, [data.table.id])
 
     # do table embedding
     run_save_table_embeddings([data.table.id])
@@ -247,6 +276,7 @@ def update_table_and_fields(session: SessionDep, data: TableObj):
 
 def updateTable(session: SessionDep, table: CoreTable):
     update_table(session, table)
+    invalidate_schema_cache(table.ds_id, [table.id])
 
     # do table embedding
     run_save_table_embeddings([table.id])
@@ -255,6 +285,7 @@ def updateTable(session: SessionDep, table: CoreTable):
 
 def updateField(session: SessionDep, field: CoreField):
     update_field(session, field)
+    invalidate_schema_cache(field.ds_id, [field.table_id])
 
     # do table embedding
     run_save_table_embeddings([field.table_id])
@@ -272,11 +303,8 @@ def preview(session: SessionDep, current_user: CurrentUser, id: int, data: Table
     f_list = [f for f in data.fields if f.checked]
     if is_normal_user(current_user):
         # column is checked, and, column permission for data.fields
-        contain_rules = session.query(DsRules).all()
-        # f_list = get_column_permission_fields(session=session, current_user=current_user, table=data.table,
-                                            #   fields=f_list) or f_list
         f_list = get_column_permission_fields(session=session, current_user=current_user, table=data.table,
-                                              fields=f_list, contain_rules=contain_rules)
+                                              fields=f_list)
 
         # row permission tree
         where_str = ''
@@ -362,38 +390,47 @@ def updateNum(session: SessionDep, ds: CoreDatasource):
     session.commit()
 
 
-def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> List[TableAndFields]:
-    _list: List = []
-    tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
-    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
-    schema = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
-
-    # get all field
+def _load_table_catalog(session: SessionDep, ds_id: int) -> tuple:
+    # vectors are ranked in the database, do not load them here
+    tables = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(CoreTable.ds_id == ds_id).all()
     table_ids = [table.id for table in tables]
     all_fields = session.query(CoreField).filter(
         and_(CoreField.table_id.in_(table_ids), CoreField.checked == True)).all()
-    # build dict
+    # detached copies, the catalog is shared by requests of other sessions
+    tables = [CoreTable(**table.model_dump()) for table in tables]
     fields_dict = {}
     for field in all_fields:
-        if fields_dict.get(field.table_id):
-            fields_dict.get(field.table_id).append(field)
-        else:
-            fields_dict[field.table_id] = [field]
+        fields_dict.setdefault(field.table_id, []).append(CoreField(**field.model_dump()))
+    return tables, fields_dict
+
+
+def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> List[TableAndFields]:
+    _list: List = []
+    tables, fields_dict = get_catalog(ds.id, lambda: _load_table_catalog(session, ds.id))
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if ds.type != "excel" else get_engine_config()
+    schema = conf.dbSchema if conf.dbSchema is not None and conf.dbSchema != "" else conf.database
 
-    contain_rules = session.query(DsRules).all()
     for table in tables:
-        # fields = session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.checked == True)).all()
         fields = fields_dict.get(table.id)
 
         # do column permissions, filter fields
-        # fields = get_column_permission_fields(session=session, current_user=current_user, table=table,
-                                            #   fields=fields) or fields
-        fields = get_column_permission_fields(session=session, current_user=current_user, table=table, fields=fields,
-                                              contain_rules=contain_rules)
+        fields = get_column_permission_fields(session=session, current_user=current_user, table=table, fields=fields)
         _list.append(TableAndFields(schema=schema, table=table, fields=fields))
     return _list
 
 
+def get_schema_version(session: SessionDep, ds: CoreDatasource) -> str:
+    """Hash of the tables and checked fields of a datasource, it changes with every edit that changes the schema prompt."""
+    tables, fields_dict = get_catalog(ds.id, lambda: _load_table_catalog(session, ds.id))
+    digest = hashlib.sha256()
+    for table in sorted(tables, key=lambda t: t.id):
+        digest.update(f'{table.id}\t{table.table_name}\t{table.table_comment}\t{table.custom_comment}\n'.encode())
+        for field in sorted(fields_dict.get(table.id) or [], key=lambda f: f.id):
+            digest.update(f'{field.id}\t{field.field_name}\t{field.field_type}\t{field.field_comment}\t'
+                          f'{field.custom_comment}\n'.encode())
+    return digest.hexdigest()
+
+
 def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
                      embedding: bool = True) -> str:
     schema_str = ""
@@ -405,36 +442,20 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
     tables = []
     all_tables = []  # temp save all tables
     for obj in table_objs:
-        schema_table = ''
-        schema_table += f"# Table: {db_name}.{obj.table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {obj.table.table_name}"
-        table_comment = ''
-        if obj.table.custom_comment:
-            table_comment = obj.table.custom_comment.strip()
-        if table_comment == '':
-            schema_table += '\n[\n'
-        else:
-            schema_table += f", {table_comment}\n[\n"
-
-        if obj.fields:
-            field_list = []
-            for field in obj.fields:
-                field_comment = ''
-                if field.custom_comment:
-                    field_comment = field.custom_comment.strip()
-                if field_comment == '':
-                    field_list.append(f"({field.field_name}:{field.field_type})")
-                else:
-                    field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-            schema_table += ",\n".join(field_list)
-        schema_table += '\n]\n'
-
-        t_obj = {"id": obj.table.id, "schema_table": schema_table, "embedding": obj.table.embedding}
+        table_name = f"{db_name}.{obj.table.table_name}" if ds.type != "mysql" and ds.type != "es" \
+            else obj.table.table_name
+        fields = obj.fields or []
+        # fragments are cached per visible field set, column permissions give users different sets
+        key = (obj.table.id, table_name, tuple(field.id for field in fields))
+        schema_table = get_fragment(ds.id, key, partial(get_table_schema_text, obj.table, fields, table_name=table_name))
+
+        t_obj = {"id": obj.table.id, "schema_table": schema_table}
         tables.append(t_obj)
         all_tables.append(t_obj)
 
     # do table embedding
     if embedding and tables and settings.TABLE_EMBEDDING_ENABLED:
-        tables = calc_table_embedding(tables, question)
+        tables = calc_table_embedding(session, ds.id, tables, question)
     # splice schema
     if tables:
         for s in tables:
@@ -458,7 +479,8 @@ def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDat
                 relation_table_ids.append(r.get('target').get('cell'))
             relation_table_ids = list(set(relation_table_ids))
             # get table dict
-            table_records = session.query(CoreTable).filter(CoreTable.id.in_(list(map(int, relation_table_ids)))).all()
+            table_records = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(
+                CoreTable.id.in_(list(map(int, relation_table_ids)))).all()
             table_dict = {}
             for ele in table_records:
                 table_dict[ele.id] = ele.table_name
@@ -0,0 +1,216 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, exists, update
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from apps.db.db import fields_reader
+from common.core.config import settings
+from common.core.db import engine
+from common.utils.utils import SQLBotLogUtil
+
+from ..models.datasource import CoreDatasource, CoreDsSyncJob, CoreTable
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCESS = 'success'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+_executor = ThreadPoolExecutor(max_workers=max(settings.DS_SYNC_WORKER_COUNT, 1), thread_name_prefix='ds-sync')
+# one job per datasource at a time in this process, the claim query covers other processes
+_ds_locks: dict[int, threading.Lock] = {}
+_ds_locks_lock = threading.Lock()
+_watchdog: Optional[threading.Thread] = None
+
+
+def _ds_lock(ds_id: int) -> threading.Lock:
+    with _ds_locks_lock:
+        return _ds_locks.setdefault(ds_id, threading.Lock())
+
+
+def submit_sync_job(session: Session, ds_id: int, tables: List[CoreTable], user_id: Optional[int] = None) \
+        -> CoreDsSyncJob:
+    """Save a sync job for the chosen tables of a datasource and run it in the background.
+    Jobs of the same datasource still waiting are replaced by the new one."""
+    now = datetime.now()
+    session.execute(update(CoreDsSyncJob).where(
+        and_(CoreDsSyncJob.ds_id == ds_id, CoreDsSyncJob.status == JOB_PENDING)).values(
+        status=JOB_CANCELLED, update_time=now))
+    chosen = list({item.table_name: item for item in tables}.values())
+    job = CoreDsSyncJob(ds_id=ds_id, status=JOB_PENDING,
+                        tables=[{'table_name': item.table_name, 'table_comment': item.table_comment} for item in chosen],
+                        tables_total=len(chosen), tables_done=0, create_by=user_id, create_time=now, update_time=now)
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    _executor.submit(_run_job, job.id, ds_id)
+    return job
+
+
+def get_sync_job(session: Session, job_id: int) -> Optional[CoreDsSyncJob]:
+    return session.get(CoreDsSyncJob, job_id)
+
+
+def get_latest_sync_job(session: Session, ds_id: int) -> Optional[CoreDsSyncJob]:
+    return session.exec(select(CoreDsSyncJob).where(CoreDsSyncJob.ds_id == ds_id)
+                        .order_by(CoreDsSyncJob.id.desc())).first()
+
+
+def cancel_sync_job(session: Session, job_id: int) -> bool:
+    """A running job stops before its next batch, tables saved by finished batches are kept."""
+    result = session.execute(update(CoreDsSyncJob).where(
+        and_(CoreDsSyncJob.id == job_id, CoreDsSyncJob.status.in_([JOB_PENDING, JOB_RUNNING]))).values(
+        status=JOB_CANCELLED, update_time=datetime.now()))
+    session.commit()
+    return result.rowcount > 0
+
+
+def _stale_time() -> datetime:
+    return datetime.now() - timedelta(seconds=settings.DS_SYNC_JOB_STALE)
+
+
+def _heartbeat_interval() -> float:
+    return max(settings.DS_SYNC_JOB_STALE / 3, 1)
+
+
+def resume_sync_jobs():
+    """Run the jobs left by a stopped process, then keep looking for them in the background:
+    a process restarted within DS_SYNC_JOB_STALE seconds still sees its old jobs as alive."""
+    global _watchdog
+    _take_over_stale_jobs(all_pending=True)
+    if _watchdog is None:
+        _watchdog = threading.Thread(target=_watch_stale_jobs, name='ds-sync-watchdog', daemon=True)
+        _watchdog.start()
+
+
+def _watch_stale_jobs():
+    while True:
+        time.sleep(_heartbeat_interval())
+        try:
+            _take_over_stale_jobs()
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Take over stale datasource sync jobs failed: {e}")
+
+
+def _take_over_stale_jobs(all_pending: bool = False):
+    """Running jobs without a heartbeat for DS_SYNC_JOB_STALE seconds are set back to pending and continue
+    after their last finished batch. Pending jobs of their datasources, or all of them, are started."""
+    with Session(engine) as session:
+        ds_ids = session.execute(update(CoreDsSyncJob).where(
+            and_(CoreDsSyncJob.status == JOB_RUNNING, CoreDsSyncJob.update_time < _stale_time())).values(
+            status=JOB_PENDING).returning(CoreDsSyncJob.ds_id)).scalars().all()
+        session.commit()
+        if not all_pending and not ds_ids:
+            return
+        statement = select(CoreDsSyncJob.id, CoreDsSyncJob.ds_id).where(CoreDsSyncJob.status == JOB_PENDING)
+        if not all_pending:
+            statement = statement.where(CoreDsSyncJob.ds_id.in_(list(set(ds_ids))))
+        jobs = session.exec(statement.order_by(CoreDsSyncJob.id)).all()
+    for job_id, ds_id in jobs:
+        _executor.submit(_run_job, job_id, ds_id)
+
+
+def _claim(session: Session, job_id: int, ds_id: int) -> bool:
+    # an older job still running without a heartbeat belongs to a stopped process, this job replaces it
+    session.execute(update(CoreDsSyncJob).where(
+        and_(CoreDsSyncJob.ds_id == ds_id, CoreDsSyncJob.id < job_id, CoreDsSyncJob.status == JOB_RUNNING,
+             CoreDsSyncJob.update_time < _stale_time())).values(
+        status=JOB_CANCELLED, error=f'no progress for {settings.DS_SYNC_JOB_STALE} seconds, replaced by job {job_id}',
+        update_time=datetime.now()))
+    running = aliased(CoreDsSyncJob)
+    result = session.execute(update(CoreDsSyncJob).where(
+        and_(CoreDsSyncJob.id == job_id, CoreDsSyncJob.status == JOB_PENDING,
+             ~exists().where(and_(running.ds_id == ds_id, running.status == JOB_RUNNING)))).values(
+        status=JOB_RUNNING, update_time=datetime.now()))
+    session.commit()
+    return result.rowcount > 0
+
+
+@contextmanager
+def _heartbeat(job_id: int):
+    """Touch update_time of the running job while a batch may take longer than DS_SYNC_JOB_STALE."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(_heartbeat_interval()):
+            try:
+                with Session(engine) as session:
+                    session.execute(update(CoreDsSyncJob).where(
+                        and_(CoreDsSyncJob.id == job_id, CoreDsSyncJob.status == JOB_RUNNING)).values(
+                        update_time=datetime.now()))
+                    session.commit()
+            except Exception as e:
+                SQLBotLogUtil.warning(f"Heartbeat of datasource sync job {job_id} failed: {e}")
+
+    thread = threading.Thread(target=beat, name=f'ds-sync-heartbeat-{job_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+def _is_cancelled(session: Session, job_id: int) -> bool:
+    return session.exec(select(CoreDsSyncJob.status).where(CoreDsSyncJob.id == job_id)).first() == JOB_CANCELLED
+
+
+def _finish(session: Session, job_id: int, status: str, error: str = None):
+    session.execute(update(CoreDsSyncJob).where(
+        and_(CoreDsSyncJob.id == job_id, CoreDsSyncJob.status == JOB_RUNNING)).values(
+        status=status, error=error, update_time=datetime.now()))
+    session.commit()
+
+
+def _run_job(job_id: int, ds_id: int):
+    with _ds_lock(ds_id):
+        with Session(engine) as session:
+            if not _claim(session, job_id, ds_id):
+                return
+            try:
+                with _heartbeat(job_id):
+                    _sync(session, job_id)
+            except Exception as e:
+                session.rollback()
+                SQLBotLogUtil.error(f"Datasource {ds_id} sync job {job_id} failed: {e}")
+                _finish(session, job_id, JOB_FAILED, str(e))
+            # a job of this datasource submitted by another process may wait for this one
+            waiting = session.exec(select(CoreDsSyncJob.id).where(
+                and_(CoreDsSyncJob.ds_id == ds_id, CoreDsSyncJob.status == JOB_PENDING))).all()
+    for next_id in waiting:
+        _executor.submit(_run_job, next_id, ds_id)
+
+
+def _sync(session: Session, job_id: int):
+    from .datasource import finish_sync_table, sync_table_batch, updateNum
+
+    job = session.get(CoreDsSyncJob, job_id)
+    ds = session.get(CoreDatasource, job.ds_id)
+    if ds is None:
+        _finish(session, job_id, JOB_FAILED, f'datasource {job.ds_id} not found')
+        return
+    tables = [CoreTable(**item) for item in job.tables or []]
+    size = max(settings.DS_SYNC_BATCH_TABLES, 1)
+    # fields are read batch by batch, after the cancel check; a catalog query is run once for all of them
+    read_fields = fields_reader(ds, [item.table_name for item in tables[job.tables_done:]])
+    # a resumed job continues after its last finished batch, upserts make a repeated batch harmless
+    for start in range(job.tables_done, len(tables), size):
+        if _is_cancelled(session, job_id):
+            SQLBotLogUtil.info(f"Datasource {ds.id} sync job {job_id} cancelled")
+            return
+        batch = tables[start:start + size]
+        sync_table_batch(session, ds, batch, read_fields([item.table_name for item in batch]))
+        session.execute(update(CoreDsSyncJob).where(CoreDsSyncJob.id == job_id).values(
+            tables_done=min(start + size, len(tables)), update_time=datetime.now()))
+        session.commit()
+
+    if _is_cancelled(session, job_id):
+        return
+    finish_sync_table(session, ds, [item.table_name for item in tables])
+    updateNum(session, ds)
+    _finish(session, job_id, JOB_SUCCESS)
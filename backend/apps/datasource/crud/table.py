@@ -1,11 +1,12 @@
-import json
 import time
 import traceback
 from typing import List
 
-from sqlalchemy import and_, select, update
+from sqlalchemy import select
+from sqlalchemy.orm import defer
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding_backfill import backfill_empty_embeddings, save_embeddings_in_batches
+from apps.datasource.embedding.vector_index import invalidate_ds_index, invalidate_table_index
 from common.core.config import settings
 from common.core.deps import SessionDep
 from common.utils.utils import SQLBotLogUtil
@@ -30,24 +31,77 @@ def update_table(session: SessionDep, item: CoreTable):
     session.commit()
 
 
+def get_table_schema_text(table: CoreTable, fields: List[CoreField], table_name: str = None) -> str:
+    schema_table = ''
+    schema_table += f"# Table: {table_name or table.table_name}"
+    table_comment = ''
+    if table.custom_comment:
+        table_comment = table.custom_comment.strip()
+    if table_comment == '':
+        schema_table += '\n[\n'
+    else:
+        schema_table += f", {table_comment}\n[\n"
+
+    if fields:
+        field_list = []
+        for field in fields:
+            field_comment = ''
+            if field.custom_comment:
+                field_comment = field.custom_comment.strip()
+            if field_comment == '':
+                field_list.append(f"({field.field_name}:{field.field_type})")
+            else:
+                field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
+        schema_table += ",\n".join(field_list)
+    schema_table += '\n]\n'
+    return schema_table
+
+
+def _fields_by_table(fields: List[CoreField]) -> dict[int, List[CoreField]]:
+    fields_dict = {}
+    for field in fields:
+        fields_dict.setdefault(field.table_id, []).append(field)
+    return fields_dict
+
+
+def load_table_texts(session, ids: List[int]) -> List[tuple[int, str]]:
+    # tables and their fields of a whole batch in two queries
+    tables = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(CoreTable.id.in_(ids)).all()
+    fields_dict = _fields_by_table(
+        session.query(CoreField).filter(CoreField.table_id.in_(ids)).order_by(CoreField.id).all())
+    return [(table.id, get_table_schema_text(table, fields_dict.get(table.id))) for table in tables]
+
+
+def load_ds_texts(session, ids: List[int]) -> List[tuple[int, str]]:
+    ds_list = session.query(CoreDatasource).options(defer(CoreDatasource.embedding)).filter(
+        CoreDatasource.id.in_(ids)).all()
+    tables = session.query(CoreTable).options(defer(CoreTable.embedding)).filter(CoreTable.ds_id.in_(ids)).order_by(
+        CoreTable.id).all()
+    fields_dict = _fields_by_table(
+        session.query(CoreField).filter(CoreField.ds_id.in_(ids)).order_by(CoreField.id).all())
+    tables_dict = {}
+    for table in tables:
+        tables_dict.setdefault(table.ds_id, []).append(table)
+
+    result = []
+    for ds in ds_list:
+        schema_table = f"{ds.name}, {ds.description}\n"
+        for table in tables_dict.get(ds.id, []):
+            schema_table += get_table_schema_text(table, fields_dict.get(table.id))
+        result.append((ds.id, schema_table))
+    return result
+
+
 def run_fill_empty_table_and_ds_embedding(session_maker):
     try:
         if not settings.TABLE_EMBEDDING_ENABLED:
             return
 
         session = session_maker()
-
-        SQLBotLogUtil.info('get tables')
-        stmt = select(CoreTable.id).where(and_(CoreTable.embedding.is_(None)))
-        results = session.execute(stmt).scalars().all()
-        SQLBotLogUtil.info('table result: ' + str(len(results)))
-        save_table_embedding(session_maker, results)
-
-        SQLBotLogUtil.info('get datasource')
-        ds_stmt = select(CoreDatasource.id).where(and_(CoreDatasource.embedding.is_(None)))
-        ds_results = session.execute(ds_stmt).scalars().all()
-        SQLBotLogUtil.info('datasource result: ' + str(len(ds_results)))
-        save_ds_embedding(session_maker, ds_results)
+        backfill_empty_embeddings(session, 'table', CoreTable, load_table_texts)
+        invalidate_table_index()
+        backfill_empty_embeddings(session, 'datasource', CoreDatasource, load_ds_texts)
+        invalidate_ds_index()
     except Exception:
         traceback.print_exc()
     finally:
@@ -63,41 +117,10 @@ def save_table_embedding(session_maker, ids: List[int]):
     try:
         SQLBotLogUtil.info('start table embedding')
         start_time = time.time()
-        model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            table = session.query(CoreTable).filter(CoreTable.id == _id).first()
-            fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-            schema_table = ''
-            schema_table += f"# Table: {table.table_name}"
-            table_comment = ''
-            if table.custom_comment:
-                table_comment = table.custom_comment.strip()
-            if table_comment == '':
-                schema_table += '\n[\n'
-            else:
-                schema_table += f", {table_comment}\n[\n"
-
-            if fields:
-                field_list = []
-                for field in fields:
-                    field_comment = ''
-                    if field.custom_comment:
-                        field_comment = field.custom_comment.strip()
-                    if field_comment == '':
-                        field_list.append(f"({field.field_name}:{field.field_type})")
-                    else:
-                        field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                schema_table += ",\n".join(field_list)
-            schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreTable).where(and_(CoreTable.id == _id)).values(embedding=emb)
-            session.execute(stmt)
-            session.commit()
-
+        save_embeddings_in_batches(session, CoreTable, ids, load_table_texts)
+        invalidate_table_index(session.execute(select(CoreTable.ds_id).where(CoreTable.id.in_(ids)).distinct())
+                               .scalars().all())
         end_time = time.time()
         SQLBotLogUtil.info('table embedding finished in: ' + str(end_time - start_time) + ' seconds')
     except Exception:
@@ -115,44 +138,9 @@ def save_ds_embedding(session_maker, ids: List[int]):
     try:
         SQLBotLogUtil.info('start datasource embedding')
         start_time = time.time()
-        model = EmbeddingModelCache.get_model()
         session = session_maker()
-        for _id in ids:
-            schema_table = ''
-            ds = session.query(CoreDatasource).filter(CoreDatasource.id == _id).first()
-            schema_table += f"{ds.name}, {ds.description}\n"
-            tables = session.query(CoreTable).filter(CoreTable.ds_id == ds.id).all()
-            for table in tables:
-                fields = session.query(CoreField).filter(CoreField.table_id == table.id).all()
-
-                schema_table += f"# Table: {table.table_name}"
-                table_comment = ''
-                if table.custom_comment:
-                    table_comment = table.custom_comment.strip()
-                if table_comment == '':
-                    schema_table += '\n[\n'
-                else:
-                    schema_table += f", {table_comment}\n[\n"
-
-                if fields:
-                    field_list = []
-                    for field in fields:
-                        field_comment = ''
-                        if field.custom_comment:
-                            field_comment = field.custom_comment.strip()
-                        if field_comment == '':
-                            field_list.append(f"({field.field_name}:{field.field_type})")
-                        else:
-                            field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-                    schema_table += ",\n".join(field_list)
-                schema_table += '\n]\n'
-            # table_schema.append(schema_table)
-            emb = json.dumps(model.embed_query(schema_table))
-
-            stmt = update(CoreDatasource).where(and_(CoreDatasource.id == _id)).values(embedding=emb)
-            session.execute(stmt)
-            session.commit()
-
+        save_embeddings_in_batches(session, CoreDatasource, ids, load_ds_texts)
+        invalidate_ds_index()
         end_time = time.time()
         SQLBotLogUtil.info('datasource embedding finished in: ' + str(end_time - start_time) + ' seconds')
     except Exception:
@@ -5,8 +5,12 @@ import time
 import traceback
 from typing import Optional
 
-from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
+from sqlalchemy import text
+from sqlalchemy.orm import defer
+from sqlmodel import select
+
+from apps.ai_model.embedding import EmbeddingModelCache, embed_query
+from apps.datasource.embedding.vector_index import VectorIndex, get_ds_index
 from apps.datasource.models.datasource import CoreDatasource
 from apps.system.crud.assistant import AssistantOutDs
 from common.core.config import settings
@@ -15,6 +19,15 @@ from common.core.deps import SessionDep, CurrentUser
 from common.utils.utils import SQLBotLogUtil
 
 
+ds_embedding_sql = """
+SELECT id, ( 1 - (embedding <=> :embedding_array) ) AS similarity
+FROM core_datasource
+WHERE embedding IS NOT NULL AND id = ANY(:ids)
+ORDER BY embedding <=> :embedding_array
+LIMIT :top_count
+"""
+
+
 def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, out_ds: AssistantOutDs,
                      question: str,
                      current_assistant: Optional[CurrentAssistant] = None):
@@ -30,19 +43,17 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
 
         if _list:
             try:
-                text = [s.get('ds_schema') for s in _list]
+                texts = [s.get('ds_schema') for s in _list]
 
                 model = EmbeddingModelCache.get_model()
-                results = model.embed_documents(text)
+                results = model.embed_documents(texts)
 
-                q_embedding = model.embed_query(question)
-                for index in range(len(results)):
-                    item = results[index]
-                    _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
-
-                _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-                # print(len(_list))
-                _list = _list[:settings.DS_EMBEDDING_COUNT]
+                q_embedding = embed_query(question)
+                ranked = VectorIndex(list(range(len(results))), results).top_k(q_embedding,
+                                                                               settings.DS_EMBEDDING_COUNT)
+                for index, similarity in ranked:
+                    _list[index]['cosine_similarity'] = similarity
+                _list = [_list[index] for index, _ in ranked]
                 SQLBotLogUtil.info(json.dumps(
                     [{"id": ele.get("id"), "name": ele.get("ds").name,
                       "cosine_similarity": ele.get("cosine_similarity")}
@@ -52,28 +63,31 @@ def get_ds_embedding(session: SessionDep, current_user: CurrentUser, _ds_list, o
             except Exception:
                 traceback.print_exc()
     else:
-        for _ds in _ds_list:
-            if _ds.get('id'):
-                ds = session.get(CoreDatasource, _ds.get('id'))
-                # table_schema = get_table_schema(session, current_user, ds, question, embedding=False)
-                # ds_info = f"{ds.name}, {ds.description}\n"
-                # ds_schema = ds_info + table_schema
-                _list.append({"id": ds.id, "cosine_similarity": 0.0, "ds": ds, "embedding": ds.embedding})
+        ds_ids = [_ds.get('id') for _ds in _ds_list if _ds.get('id')]
+        if ds_ids:
+            records = session.exec(select(CoreDatasource).options(defer(CoreDatasource.embedding)).where(
+                CoreDatasource.id.in_(ds_ids))).all()
+            ds_dict = {ds.id: ds for ds in records}
+            for _id in ds_ids:
+                ds = ds_dict.get(_id)
+                if ds:
+                    _list.append({"id": ds.id, "cosine_similarity": 0.0, "ds": ds})
 
         if _list:
             try:
-                # text = [s.get('ds_schema') for s in _list]
-
-                model = EmbeddingModelCache.get_model()
                 start_time = time.time()
-                # results = model.embed_documents(text)
-                results = [item.get('embedding') for item in _list]
-
-                q_embedding = model.embed_query(question)
-                for index in range(len(results)):
-                    item = results[index]
-                    if item:
-                        _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
+                embedding = embed_query(question)
+                ids = [item.get('id') for item in _list]
+                index = get_ds_index(session)
+                if index is not None:
+                    similarities = dict(index.top_k(embedding, settings.DS_EMBEDDING_COUNT, ids))
+                else:
+                    results = session.execute(text(ds_embedding_sql),
+                                              {'embedding_array': str(embedding), 'ids': ids,
+                                               'top_count': settings.DS_EMBEDDING_COUNT}).fetchall()
+                    similarities = {row.id: row.similarity for row in results}
+                for item in _list:
+                    item['cosine_similarity'] = similarities.get(item.get('id'), 0.0)
 
                 _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
                 # print(len(_list))
@@ -4,8 +4,10 @@ import json
 import time
 import traceback
 
-from apps.ai_model.embedding import EmbeddingModelCache
-from apps.datasource.embedding.utils import cosine_similarity
+from sqlalchemy import text
+
+from apps.ai_model.embedding import EmbeddingModelCache, embed_query
+from apps.datasource.embedding.vector_index import VectorIndex, get_table_index
 from common.core.config import settings
 from common.utils.utils import SQLBotLogUtil
 
@@ -25,13 +27,12 @@ def get_table_embedding(tables: list[dict], question: str):
             end_time = time.time()
             SQLBotLogUtil.info(str(end_time - start_time))
 
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
-
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
+            q_embedding = embed_query(question)
+            ranked = VectorIndex(list(range(len(results))), results).top_k(q_embedding,
+                                                                           settings.TABLE_EMBEDDING_COUNT)
+            for index, similarity in ranked:
+                _list[index]['cosine_similarity'] = similarity
+            _list = [_list[index] for index, _ in ranked]
             # print(len(_list))
             SQLBotLogUtil.info(json.dumps(_list))
             return _list
@@ -40,33 +41,43 @@ def get_table_embedding(tables: list[dict], question: str):
     return _list
 
 
-def calc_table_embedding(tables: list[dict], question: str):
+# candidates are the tables visible to the current user, ordered by the hnsw cosine index;
+# for datasources too large for the in-memory index
+table_embedding_sql = """
+SELECT id, ( 1 - (embedding <=> :embedding_array) ) AS similarity
+FROM core_table
+WHERE ds_id = :ds_id AND embedding IS NOT NULL AND id = ANY(:ids)
+ORDER BY embedding <=> :embedding_array
+LIMIT :top_count
+"""
+
+
+def calc_table_embedding(session, ds_id: int, tables: list[dict], question: str):
     _list = []
     for table in tables:
-        _list.append(
-            {"id": table.get('id'), "schema_table": table.get('schema_table'), "embedding": table.get('embedding'),
-             "cosine_similarity": 0.0})
+        _list.append({"id": table.get('id'), "schema_table": table.get('schema_table'), "cosine_similarity": 0.0})
 
     if _list:
         try:
-            # text = [s.get('schema_table') for s in _list]
-            #
-            model = EmbeddingModelCache.get_model()
             start_time = time.time()
-            # results = model.embed_documents(text)
-            # end_time = time.time()
-            # SQLBotLogUtil.info(str(end_time - start_time))
-            results = [item.get('embedding') for item in _list]
+            embedding = embed_query(question)
+            ids = [item.get('id') for item in _list]
+            index = get_table_index(session, ds_id)
+            if index is not None:
+                similarities = dict(index.top_k(embedding, settings.TABLE_EMBEDDING_COUNT, ids))
+            else:
+                results = session.execute(text(table_embedding_sql),
+                                          {'embedding_array': str(embedding), 'ds_id': ds_id, 'ids': ids,
+                                           'top_count': settings.TABLE_EMBEDDING_COUNT}).fetchall()
+                similarities = {row.id: row.similarity for row in results}
+            for item in _list:
+                item['cosine_similarity'] = similarities.get(item.get('id'), 0.0)
 
-            q_embedding = model.embed_query(question)
-            for index in range(len(results)):
-                item = results[index]
-                if item:
-                    _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, json.loads(item))
-
-            _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
-            # print(len(_list))
+            # tables without embedding come after the ranked ones
+            ranked_list = [item for item in _list if item.get('id') in similarities]
+            ranked_list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
+            _list = (ranked_list + [item for item in _list if item.get('id') not in similarities])[
+                    :settings.TABLE_EMBEDDING_COUNT]
             end_time = time.time()
             SQLBotLogUtil.info(str(end_time - start_time))
             SQLBotLogUtil.info(json.dumps([{"id": ele.get('id'), "schema_table": ele.get('schema_table'),
@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+
+from apps.datasource.models.datasource import CoreDatasource, CoreTable
+from common.core.config import settings
+
+
+class VectorIndex:
+    """Normalized float32 matrix of embeddings, one row per id."""
+
+    def __init__(self, ids: list, vectors: list):
+        self.ids = list(ids)
+        self.positions = {_id: index for index, _id in enumerate(self.ids)}
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(self.ids), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def from_rows(items: Iterable[tuple]) -> 'VectorIndex':
+        """Build from (id, embedding) rows of a vector column, empty ones are skipped."""
+        ids, vectors = [], []
+        for _id, embedding in items:
+            if embedding is not None and len(embedding):
+                ids.append(_id)
+                vectors.append(embedding)
+        return VectorIndex(ids, vectors)
+
+    def top_k(self, query: list[float], k: int, ids: Optional[list] = None) -> list[tuple]:
+        """The k most similar (id, similarity) pairs, best first."""
+        if not self.ids or k <= 0:
+            return []
+        if ids is None:
+            rows = np.arange(len(self.ids))
+        else:
+            rows = np.fromiter((self.positions[i] for i in ids if i in self.positions), dtype=np.int64)
+            if len(rows) == 0:
+                return []
+        scores = self.matrix[rows] @ _normalize(query)
+        if k < len(scores):
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.ids[rows[i]], float(scores[i])) for i in best.tolist()]
+
+
+def _normalize(query: list[float]) -> np.ndarray:
+    vector = np.asarray(query, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# stored vectors of a datasource's tables, and of all datasources, ranked exactly in memory;
+# None for an index over EMBEDDING_INDEX_MAX_ROWS, those are ranked by the hnsw index in the database
+_indexes: dict[tuple[str, int], tuple[float, Optional[VectorIndex]]] = {}
+_lock = threading.Lock()
+# bumped on every invalidation, an index loaded meanwhile may be stale and is not kept
+_generation = 0
+
+
+def _get_index(key: tuple[str, int], count: Callable[[], int], load: Callable[[], Iterable[tuple]]) \
+        -> Optional[VectorIndex]:
+    now = time.monotonic()
+    with _lock:
+        entry = _indexes.get(key)
+        generation = _generation
+    # writes in other worker processes are only seen after the ttl
+    if entry is not None and now - entry[0] < settings.EMBEDDING_INDEX_TTL:
+        return entry[1]
+    index = VectorIndex.from_rows(load()) if count() <= settings.EMBEDDING_INDEX_MAX_ROWS else None
+    with _lock:
+        if generation == _generation:
+            _indexes[key] = (now, index)
+    return index
+
+
+def get_table_index(session, ds_id: int) -> Optional[VectorIndex]:
+    where = (CoreTable.ds_id == ds_id, CoreTable.embedding.isnot(None))
+    return _get_index(('table', ds_id),
+                      lambda: session.execute(select(func.count()).select_from(CoreTable).where(*where)).scalar(),
+                      lambda: session.execute(select(CoreTable.id, CoreTable.embedding).where(*where)).all())
+
+
+def get_ds_index(session) -> Optional[VectorIndex]:
+    # datasources are few, one index holds all of them
+    where = (CoreDatasource.embedding.isnot(None),)
+    return _get_index(('ds', 0),
+                      lambda: session.execute(
+                          select(func.count()).select_from(CoreDatasource).where(*where)).scalar(),
+                      lambda: session.execute(select(CoreDatasource.id, CoreDatasource.embedding).where(*where)).all())
+
+
+def invalidate_table_index(ds_ids: Optional[Iterable[int]] = None):
+    """Drop the table indexes of the datasources, of all datasources when ds_ids is None."""
+    global _generation
+    with _lock:
+        _generation += 1
+        if ds_ids is None:
+            for key in [key for key in _indexes if key[0] == 'table']:
+                del _indexes[key]
+        else:
+            for ds_id in ds_ids:
+                _indexes.pop(('table', ds_id), None)
+
+
+def invalidate_ds_index():
+    global _generation
+    with _lock:
+        _generation += 1
+        _indexes.pop(('ds', 0), None)
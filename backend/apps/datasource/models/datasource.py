@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 
+from pgvector.sqlalchemy import VECTOR
 from pydantic import BaseModel
 from sqlalchemy import Column, Text, BigInteger, DateTime, Identity
 from sqlalchemy.dialects.postgresql import JSONB
@@ -21,7 +22,7 @@ class CoreDatasource(SQLModel, table=True):
     num: str = Field(max_length=256, nullable=True)
     oid: int = Field(sa_column=Column(BigInteger()))
     table_relation: List = Field(sa_column=Column(JSONB, nullable=True))
-    embedding: str = Field(sa_column=Column(Text, nullable=True))
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=True), exclude=True)
 
 
 class CoreTable(SQLModel, table=True):
@@ -32,7 +33,7 @@ class CoreTable(SQLModel, table=True):
     table_name: str = Field(sa_column=Column(Text))
     table_comment: str = Field(sa_column=Column(Text))
     custom_comment: str = Field(sa_column=Column(Text))
-    embedding: str = Field(sa_column=Column(Text, nullable=True))
+    embedding: Optional[List[float]] = Field(sa_column=Column(VECTOR(), nullable=True), exclude=True)
 
 
 class CoreField(SQLModel, table=True):
@@ -48,6 +49,21 @@ class CoreField(SQLModel, table=True):
     field_index: int = Field(sa_column=Column(BigInteger()))
 
 
+class CoreDsSyncJob(SQLModel, table=True):
+    __tablename__ = "core_ds_sync_job"
+    id: int = Field(sa_column=Column(BigInteger, Identity(always=True), nullable=False, primary_key=True))
+    ds_id: int = Field(sa_column=Column(BigInteger()))
+    status: str = Field(max_length=32)
+    # chosen tables: [{"table_name": ..., "table_comment": ...}]
+    tables: List = Field(sa_column=Column(JSONB, nullable=True), exclude=True)
+    tables_total: int = Field(default=0)
+    tables_done: int = Field(default=0)
+    error: Optional[str] = Field(sa_column=Column(Text, nullable=True))
+    create_by: Optional[int] = Field(sa_column=Column(BigInteger(), nullable=True))
+    create_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+    update_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+
+
 # datasource create obj
 class CreateDatasource(BaseModel):
     id: int = None
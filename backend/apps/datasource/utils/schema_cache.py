@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from common.core.config import settings
+
+
+class _DsSchemaCache:
+    def __init__(self):
+        # (tables, {table_id: fields}) of checked fields, detached copies shared by all requests
+        self.catalog = None
+        self.loaded_at = 0.0
+        # (table_id, table name in prompt, field ids) -> formatted '# Table:' fragment
+        self.fragments: dict[tuple, str] = {}
+        self.generation = 0
+
+
+_caches: dict[int, _DsSchemaCache] = {}
+_lock = threading.Lock()
+
+
+def _get_cache(ds_id: int) -> _DsSchemaCache:
+    cache = _caches.get(ds_id)
+    if cache is None:
+        cache = _caches.setdefault(ds_id, _DsSchemaCache())
+    return cache
+
+
+def get_catalog(ds_id: int, loader: Callable[[], tuple]) -> tuple:
+    """Tables and checked fields of a datasource, loaded once and reused until invalidated
+    (or SCHEMA_CACHE_TTL passed, for changes made in another worker process)."""
+    now = time.monotonic()
+    with _lock:
+        cache = _get_cache(ds_id)
+        if cache.catalog is not None and now - cache.loaded_at < settings.SCHEMA_CACHE_TTL:
+            return cache.catalog
+        generation = cache.generation
+    catalog = loader()
+    with _lock:
+        cache = _get_cache(ds_id)
+        if cache.generation == generation:
+            if cache.catalog is not None:
+                # reloaded after the ttl, fragments may be outdated as well
+                cache.fragments.clear()
+            cache.catalog = catalog
+            cache.loaded_at = now
+    return catalog
+
+
+def get_fragment(ds_id: int, key: tuple, builder: Callable[[], str]) -> str:
+    with _lock:
+        cache = _get_cache(ds_id)
+        fragment = cache.fragments.get(key)
+        generation = cache.generation
+    if fragment is None:
+        fragment = builder()
+        with _lock:
+            cache = _get_cache(ds_id)
+            if cache.generation == generation:
+                cache.fragments[key] = fragment
+    return fragment
+
+
+def invalidate_schema_cache(ds_id: int, table_ids: Optional[Iterable[int]] = None):
+    """Drop the catalog of a datasource, and the fragments of table_ids (all fragments when not given)."""
+    with _lock:
+        cache = _caches.get(ds_id)
+        if cache is None:
+            return
+        # loads started before this call are not stored
+        cache.generation += 1
+        cache.catalog = None
+        if table_ids is None:
+            cache.fragments.clear()
+            return
+        table_ids = set(table_ids)
+        for key in [key for key in cache.fragments if key[0] in table_ids]:
+            del cache.fragments[key]
@@ -2,14 +2,14 @@ import base64
 import json
 import platform
 import urllib.parse
-from decimal import Decimal
-from typing import Optional
+import uuid
+from typing import Callable, Dict, List, Optional
 
 import oracledb
 import psycopg2
 import pymssql
 
-from apps.db.db_sql import get_table_sql, get_field_sql, get_version_sql
+from apps.db.db_sql import get_table_sql, get_field_sql, get_all_fields_sql, get_version_sql
 from common.error import ParseSQLResultError
 
 if platform.system() != "Darwin":
@@ -26,12 +26,18 @@ from apps.datasource.models.datasource import DatasourceConf, CoreDatasource, Ta
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB, ConnectType
 from apps.db.engine import get_engine_config
+from apps.db.driver_pool import DriverConnectionPool
+from apps.db.introspection import fetch_concurrently
+from apps.db.engine_pool import get_cached_engine, get_pool_args, get_pool_key, dispose_ds_engines
+from apps.db.result_cache import cached_exec, invalidate_ds_result_cache
+from apps.db.result_set import normalize_rows
+from apps.db.sql_limit import limit_sql
 from apps.system.crud.assistant import get_ds_engine
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from common.core.deps import Trans
 from common.utils.utils import SQLBotLogUtil, equals_ignore_case
 from fastapi import HTTPException
-from apps.db.es_engine import get_es_connect, get_es_index, get_es_fields, get_es_data_by_http
+from apps.db.es_engine import get_es_connect, get_es_index, get_es_fields, get_es_fields_by_indices, EsSqlCursor
 from common.core.config import settings
 
 try:
@@ -115,32 +121,74 @@ def get_origin_connect(type: str, conf: DatasourceConf):
         )
 
 
+def get_py_driver_connect(type: str, conf: DatasourceConf, connect_timeout: int = 0):
+    """Query timeouts come from conf, the connection may be pooled and reused by any query."""
+    connect_timeout = connect_timeout if connect_timeout > 0 else conf.timeout
+    extra_config_dict = get_extra_config(conf)
+    if equals_ignore_case(type, 'dm'):
+        return dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
+                                port=conf.port, **extra_config_dict)
+    elif equals_ignore_case(type, 'doris', 'starrocks'):
+        return pymysql.connect(**{'user': conf.username, 'passwd': conf.password, 'host': conf.host,
+                                  'port': conf.port, 'db': conf.database, 'connect_timeout': connect_timeout,
+                                  'read_timeout': conf.timeout, **extra_config_dict})
+    elif equals_ignore_case(type, 'redshift'):
+        # one socket timeout for connecting and reading
+        return redshift_connector.connect(**{'host': conf.host, 'port': conf.port, 'database': conf.database,
+                                             'user': conf.username, 'password': conf.password,
+                                             'timeout': conf.timeout, **extra_config_dict})
+    elif equals_ignore_case(type, 'kingbase'):
+        return psycopg2.connect(**{'host': conf.host, 'port': conf.port, 'database': conf.database,
+                                   'user': conf.username, 'password': conf.password,
+                                   'connect_timeout': connect_timeout,
+                                   'options': f"-c statement_timeout={conf.timeout * 1000}", **extra_config_dict})
+    raise Exception(f'The datasource type {type} is not a py_driver datasource.')
+
+
+def get_py_driver_conn(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf, timeout: int = 0):
+    """Borrow a pooled connection, use it as `with get_py_driver_conn(ds, conf) as conn`.
+    timeout bounds this call only: the wait for a free connection and the connect of a new one."""
+    timeout = timeout if timeout > 0 else conf.timeout
+    key = get_pool_key(ds.id, ConnectType.py_driver.name, ds.type, json.dumps(conf.to_dict(), sort_keys=True))
+    # connections of an unsaved datasource are closed after use
+    pool = get_cached_engine(ds.id, key,
+                             lambda: DriverConnectionPool(ds.id,
+                                                          lambda t: get_py_driver_connect(ds.type, conf, t),
+                                                          max_idle=None if key else 0))
+    return pool.connection(timeout)
+
+
 # use sqlalchemy
-def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
+def get_engine(ds: CoreDatasource) -> Engine:
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
                                                                                                  "excel") else get_engine_config()
     if conf.timeout is None:
-        conf.timeout = timeout
-    if timeout > 0:
-        conf.timeout = timeout
+        conf.timeout = 0
+    # one engine per configuration, the timeouts are part of it
+    key = get_pool_key(ds.id, ds.type, ds.configuration)
+    return get_cached_engine(ds.id, key, lambda: _create_engine(ds, conf))
+
+
+def _create_engine(ds: CoreDatasource, conf: DatasourceConf) -> Engine:
+    pool_args = get_pool_args(conf.timeout)
     if equals_ignore_case(ds.type, "pg"):
         if conf.dbSchema is not None and conf.dbSchema != "":
             engine = create_engine(get_uri(ds),
                                    connect_args={"options": f"-c search_path={urllib.parse.quote(conf.dbSchema)}",
                                                  "connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   **pool_args)
         else:
             engine = create_engine(get_uri(ds),
                                    connect_args={"connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   **pool_args)
     elif equals_ignore_case(ds.type, 'sqlServer'):
         engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(ds.type, conf),
-                               pool_timeout=conf.timeout)
+                               **pool_args)
     elif equals_ignore_case(ds.type, 'oracle'):
         engine = create_engine(get_uri(ds),
-                               pool_timeout=conf.timeout)
+                               **pool_args)
     else:  # mysql, ck
-        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout)
+        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, **pool_args)
     return engine
 
 
@@ -151,11 +199,17 @@ def get_session(ds: CoreDatasource | AssistantOutDsSchema):
     return session
 
 
+def invalidate_ds_connections(ds_id: int):
+    # configuration changed or datasource removed, pooled connections are no longer valid
+    dispose_ds_engines(ds_id)
+    invalidate_ds_result_cache(ds_id)
+
+
 def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDsSchema, is_raise: bool = False):
     if isinstance(ds, CoreDatasource):
         db = DB.get_db(ds.type)
         if db.connect_type == ConnectType.sqlalchemy:
-            conn = get_engine(ds, 10)
+            conn = get_engine(ds)
             try:
                 with conn.connect() as connection:
                     SQLBotLogUtil.info("success")
@@ -167,10 +221,8 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                 return False
         else:
             conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-            extra_config_dict = get_extra_config(conf)
             if equals_ignore_case(ds.type, 'dm'):
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_py_driver_conn(ds, conf, 10) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1', timeout=10).fetchall()
                         SQLBotLogUtil.info("success")
@@ -181,9 +233,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                         return False
             elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_py_driver_conn(ds, conf, 10) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1')
                         SQLBotLogUtil.info("success")
@@ -194,10 +244,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                         return False
             elif equals_ignore_case(ds.type, 'redshift'):
-                with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
-                                                user=conf.username,
-                                                password=conf.password,
-                                                timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_py_driver_conn(ds, conf, 10) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1')
                         SQLBotLogUtil.info("success")
@@ -208,10 +255,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                         return False
             elif equals_ignore_case(ds.type, 'kingbase'):
-                with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
-                                      user=conf.username,
-                                      password=conf.password,
-                                      connect_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_py_driver_conn(ds, conf, 10) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1')
                         SQLBotLogUtil.info("success")
@@ -269,17 +313,13 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
                     res = result.fetchall()
                     version = res[0][0]
         else:
-            extra_config_dict = get_extra_config(conf)
             if equals_ignore_case(ds.type, 'dm'):
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql, timeout=10, **extra_config_dict)
+                with get_py_driver_conn(ds, conf, 10) as conn, conn.cursor() as cursor:
+                    cursor.execute(sql, timeout=10)
                     res = cursor.fetchall()
                     version = res[0][0]
             elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_py_driver_conn(ds, conf, 10) as conn, conn.cursor() as cursor:
                     cursor.execute(sql)
                     res = cursor.fetchall()
                     version = res[0][0]
@@ -308,27 +348,20 @@ def get_schema(ds: CoreDatasource):
                 res_list = [item[0] for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""select OBJECT_NAME from dba_objects where object_type='SCH'""", timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
@@ -347,35 +380,26 @@ def get_tables(ds: CoreDatasource):
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param": sql_param}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql.format(sql_param))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
@@ -389,165 +413,206 @@ def get_tables(ds: CoreDatasource):
 def get_fields(ds: CoreDatasource, table_name: str = None):
     conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
                                                                                                  "excel") else get_engine_config()
-    db = DB.get_db(ds.type)
+    if equals_ignore_case(ds.type, 'es'):
+        res = get_es_fields(conf, table_name)
+        return [ColumnSchema(*item) for item in res]
     sql, p1, p2 = get_field_sql(ds, conf, table_name)
+    return [ColumnSchema(*item) for item in _fetch_field_rows(ds, conf, sql, p1, p2)]
+
+
+def get_fields_by_tables(ds: CoreDatasource, table_names: List[str]) -> Dict[str, List[ColumnSchema]]:
+    """Fields of many tables: one catalog query where the type has one, a single _mapping request
+    for Elasticsearch, otherwise table by table on a few threads."""
+    return fields_reader(ds, table_names)(table_names)
+
+
+def fields_reader(ds: CoreDatasource, table_names: List[str]) \
+        -> Callable[[List[str]], Dict[str, List[ColumnSchema]]]:
+    """Read the fields of table_names a part at a time, e.g. batch by batch.
+    The catalog query covers the whole schema, it runs on the first call and later calls reuse its rows."""
+    conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration))) if not equals_ignore_case(ds.type,
+                                                                                                 "excel") else get_engine_config()
+    if equals_ignore_case(ds.type, 'es'):
+        def read_es(names: List[str]) -> Dict[str, List[ColumnSchema]]:
+            res = get_es_fields_by_indices(conf, names)
+            return {name: [ColumnSchema(*item) for item in items] for name, items in res.items()}
+
+        return read_es
+
+    sql, p1 = get_all_fields_sql(ds, conf)
+    wanted = set(table_names)
+    catalog: Optional[Dict[str, List[ColumnSchema]]] = None
+    failed = not sql
+
+    def read(names: List[str]) -> Dict[str, List[ColumnSchema]]:
+        nonlocal catalog, failed
+        if catalog is None and not failed:
+            try:
+                result = {}
+                for item in _fetch_field_rows(ds, conf, sql, p1, None):
+                    # the query covers the whole schema, tables not synced are skipped
+                    if item[0] in wanted:
+                        result.setdefault(item[0], []).append(ColumnSchema(*item[1:]))
+                catalog = result
+            except Exception as e:
+                # e.g. no privilege on the whole catalog, the per table query may still work
+                SQLBotLogUtil.warning(f"Read fields of datasource {ds.id} in one query failed, read by table: {e}")
+                failed = True
+        if catalog is not None:
+            return {name: catalog.get(name, []) for name in names}
+        return fetch_concurrently(ds.id, names, lambda name: get_fields(ds, name))
+
+    return read
+
+
+def _fetch_field_rows(ds: CoreDatasource, conf: DatasourceConf, sql: str, p1, p2) -> list:
+    db = DB.get_db(ds.type)
     if db.connect_type == ConnectType.sqlalchemy:
         with get_session(ds) as session:
             with session.execute(text(sql), {"param1": p1, "param2": p2}) as result:
-                res = result.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-    else:
-        extra_config_dict = get_extra_config(conf)
-        if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql, (p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
-                cursor.execute(sql.format(p1, p2))
-                res = cursor.fetchall()
-                res_list = [ColumnSchema(*item) for item in res]
-                return res_list
-        elif equals_ignore_case(ds.type, 'es'):
-            res = get_es_fields(conf, table_name)
-            res_list = [ColumnSchema(*item) for item in res]
-            return res_list
+                return result.fetchall()
+    params = (p1, p2) if p2 is not None else (p1,)
+    if equals_ignore_case(ds.type, 'dm'):
+        with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
+            cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
+            return cursor.fetchall()
+    elif equals_ignore_case(ds.type, 'doris', 'starrocks', 'redshift'):
+        with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+    elif equals_ignore_case(ds.type, 'kingbase'):
+        with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
+            cursor.execute(sql.format(p1, p2))
+            return cursor.fetchall()
+    return []
+
+
+# datasources read through an unbuffered pymysql cursor, see _exec_sql
+_unbuffered_types = {DB.mysql, DB.doris, DB.starrocks}
+
+
+def fetch_rows(fetchmany, max_rows: int, batch_size: int):
+    """Fetch rows in batches and stop after max_rows (0 means no limit).
+    Returns the rows, whether the result was truncated, and how many rows were read from the cursor."""
+    rows = []
+    truncated = False
+    batch_size = max(batch_size, 1)
+    while True:
+        # read one row past the cap to know if the result is truncated
+        size = batch_size if max_rows <= 0 else min(batch_size, max_rows + 1 - len(rows))
+        batch = fetchmany(size)
+        if not batch:
+            break
+        rows.extend(batch)
+        if 0 < max_rows < len(rows):
+            truncated = True
+            break
+    scanned = len(rows)
+    if truncated:
+        del rows[max_rows:]
+    return rows, truncated, scanned
+
+
+def build_exec_result(columns: list, rows, sql: str, truncated: bool, scanned: int):
+    result_list = normalize_rows(columns, rows)
+    return {"fields": columns, "data": result_list,
+            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8'))),
+            "truncated": truncated, "scanned_rows": scanned}
 
 
-def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False):
+def get_cursor_columns(cursor, origin_column: bool):
+    return [field[0] for field in cursor.description] if origin_column else [field[0].lower() for field in
+                                                                            cursor.description]
+
+
+def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, max_rows: int = 0,
+             use_cache: bool = True):
+    """max_rows caps the rows read (0 means all of them), e.g. the chat keeps only the rows it stores.
+    The result tells whether it was truncated."""
     while sql.endswith(';'):
         sql = sql[:-1]
 
+    return cached_exec(ds, sql, origin_column, max_rows, use_cache,
+                       lambda: _exec_sql(ds, sql, origin_column, max_rows))
+
+
+def _exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column: bool, max_rows: int):
+    fetch_size = settings.SQL_EXEC_FETCH_SIZE
     db = DB.get_db(ds.type)
+    # closing an unbuffered pymysql cursor reads the rest of the result, the query itself stops after the cap
+    query = limit_sql(sql, max_rows + 1, ds.type) if max_rows > 0 and db in _unbuffered_types else sql
     if db.connect_type == ConnectType.sqlalchemy:
         with get_session(ds) as session:
-            with session.execute(text(sql)) as result:
+            # server side cursor where the dialect supports it, otherwise ignored by sqlalchemy
+            with session.execute(text(query), execution_options={"stream_results": True,
+                                                               "max_row_buffer": fetch_size}) as result:
                 try:
                     columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
-                    res = result.fetchall()
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    res, truncated, scanned = fetch_rows(result.fetchmany, max_rows, fetch_size)
+                    return build_exec_result(columns, res, sql, truncated, scanned)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
     else:
         conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
         if equals_ignore_case(ds.type, 'dm'):
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 try:
+                    cursor.arraysize = fetch_size
                     cursor.execute(sql, timeout=conf.timeout)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    res, truncated, scanned = fetch_rows(cursor.fetchmany, max_rows, fetch_size)
+                    columns = get_cursor_columns(cursor, origin_column)
+                    return build_exec_result(columns, res, sql, truncated, scanned)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
         elif equals_ignore_case(ds.type, 'doris', 'starrocks'):
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            # unbuffered cursor, rows are streamed from the server instead of loaded at once
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor(pymysql.cursors.SSCursor) as cursor:
                 try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    cursor.execute(query)
+                    res, truncated, scanned = fetch_rows(cursor.fetchmany, max_rows, fetch_size)
+                    columns = get_cursor_columns(cursor, origin_column)
+                    return build_exec_result(columns, res, sql, truncated, scanned)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
         elif equals_ignore_case(ds.type, 'redshift'):
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            # redshift_connector has no server side cursor, the cap only bounds the rows we convert
+            with get_py_driver_conn(ds, conf) as conn, conn.cursor() as cursor:
                 try:
                     cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    res, truncated, scanned = fetch_rows(cursor.fetchmany, max_rows, fetch_size)
+                    columns = get_cursor_columns(cursor, origin_column)
+                    return build_exec_result(columns, res, sql, truncated, scanned)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
         elif equals_ignore_case(ds.type, 'kingbase'):
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_py_driver_conn(ds, conf) as conn:
                 try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    with open_kingbase_cursor(conn, sql, fetch_size) as cursor:
+                        res, truncated, scanned = fetch_rows(cursor.fetchmany, max_rows, fetch_size)
+                        columns = get_cursor_columns(cursor, origin_column)
+                        return build_exec_result(columns, res, sql, truncated, scanned)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
         elif equals_ignore_case(ds.type, 'es'):
             try:
-                res, columns = get_es_data_by_http(conf, sql)
-                columns = [field.get('name') for field in columns] if origin_column else [field.get('name').lower() for
-                                                                                          field in
-                                                                                          columns]
-                result_list = [
-                    {str(columns[i]): float(value) if isinstance(value, Decimal) else value for i, value in
-                     enumerate(tuple(tuple_item))}
-                    for tuple_item in res
-                ]
-                return {"fields": columns, "data": result_list,
-                        "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                with EsSqlCursor(conf, sql, min(fetch_size, max_rows + 1) if max_rows > 0 else fetch_size) as cursor:
+                    res, truncated, scanned = fetch_rows(cursor.fetchmany, max_rows, fetch_size)
+                    columns = [field.get('name') for field in cursor.columns] if origin_column else [
+                        field.get('name').lower() for field in cursor.columns]
+                    return build_exec_result(columns, res, sql, truncated, scanned)
             except Exception as ex:
                 raise Exception(str(ex))
+
+
+def open_kingbase_cursor(conn, sql: str, fetch_size: int):
+    # named cursor is a server side cursor, it only accepts SELECT/VALUES, fall back to a client cursor otherwise
+    cursor = conn.cursor(name=f'sqlbot_{uuid.uuid4().hex}')
+    cursor.itersize = fetch_size
+    try:
+        cursor.execute(sql)
+        return cursor
+    except psycopg2.ProgrammingError:
+        conn.rollback()
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    return cursor
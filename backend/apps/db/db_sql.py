@@ -313,3 +313,28 @@ def get_field_sql(ds: CoreDatasource, conf: DatasourceConf, table_name: str = No
         return sql1 + sql2, conf.dbSchema, table_name
     elif equals_ignore_case(ds.type, "es"):
         return "", None, None
+
+
+# column holding the table name in the get_field_sql query of each type
+_field_table_columns = {
+    "mysql": "TABLE_NAME",
+    "sqlServer": "C.TABLE_NAME",
+    "pg": "c.relname",
+    "excel": "c.relname",
+    "redshift": "c.relname",
+    "oracle": "col.TABLE_NAME",
+    "ck": "table",
+    "dm": "c.TABLE_NAME",
+    "doris": "TABLE_NAME",
+    "starrocks": "TABLE_NAME",
+    "kingbase": "c.relname",
+}
+
+
+def get_all_fields_sql(ds: CoreDatasource, conf: DatasourceConf):
+    """get_field_sql for every table of the schema in one query, the table name is selected first."""
+    sql, param, _ = get_field_sql(ds, conf)
+    column = next((v for k, v in _field_table_columns.items() if equals_ignore_case(ds.type, k)), None)
+    if not sql or column is None:
+        return "", None
+    return sql.replace("SELECT", f"SELECT {column} AS TABLE_NAME,", 1), param
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.create_time = time.monotonic()
+        self.last_used = self.create_time
+
+
+class DriverConnectionPool:
+    """Thread-safe DB-API connection pool for the py_driver datasources (pymysql, redshift_connector,
+    psycopg2, dmPython), which are not managed by sqlalchemy."""
+
+    def __init__(self, ds_id, creator: Callable[[int], Any], max_size: int = None, max_idle: int = None,
+                 max_lifetime: int = None):
+        """creator opens a connection, it is called with the connect timeout of the borrowing call."""
+        self.ds_id = ds_id
+        self._creator = creator
+        self._max_size = max(max_size if max_size is not None else
+                             settings.DS_POOL_SIZE + settings.DS_POOL_MAX_OVERFLOW, 1)
+        self._max_idle = max_idle if max_idle is not None else settings.DS_POOL_SIZE
+        self._max_lifetime = max_lifetime if max_lifetime is not None else settings.DS_POOL_RECYCLE
+        self._idle: deque[_PooledConnection] = deque()
+        self._total = 0
+        self._disposed = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def connection(self, timeout: int = 30):
+        """Borrow a connection, waiting and connecting at most timeout seconds."""
+        item = self._acquire(timeout)
+        try:
+            yield item.conn
+        finally:
+            self._release(item)
+
+    def _acquire(self, timeout: int) -> _PooledConnection:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                item = self._idle.pop() if self._idle else None
+                if item is None:
+                    if self._total < self._max_size:
+                        self._total += 1
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Exception(f'Connection pool of datasource {self.ds_id} exhausted, '
+                                            f'{self._max_size} connections in use')
+                        self._cond.wait(remaining)
+                        continue
+            if item is None:
+                return self._create(timeout)
+            if self._is_usable(item):
+                return item
+            self._discard(item)
+
+    def _create(self, timeout: int) -> _PooledConnection:
+        try:
+            return _PooledConnection(self._creator(timeout))
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+    def _is_usable(self, item: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if 0 < self._max_lifetime < now - item.create_time:
+            return False
+        if settings.DS_POOL_PRE_PING and now - item.last_used > settings.DS_DRIVER_POOL_PING_INTERVAL:
+            return _ping(item.conn)
+        return True
+
+    def _release(self, item: _PooledConnection):
+        try:
+            # end the transaction opened by the query, a broken connection fails here
+            item.conn.rollback()
+        except Exception:
+            self._discard(item)
+            return
+        item.last_used = time.monotonic()
+        with self._cond:
+            if not self._disposed and len(self._idle) < self._max_idle:
+                self._idle.append(item)
+                self._cond.notify()
+                return
+        self._discard(item)
+
+    def _discard(self, item: _PooledConnection):
+        _close(item.conn, self.ds_id)
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def dispose(self):
+        with self._cond:
+            self._disposed = True
+            items = list(self._idle)
+            self._idle.clear()
+        for item in items:
+            self._discard(item)
+
+    # same metrics as sqlalchemy QueuePool
+    def size(self) -> int:
+        return self._max_idle
+
+    def checkedin(self) -> int:
+        return len(self._idle)
+
+    def checkedout(self) -> int:
+        return self._total - len(self._idle)
+
+    def overflow(self) -> int:
+        return self._total - self._max_idle
+
+
+def _ping(conn) -> bool:
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('select 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _close(conn, ds_id):
+    try:
+        conn.close()
+    except Exception as e:
+        SQLBotLogUtil.error(f"Close connection of datasource {ds_id} failed: {e}")
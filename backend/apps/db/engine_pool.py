@@ -0,0 +1,141 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from sqlalchemy import Engine
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+class _EngineEntry:
+    def __init__(self, ds_id, engine: Engine):
+        self.ds_id = ds_id
+        self.engine = engine
+        self.create_time = time.monotonic()
+        self.last_used = self.create_time
+
+
+_engines: OrderedDict[str, _EngineEntry] = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_pool_key(ds_id, *parts) -> Optional[str]:
+    # unsaved datasource (e.g. connection test) has no id, it will not be cached
+    if ds_id is None:
+        return None
+    digest = hashlib.sha256('--sqlbot--'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return f'{ds_id}:{digest}'
+
+
+def get_pool_args(timeout: int) -> dict:
+    return {
+        "pool_size": settings.DS_POOL_SIZE,
+        "max_overflow": settings.DS_POOL_MAX_OVERFLOW,
+        "pool_recycle": settings.DS_POOL_RECYCLE,
+        "pool_pre_ping": settings.DS_POOL_PRE_PING,
+        "pool_timeout": timeout,
+    }
+
+
+def _pop_idle(now: float) -> list[_EngineEntry]:
+    idle = []
+    if settings.DS_ENGINE_IDLE_TIMEOUT <= 0:
+        return idle
+    for key, entry in list(_engines.items()):
+        if now - entry.last_used < settings.DS_ENGINE_IDLE_TIMEOUT:
+            continue
+        if _checked_out(entry.engine) > 0:
+            continue
+        idle.append(_engines.pop(key))
+    return idle
+
+
+def _pop_overflow() -> list[_EngineEntry]:
+    evicted = []
+    while len(_engines) > max(settings.DS_ENGINE_MAX_COUNT, 1):
+        _, entry = _engines.popitem(last=False)
+        evicted.append(entry)
+    return evicted
+
+
+def _dispose(entries: list[_EngineEntry]):
+    for entry in entries:
+        try:
+            entry.engine.dispose()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Dispose engine of datasource {entry.ds_id} failed: {e}")
+
+
+def _pool_of(engine):
+    # sqlalchemy engine, or DriverConnectionPool which is cached the same way
+    return engine.pool if isinstance(engine, Engine) else engine
+
+
+def _checked_out(engine) -> int:
+    checkedout = getattr(_pool_of(engine), 'checkedout', None)
+    return checkedout() if callable(checkedout) else 0
+
+
+def get_cached_engine(ds_id, key: Optional[str], factory: Callable[[], Engine]) -> Engine:
+    """Return the pooled engine for key, creating it with factory on first use."""
+    if key is None:
+        return factory()
+
+    now = time.monotonic()
+    with _lock:
+        entry = _engines.get(key)
+        if entry is not None:
+            entry.last_used = now
+            _engines.move_to_end(key)
+        expired = _pop_idle(now)
+    _dispose(expired)
+    if entry is not None:
+        return entry.engine
+
+    engine = factory()
+    with _lock:
+        entry = _engines.get(key)
+        if entry is None:
+            entry = _EngineEntry(ds_id, engine)
+            _engines[key] = entry
+            evicted = _pop_overflow()
+        else:
+            # created concurrently by another thread, keep the first one
+            evicted = [_EngineEntry(ds_id, engine)]
+        entry.last_used = now
+    _dispose(evicted)
+    return entry.engine
+
+
+def dispose_ds_engines(ds_id):
+    with _lock:
+        entries = [_engines.pop(key) for key, entry in list(_engines.items()) if entry.ds_id == ds_id]
+    _dispose(entries)
+    if entries:
+        SQLBotLogUtil.info(f"Disposed {len(entries)} cached engine(s) of datasource {ds_id}")
+
+
+def dispose_all_engines():
+    with _lock:
+        entries = list(_engines.values())
+        _engines.clear()
+    _dispose(entries)
+
+
+def get_engine_pool_status(ds_id=None) -> list[dict]:
+    now = time.monotonic()
+    with _lock:
+        entries = [entry for entry in _engines.values() if ds_id is None or entry.ds_id == ds_id]
+    status = []
+    for entry in entries:
+        pool = _pool_of(entry.engine)
+        item = {"ds_id": entry.ds_id, "pool": pool.__class__.__name__,
+                "idle_seconds": int(now - entry.last_used), "age_seconds": int(now - entry.create_time)}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            func = getattr(pool, name, None)
+            item[name] = func() if callable(func) else None
+        status.append(item)
+    return status
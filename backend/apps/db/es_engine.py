@@ -3,6 +3,7 @@
 
 import json
 from base64 import b64encode
+from typing import Dict, List
 
 import requests
 from elasticsearch import Elasticsearch
@@ -41,12 +42,12 @@ def get_es_index(conf: DatasourceConf):
     indices = es_client.cat.indices(format="json")
     res = []
     if indices is not None:
+        # mappings of all indices in one request
+        all_mappings = es_client.indices.get_mapping()
         for idx in indices:
             index_name = idx.get('index')
             desc = ''
-            # get mapping
-            mapping = es_client.indices.get_mapping(index=index_name)
-            mappings = mapping.get(index_name).get("mappings")
+            mappings = (all_mappings.get(index_name) or {}).get("mappings") or {}
             if mappings.get('_meta'):
                 desc = mappings.get('_meta').get('description')
             res.append((index_name, desc))
@@ -58,7 +59,18 @@ def get_es_fields(conf: DatasourceConf, table_name: str):
     es_client = get_es_connect(conf)
     index_name = table_name
     mapping = es_client.indices.get_mapping(index=index_name)
-    properties = mapping.get(index_name).get("mappings").get("properties")
+    return _get_mapping_fields(mapping.get(index_name).get("mappings"))
+
+
+def get_es_fields_by_indices(conf: DatasourceConf, index_names: List[str]) -> Dict[str, list]:
+    """Fields of many indices from a single _mapping request."""
+    es_client = get_es_connect(conf)
+    all_mappings = es_client.indices.get_mapping()
+    return {name: _get_mapping_fields((all_mappings.get(name) or {}).get("mappings") or {}) for name in index_names}
+
+
+def _get_mapping_fields(mappings: dict):
+    properties = mappings.get("properties")
     res = []
     if properties is not None:
         for field, config in properties.items():
@@ -119,3 +131,49 @@ def get_es_data_by_http(conf: DatasourceConf, sql: str):
     fields = res.get('columns')
     result = res.get('rows')
     return result, fields
+
+
+class EsSqlCursor:
+    """Page through an ES SQL query with fetch_size and the returned cursor, instead of one big response."""
+
+    def __init__(self, conf: DatasourceConf, sql: str, fetch_size: int = 1000):
+        url = conf.host
+        while url.endswith('/'):
+            url = url[:-1]
+        self.url = url
+        self.headers = get_es_auth(conf)
+        self.columns = []
+        self._rows = []
+        self._cursor = None
+        self._post('/_sql?format=json', {"query": sql, "fetch_size": fetch_size})
+
+    def _post(self, path: str, body: dict):
+        response = requests.post(f'{self.url}{path}', data=json.dumps(body), headers=self.headers, verify=False)
+        res = response.json()
+        if res.get('error'):
+            raise SingleMessageError(json.dumps(res))
+        if res.get('columns'):
+            self.columns = res.get('columns')
+        self._rows.extend(res.get('rows') or [])
+        self._cursor = res.get('cursor')
+
+    def fetchmany(self, size: int):
+        while len(self._rows) < size and self._cursor:
+            self._post('/_sql?format=json', {"cursor": self._cursor})
+        rows = self._rows[:size]
+        del self._rows[:size]
+        return rows
+
+    def close(self):
+        if self._cursor:
+            try:
+                requests.post(f'{self.url}/_sql/close', data=json.dumps({"cursor": self._cursor}),
+                              headers=self.headers, verify=False)
+            finally:
+                self._cursor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,37 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, TypeVar
+
+from common.core.config import settings
+
+T = TypeVar('T')
+
+# metadata requests in flight per datasource, shared by all syncs of this process
+_limits: Dict[int, threading.BoundedSemaphore] = {}
+_limits_lock = threading.Lock()
+
+
+def _ds_limit(ds_id: int) -> threading.BoundedSemaphore:
+    with _limits_lock:
+        limit = _limits.get(ds_id)
+        if limit is None:
+            limit = _limits[ds_id] = threading.BoundedSemaphore(max(settings.DS_INTROSPECTION_CONCURRENCY, 1))
+        return limit
+
+
+def fetch_concurrently(ds_id: int, names: Iterable[str], fetch: Callable[[str], T]) -> Dict[str, T]:
+    """Call fetch for each name on a few threads, at most DS_INTROSPECTION_CONCURRENCY calls run
+    against one datasource at a time. The first error is raised after the other calls finished."""
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    limit = _ds_limit(ds_id)
+
+    def limited(name: str) -> T:
+        with limit:
+            return fetch(name)
+
+    workers = min(max(settings.DS_INTROSPECTION_CONCURRENCY, 1), len(names))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'ds-meta-{ds_id}') as executor:
+        futures = [executor.submit(limited, name) for name in names]
+    return {name: future.result() for name, future in zip(names, futures, strict=True)}
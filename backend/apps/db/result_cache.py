@@ -0,0 +1,212 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import orjson
+import sqlparse
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+_CACHE_NAMESPACE = 'sql_result'
+
+
+def normalize_sql(sql: str) -> str:
+    # comments, whitespace and keyword case do not change the result
+    return sqlparse.format(sql, strip_comments=True, strip_whitespace=True, keyword_case='upper').strip()
+
+
+def is_cacheable_sql(sql: str) -> bool:
+    statements = [s for s in sqlparse.parse(sql) if s.token_first(skip_cm=True) is not None]
+    return len(statements) == 1 and statements[0].get_type() == 'SELECT'
+
+
+def get_ds_version(ds) -> str:
+    """Hash of the connection settings, a changed configuration never hits results cached before."""
+    if hasattr(ds, 'configuration'):
+        parts = [ds.type, ds.configuration]
+    else:
+        parts = [ds.type, ds.host, ds.port, ds.dataBase, ds.user, ds.password, ds.db_schema, ds.extraParams]
+    return hashlib.sha256('--sqlbot--'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def _dumps(result: dict) -> bytes:
+    return orjson.dumps(result, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+class _MemoryResultCache:
+    """Per process LRU, one OrderedDict per datasource bounded by the size of its values."""
+
+    def __init__(self):
+        self._entries: dict[int, OrderedDict[str, tuple[float, bytes]]] = {}
+        self._sizes: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, ds_id: int, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(ds_id)
+            item = entries.get(key) if entries is not None else None
+            if item is None:
+                return None
+            if item[0] <= now:
+                del entries[key]
+                self._sizes[ds_id] -= len(item[1])
+                return None
+            entries.move_to_end(key)
+            return item[1]
+
+    def set(self, ds_id: int, key: str, value: bytes, ttl: int, max_bytes: int):
+        with self._lock:
+            entries = self._entries.setdefault(ds_id, OrderedDict())
+            size = self._sizes.get(ds_id, 0)
+            old = entries.pop(key, None)
+            if old is not None:
+                size -= len(old[1])
+            entries[key] = (time.monotonic() + ttl, value)
+            size += len(value)
+            while size > max_bytes and entries:
+                _, (_, evicted) = entries.popitem(last=False)
+                size -= len(evicted)
+            self._sizes[ds_id] = size
+
+    def invalidate(self, ds_id: int):
+        with self._lock:
+            self._entries.pop(ds_id, None)
+            self._sizes.pop(ds_id, None)
+
+
+class _RedisResultCache:
+    """Shared by all workers. Keys of a datasource are tracked in a sorted set by last access time and
+    their sizes in a hash, the least recently used ones are removed when the total grows over the limit."""
+
+    def __init__(self, url: str):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(ds_id: int, key: str) -> str:
+        return f'sqlbot-cache:{_CACHE_NAMESPACE}:{ds_id}:{key}'
+
+    @staticmethod
+    def _index_key(ds_id: int) -> str:
+        return f'sqlbot-cache:{_CACHE_NAMESPACE}:{ds_id}'
+
+    @staticmethod
+    def _size_key(ds_id: int) -> str:
+        return f'sqlbot-cache:{_CACHE_NAMESPACE}:{ds_id}:sizes'
+
+    def get(self, ds_id: int, key: str) -> Optional[bytes]:
+        value = self._redis.get(self._key(ds_id, key))
+        if value is not None:
+            self._redis.zadd(self._index_key(ds_id), {key: time.time()})
+        return value
+
+    def set(self, ds_id: int, key: str, value: bytes, ttl: int, max_bytes: int):
+        index_key, size_key = self._index_key(ds_id), self._size_key(ds_id)
+        now = time.time()
+        # entries older than ttl are expired by redis already
+        expired = self._redis.zrangebyscore(index_key, '-inf', now - ttl)
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(ds_id, key), value, ex=ttl)
+        pipe.zadd(index_key, {key: now})
+        pipe.hset(size_key, key, len(value))
+        if expired:
+            pipe.zrem(index_key, *expired)
+            pipe.hdel(size_key, *expired)
+        pipe.expire(index_key, ttl)
+        pipe.expire(size_key, ttl)
+        pipe.hgetall(size_key)
+        sizes = pipe.execute()[-1]
+        total = sum(int(size) for size in sizes.values())
+        if total <= max_bytes:
+            return
+        evicted = []
+        for k in self._redis.zrange(index_key, 0, -1):
+            if total <= max_bytes:
+                break
+            evicted.append(k)
+            total -= int(sizes.get(k) or 0)
+        if evicted:
+            pipe = self._redis.pipeline()
+            pipe.delete(*[self._key(ds_id, k.decode('utf-8')) for k in evicted])
+            pipe.zrem(index_key, *evicted)
+            pipe.hdel(size_key, *evicted)
+            pipe.execute()
+
+    def invalidate(self, ds_id: int):
+        index_key = self._index_key(ds_id)
+        keys = self._redis.zrange(index_key, 0, -1)
+        pipe = self._redis.pipeline()
+        if keys:
+            pipe.delete(*[self._key(ds_id, k.decode('utf-8')) for k in keys])
+        pipe.delete(index_key, self._size_key(ds_id))
+        pipe.execute()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _get_backend():
+    global _backend
+    if not settings.SQL_RESULT_CACHE_ENABLED:
+        return None
+    cache_type = (settings.CACHE_TYPE or '').lower()
+    if cache_type not in ('memory', 'redis'):
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if cache_type == 'redis':
+                    _backend = _RedisResultCache(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+                else:
+                    _backend = _MemoryResultCache()
+    return _backend
+
+
+def get_result_cache_key(ds, sql: str, origin_column: bool, max_rows: int) -> str:
+    raw = '--sqlbot--'.join([get_ds_version(ds), normalize_sql(sql), str(origin_column), str(max_rows)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cached_exec(ds, sql: str, origin_column: bool, max_rows: int, use_cache: bool,
+                execute: Callable[[], dict]) -> dict:
+    """Return the result of execute, read from / written to the result cache for SELECT statements.
+    A cached result is decoded from json, so a fresh one is returned the same way, e.g. datetime as an ISO string."""
+    backend = _get_backend() if use_cache and getattr(ds, 'id', None) is not None else None
+    if backend is None or not is_cacheable_sql(sql):
+        return execute()
+
+    key = get_result_cache_key(ds, sql, origin_column, max_rows)
+    try:
+        value = backend.get(ds.id, key)
+        if value is not None:
+            return orjson.loads(value)
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Read sql result cache of datasource {ds.id} failed: {e}")
+
+    result = execute()
+    try:
+        value = _dumps(result)
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Write sql result cache of datasource {ds.id} failed: {e}")
+        return result
+    if len(value) <= settings.SQL_RESULT_CACHE_MAX_ENTRY_BYTES:
+        try:
+            backend.set(ds.id, key, value, settings.SQL_RESULT_CACHE_TTL, settings.SQL_RESULT_CACHE_DS_MAX_BYTES)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Write sql result cache of datasource {ds.id} failed: {e}")
+    return orjson.loads(value)
+
+
+def invalidate_ds_result_cache(ds_id: int):
+    backend = _get_backend()
+    if backend is None or ds_id is None:
+        return
+    try:
+        backend.invalidate(ds_id)
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Clear sql result cache of datasource {ds_id} failed: {e}")
@@ -0,0 +1,283 @@
+import base64
+from array import array
+from decimal import Decimal
+from itertools import chain
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+COLUMNAR_FORMAT = 'columnar'
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+# 超过15位的整数/小数在前端会丢失精度, 以字符串返回
+_BIG_INT = 10 ** 15
+_BYTES_TYPES = (bytes, bytearray, memoryview)
+_NONE_TYPE = type(None)
+_VECTORIZE_MIN_ROWS = 1024
+
+
+class Column:
+    """One result column: non-null values in a typed array plus a null bitmap (bit set = null)."""
+
+    def __init__(self, type: str, values, nulls: Optional[bytearray], length: int):
+        self.type = type
+        self.values = values
+        self.nulls = nulls
+        self.length = length
+
+    @staticmethod
+    def from_values(values: list) -> 'Column':
+        length = len(values)
+        nulls = None
+        non_null = values
+        if None in values:
+            nulls = bytearray((length + 7) // 8)
+            non_null = []
+            for i, value in enumerate(values):
+                if value is None:
+                    nulls[i >> 3] |= 1 << (i & 7)
+                else:
+                    non_null.append(value)
+        _type = _detect_type(non_null)
+        if _type == 'int':
+            non_null = array('q', non_null)
+        elif _type == 'float':
+            non_null = array('d', non_null)
+        return Column(_type, non_null, nulls, length)
+
+    def is_null(self, index: int) -> bool:
+        return self.nulls is not None and bool(self.nulls[index >> 3] & (1 << (index & 7)))
+
+    def to_list(self) -> list:
+        if self.nulls is None:
+            return list(self.values)
+        result = [None] * self.length
+        it = iter(self.values)
+        for i in range(self.length):
+            if not self.nulls[i >> 3] & (1 << (i & 7)):
+                result[i] = next(it)
+        return result
+
+    def to_dict(self) -> dict:
+        obj = {'type': self.type, 'values': self.values.tolist() if isinstance(self.values, array) else self.values}
+        if self.nulls is not None:
+            obj['nulls'] = base64.b64encode(bytes(self.nulls)).decode('utf-8')
+        return obj
+
+    @staticmethod
+    def from_dict(obj: dict, length: int) -> 'Column':
+        _type = obj.get('type') or 'object'
+        values = obj.get('values') or []
+        if _type == 'int':
+            values = array('q', values)
+        elif _type == 'float':
+            values = array('d', values)
+        nulls = bytearray(base64.b64decode(obj['nulls'])) if obj.get('nulls') else None
+        return Column(_type, values, nulls, length)
+
+
+def _detect_type(values: list) -> str:
+    if not values:
+        return 'object'
+    first = type(values[0])
+    if first is bool:
+        return 'bool' if all(type(v) is bool for v in values) else 'object'
+    if first is int:
+        if all(type(v) is int for v in values) and _INT64_MIN <= min(values) and max(values) <= _INT64_MAX:
+            return 'int'
+        return 'object'
+    if first is float:
+        return 'float' if all(type(v) is float for v in values) else 'object'
+    if first is str:
+        return 'str' if all(type(v) is str for v in values) else 'object'
+    return 'object'
+
+
+class ColumnarResult:
+    """Compact form of a query result: the field list once and one typed column per field,
+    instead of a dict repeating every field name per row."""
+
+    def __init__(self, fields: list[str], columns: list[Column], row_count: int):
+        self.fields = fields
+        self.columns = columns
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    @staticmethod
+    def from_rows(fields: list[str], rows: Iterable[dict], precision_safe: bool = False) -> 'ColumnarResult':
+        rows = rows if isinstance(rows, list) else list(rows)
+        columns = [Column.from_values(normalize_column([row.get(field) for row in rows], precision_safe))
+                   for field in fields]
+        return ColumnarResult(list(fields), columns, len(rows))
+
+    @staticmethod
+    def from_tuples(fields: list[str], rows: list[tuple], precision_safe: bool = False) -> 'ColumnarResult':
+        if rows:
+            columns = [Column.from_values(normalize_column(list(values), precision_safe))
+                       for values in zip(*rows, strict=True)]
+        else:
+            columns = [Column.from_values([]) for _ in fields]
+        return ColumnarResult(list(fields), columns, len(rows))
+
+    def column(self, field: str) -> list:
+        return self.columns[self.fields.index(field)].to_list()
+
+    def to_rows(self) -> list[dict]:
+        fields = [str(field) for field in self.fields]
+        return [dict(zip(fields, values, strict=True))
+                for values in zip(*[column.to_list() for column in self.columns], strict=True)] \
+            if self.columns else [{} for _ in range(self.row_count)]
+
+    def to_dict(self) -> dict:
+        return {'format': COLUMNAR_FORMAT, 'fields': self.fields, 'row_count': self.row_count,
+                'columns': [column.to_dict() for column in self.columns]}
+
+    @staticmethod
+    def from_dict(obj: dict) -> 'ColumnarResult':
+        row_count = obj.get('row_count') or 0
+        fields = obj.get('fields') or []
+        return ColumnarResult(fields, [Column.from_dict(column, row_count) for column in obj.get('columns') or []],
+                              row_count)
+
+
+def is_columnar(obj: Any) -> bool:
+    return isinstance(obj, dict) and obj.get('format') == COLUMNAR_FORMAT
+
+
+def to_columnar_result(obj: dict, precision_safe: bool = False) -> dict:
+    """Convert an exec_sql style result {fields, data: [row dict]} to the columnar form, other keys are kept.
+    With precision_safe the columns are normalized on the way, and the result is marked as formatted."""
+    if not obj or is_columnar(obj):
+        return obj
+    result = {k: v for k, v in obj.items() if k not in ('fields', 'data')}
+    result.update(ColumnarResult.from_rows(obj.get('fields') or [], obj.get('data') or [],
+                                           precision_safe).to_dict())
+    if precision_safe:
+        result['formatted'] = True
+    return result
+
+
+def to_row_result(obj: dict) -> dict:
+    """Convert a columnar result back to {fields, data: [row dict]}, a row result is returned as it is."""
+    if not is_columnar(obj):
+        return obj
+    columnar = ColumnarResult.from_dict(obj)
+    result = {k: v for k, v in obj.items() if k not in ('format', 'fields', 'row_count', 'columns')}
+    result['fields'] = columnar.fields
+    result['data'] = columnar.to_rows()
+    return result
+
+
+def _is_long_float(value: float) -> bool:
+    return len(format(value, '.16f').rstrip('0').rstrip('.')) > 15
+
+
+def normalize_value(value, precision_safe: bool = False):
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        value = float(value)
+    elif isinstance(value, _BYTES_TYPES):
+        return base64.b64encode(bytes(value)).decode('utf-8')
+    if precision_safe and not isinstance(value, bool):
+        if isinstance(value, int):
+            if abs(value) >= _BIG_INT:
+                return str(value)
+        elif isinstance(value, float) and _is_long_float(value):
+            return str(value)
+    return value
+
+
+def _normalize_floats(values: list) -> list:
+    if len(values) < _VECTORIZE_MIN_ROWS:
+        return [normalize_value(v, True) for v in values]
+    # None becomes nan, integral values below 1e14 (sign included) never exceed 15 chars
+    arr = np.array(values, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        keep = np.isnan(arr) | ((np.floor(arr) == arr) & (np.abs(arr) < 1e14))
+    candidates = np.flatnonzero(~keep)
+    if len(candidates) == 0:
+        return values
+    values = list(values)
+    for i in candidates.tolist():
+        if _is_long_float(values[i]):
+            values[i] = str(values[i])
+    return values
+
+
+def normalize_column(values: list, precision_safe: bool = False) -> list:
+    """Convert one column in a single pass: Decimal to float, bytes to base64,
+    and with precision_safe big integers and long floats to str.
+    Columns that need no conversion are returned as they are."""
+    types = set(map(type, values))
+    types.discard(_NONE_TYPE)
+    if not types:
+        return values
+    if len(types) == 1:
+        _type = next(iter(types))
+        if _type is Decimal:
+            values = [float(v) if v is not None else None for v in values]
+            return _normalize_floats(values) if precision_safe else values
+        if _type in _BYTES_TYPES:
+            return [base64.b64encode(bytes(v)).decode('utf-8') if v is not None else None for v in values]
+        if _type is int:
+            if not precision_safe:
+                return values
+            non_null = [v for v in values if v is not None]
+            if -_BIG_INT < min(non_null) and max(non_null) < _BIG_INT:
+                return values
+            return [normalize_value(v, True) for v in values]
+        if _type is float:
+            return _normalize_floats(values) if precision_safe else values
+        return values
+    if not precision_safe and not any(issubclass(t, (Decimal,) + _BYTES_TYPES) for t in types):
+        return values
+    return [normalize_value(v, precision_safe) for v in values]
+
+
+def _needs_conversion(types: set, precision_safe: bool) -> bool:
+    if any(issubclass(t, (Decimal,) + _BYTES_TYPES) for t in types):
+        return True
+    return precision_safe and (int in types or float in types)
+
+
+def normalize_rows(fields: list, rows: list, precision_safe: bool = False) -> list[dict]:
+    """Build row dicts from driver tuples. Only the columns holding values to convert are
+    normalized, column by column, and patched into the rows."""
+    if not rows:
+        return []
+    keys = [str(field) for field in fields]
+    records = [dict(zip(keys, row, strict=True)) for row in rows]
+    if not _needs_conversion(set(map(type, chain.from_iterable(rows))), precision_safe):
+        return records
+    for index, key in enumerate(keys):
+        values = [row[index] for row in rows]
+        converted = normalize_column(values, precision_safe)
+        if converted is not values:
+            for record, value in zip(records, converted, strict=True):
+                record[key] = value
+    return records
+
+
+def normalize_records(records: list[dict], precision_safe: bool = False) -> list[dict]:
+    """Same as normalize_rows for row dicts, the given rows are not modified."""
+    if not records:
+        return []
+    if not _needs_conversion(set(map(type, chain.from_iterable(record.values() for record in records))),
+                             precision_safe):
+        return records
+    keys = records[0].keys()
+    if any(record.keys() != keys for record in records):
+        return [{k: normalize_value(v, precision_safe) for k, v in record.items()} for record in records]
+    result = [dict(record) for record in records]
+    for key in keys:
+        values = [record[key] for record in records]
+        converted = normalize_column(values, precision_safe)
+        if converted is not values:
+            for record, value in zip(result, converted, strict=True):
+                record[key] = value
+    return result
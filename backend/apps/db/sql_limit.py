@@ -0,0 +1,49 @@
+from typing import Optional
+
+import sqlglot
+from sqlglot import exp
+
+from apps.db.constant import DB
+from common.utils.utils import SQLBotLogUtil
+
+# sqlglot dialect of each datasource type
+_dialects = {
+    DB.excel: 'postgres',
+    DB.pg: 'postgres',
+    DB.kingbase: 'postgres',
+    DB.redshift: 'redshift',
+    DB.ck: 'clickhouse',
+    DB.dm: 'oracle',
+    DB.oracle: 'oracle',
+    DB.doris: 'doris',
+    DB.starrocks: 'starrocks',
+    DB.mysql: 'mysql',
+    DB.sqlServer: 'tsql',
+    DB.es: None,
+}
+
+
+def get_sqlglot_dialect(ds_type: str) -> Optional[str]:
+    return _dialects.get(DB.get_db(ds_type, True))
+
+
+def limit_sql(sql: str, limit: int, ds_type: str) -> str:
+    """Bound the rows of a query to limit: a LIMIT clause is appended, or a larger one is lowered.
+    Statements other than a single query, or not parsed, are returned unchanged."""
+    dialect = get_sqlglot_dialect(ds_type)
+    try:
+        statements = [s for s in sqlglot.parse(sql.strip().rstrip(';'), read=dialect) if s is not None]
+        if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+            return sql
+        tree = statements[0]
+        current = tree.args.get('limit')
+        if current is None:
+            # the query is sent as written, on its own line a trailing comment cannot swallow the clause
+            return f'{sql}\nLIMIT {limit}'
+        value = current.expression
+        if isinstance(value, exp.Literal) and value.is_int and int(value.this) <= limit:
+            return sql
+        return tree.limit(limit, copy=False).sql(dialect=dialect)
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Add limit to sql failed: {e}")
+        return sql
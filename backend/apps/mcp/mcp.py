@@ -130,9 +130,8 @@ async def mcp_question(session: SessionDep, chat: McpQuestion):
     if chat.stream:
         return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in llm_service.await_result():
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -186,9 +185,8 @@ async def mcp_assistant(session: SessionDep, chat: McpAssistant):
     if chat.stream:
         return StreamingResponse(llm_service.await_result(), media_type="text/event-stream")
     else:
-        res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in llm_service.await_result():
             if chunk:
                 raw_data = chunk
         status_code = 200
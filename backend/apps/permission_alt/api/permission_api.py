@@ -6,6 +6,7 @@ from common.core.decorators import require_space_admin
 from common.core.pagination import Paginator
 from common.core.schemas import PaginatedResponse, PaginationParams
 from ..models.permission_models import DsPermission, DsRules, PermissionDTO
+from ..utils.permission_index import invalidate_permission_index
 from ..crud.permission_crud import (
     create_permission,
     update_permission,
@@ -311,6 +312,7 @@ async def save_rule(session: SessionDep, trans: Trans, current_user: CurrentUser
         db_rule.user_list = json.dumps(users_data)
 
         session.commit()
+        invalidate_permission_index()
         session.refresh(db_rule)
         return db_rule
     else:
@@ -323,6 +325,7 @@ async def save_rule(session: SessionDep, trans: Trans, current_user: CurrentUser
         )
         session.add(new_rule)
         session.commit()
+        invalidate_permission_index()
         session.refresh(new_rule)
         return new_rule
 
@@ -337,6 +340,7 @@ async def delete_rule_api(session: SessionDep, trans: Trans, current_user: Curre
 
     session.delete(rule)
     session.commit()
+    invalidate_permission_index()
     return {"success": True}
 
 
@@ -1,15 +1,13 @@
-import json
 from typing import List, Optional
 
 from fastapi import HTTPException
-from common.utils.utils import SQLBotLogUtil
 from sqlalchemy import select, and_
 from sqlmodel import Session
 
 from apps.datasource.models.datasource import CoreDatasource, CoreField, CoreTable
 from common.core.deps import CurrentUser
 from ..models.permission_models import DsPermission, DsRules, PermissionDTO
-from ..utils.filter_builder import build_sql_filter
+from ..utils.permission_index import get_permission_index, invalidate_permission_index
 
 
 def is_normal_user(current_user: CurrentUser) -> bool:
@@ -37,6 +35,10 @@ def get_row_permission_filters(
     Returns:  
         [{"table": "表名", "filter": "WHERE条件"}, ...]  
     """
+    # 只对普通用户应用权限
+    if not is_normal_user(current_user):
+        return []
+
     # 获取表列表
     if single_table:
         table_list = [session.get(CoreTable, single_table.id)]
@@ -45,52 +47,17 @@ def get_row_permission_filters(
             and_(CoreTable.ds_id == ds.id, CoreTable.table_name.in_(tables))
         ).all()
 
-    filters = []
-
-    # 只对普通用户应用权限
-    if not is_normal_user(current_user):
-        return filters
-
-    # 获取所有规则组
-    contain_rules = session.query(DsRules).filter(DsRules.enable == True).all()
-
-    for table in table_list:
-        # 查询该表的行权限
-        row_permissions = session.query(DsPermission).filter(
-            and_(
-                DsPermission.table_id == table.id,
-                DsPermission.type == 'row',
-                DsPermission.enable == True
-            )
-        ).all()
-
-        # 过滤出用户关联的权限
-        user_permissions = []
-        for permission in row_permissions:
-            # 检查权限和用户是否在同一规则组中
-            for rule in contain_rules:
-                p_list = json.loads(
-                    rule.permission_list) if rule.permission_list else []
-                u_list = json.loads(rule.user_list) if rule.user_list else []
-
-                if (permission.id in p_list and
-                        (current_user.id in u_list or str(current_user.id) in u_list)):
-                    user_permissions.append(permission)
-                    break
-
-        # 构建WHERE条件
-        where_str = build_sql_filter(session, user_permissions, ds)
-        filters.append({"table": table.table_name, "filter": where_str})
-
-    return filters
+    # 规则组与权限已预编译, 按用户和表直接取出WHERE条件
+    index = get_permission_index(session)
+    return [{"table": table.table_name, "filter": index.row_filter(session, current_user.id, table.id, ds)}
+            for table in table_list]
 
 
 def get_column_permission_fields(
     session: Session,
     current_user: CurrentUser,
     table: CoreTable,
-    fields: List[CoreField],
-    contain_rules: List[DsRules]
+    fields: List[CoreField]
 ) -> List[CoreField]:
     """  
     获取列权限过滤后的字段列表  
@@ -100,7 +67,6 @@ def get_column_permission_fields(
         current_user: 当前用户  
         table: 数据表对象  
         fields: 原始字段列表  
-        contain_rules: 规则组列表  
 
     Returns:  
         过滤后的字段列表  
@@ -109,44 +75,21 @@ def get_column_permission_fields(
     if not is_normal_user(current_user):
         return fields
 
-    # 查询该表的列权限
-    column_permissions = session.query(DsPermission).filter(
-        and_(
-            DsPermission.table_id == table.id,
-            DsPermission.type == 'column',
-            DsPermission.enable == True
-        )
-    ).all()
-
-    SQLBotLogUtil.info(f"column_permissions: {column_permissions}")
-    SQLBotLogUtil.info(f"contain_rules: {contain_rules}")
-
-    if not column_permissions:
-        return fields
-
-    # 过滤出用户关联的权限
-    for permission in column_permissions:
-        # 检查权限和用户是否在同一规则组中
-        for rule in contain_rules:
-            p_list = json.loads(
-                rule.permission_list) if rule.permission_list else []
-            u_list = json.loads(rule.user_list) if rule.user_list else []
+    return get_permission_index(session).column_fields(current_user.id, table.id, fields)
 
-            if (permission.id in p_list and
-                    (current_user.id in u_list or str(current_user.id) in u_list)):
-                # 应用列权限过滤
-                permission_list = json.loads(
-                    permission.permissions) if permission.permissions else []
-                fields = filter_fields_by_permission(fields, permission_list)
-                break
 
-    return fields
+def get_permission_key(session: Session, current_user: CurrentUser, ds: CoreDatasource) -> str:
+    """用户在数据源上生效的权限标识, 标识相同的用户看到的数据相同, 空字符串表示不受限制"""
+    if not is_normal_user(current_user):
+        return ''
+    return get_permission_index(session).permission_key(current_user.id, ds.id)
 
 
 def create_permission(session: Session, permission: DsPermission) -> DsPermission:
     """创建权限规则"""
     session.add(permission)
     session.commit()
+    invalidate_permission_index()
     session.refresh(permission)
     return permission
 
@@ -161,6 +104,7 @@ def update_permission(session: Session, permission: DsPermission) -> DsPermissio
         setattr(db_permission, key, value)
 
     session.commit()
+    invalidate_permission_index()
     session.refresh(db_permission)
     return db_permission
 
@@ -173,6 +117,7 @@ def delete_permission(session: Session, permission_id: int) -> bool:
 
     session.delete(permission)
     session.commit()
+    invalidate_permission_index()
     return True
 
 
@@ -185,6 +130,7 @@ def create_rule(session: Session, rule: DsRules) -> DsRules:
     """创建权限规则组"""
     session.add(rule)
     session.commit()
+    invalidate_permission_index()
     session.refresh(rule)
     return rule
 
@@ -199,6 +145,7 @@ def update_rule(session: Session, rule: DsRules) -> DsRules:
         setattr(db_rule, key, value)
 
     session.commit()
+    invalidate_permission_index()
     session.refresh(db_rule)
     return db_rule
 
@@ -211,6 +158,7 @@ def delete_rule(session: Session, rule_id: int) -> bool:
 
     session.delete(rule)
     session.commit()
+    invalidate_permission_index()
     return True
 
 
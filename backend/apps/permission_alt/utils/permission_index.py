@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional
+
+from sqlmodel import Session
+
+from apps.datasource.models.datasource import CoreDatasource, CoreField
+from common.core.config import settings
+
+from ..models.permission_models import DsPermission, DsRules
+from .filter_builder import build_sql_filter
+
+
+def _load_list(value: Optional[str]) -> list:
+    try:
+        return json.loads(value) if value else []
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return []
+
+
+class PermissionIndex:
+    """Rules and enabled permissions compiled once: user -> permission ids, table -> permissions,
+    and the WHERE fragment and allowed field ids of each permission."""
+
+    def __init__(self, rules: List[DsRules], permissions: List[DsPermission]):
+        # row permissions only count enabled rule groups, column permissions every group
+        self.row_user_permissions = self._user_permissions([rule for rule in rules if rule.enable])
+        self.column_user_permissions = self._user_permissions(rules)
+        self.row_permissions: Dict[int, List[DsPermission]] = {}
+        self.column_permissions: Dict[int, List[tuple[int, Optional[FrozenSet[int]]]]] = {}
+        # datasource -> (row permission ids, column permission ids)
+        self.ds_permissions: Dict[int, tuple[set, set]] = {}
+        for permission in permissions:
+            if permission.type in ('row', 'column'):
+                row_ids, column_ids = self.ds_permissions.setdefault(permission.ds_id, (set(), set()))
+                (row_ids if permission.type == 'row' else column_ids).add(permission.id)
+            if permission.type == 'row':
+                # detached copy, the index outlives the session it was loaded with
+                self.row_permissions.setdefault(permission.table_id, []).append(
+                    DsPermission(**permission.model_dump()))
+            elif permission.type == 'column':
+                items = _load_list(permission.permissions)
+                # an empty permission list filters nothing
+                allowed = frozenset(item['field_id'] for item in items if item.get('enable', False)) if items else None
+                self.column_permissions.setdefault(permission.table_id, []).append((permission.id, allowed))
+        self._filters: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _user_permissions(rules: List[DsRules]) -> Dict[str, FrozenSet[int]]:
+        result: Dict[str, set] = {}
+        for rule in rules:
+            permission_ids = _load_list(rule.permission_list)
+            for user_id in _load_list(rule.user_list):
+                result.setdefault(str(user_id), set()).update(permission_ids)
+        return {user_id: frozenset(ids) for user_id, ids in result.items()}
+
+    def row_filter(self, session: Session, user_id: int, table_id: int, ds: CoreDatasource) -> str:
+        user_permissions = self.row_user_permissions.get(str(user_id), frozenset())
+        parts = []
+        for permission in self.row_permissions.get(table_id, []):
+            if permission.id in user_permissions:
+                condition = self._filter(session, permission, ds)
+                if condition:
+                    parts.append(condition)
+        return " OR ".join(parts)
+
+    def _filter(self, session: Session, permission: DsPermission, ds: CoreDatasource) -> str:
+        condition = self._filters.get(permission.id)
+        if condition is None:
+            condition = build_sql_filter(session, [permission], ds)
+            with self._lock:
+                self._filters[permission.id] = condition
+        return condition
+
+    def permission_key(self, user_id: int, ds_id: int) -> str:
+        """Permissions of a datasource applying to the user, users with the same key see the same data."""
+        row_ids, column_ids = self.ds_permissions.get(ds_id, (set(), set()))
+        row_ids = sorted(row_ids & self.row_user_permissions.get(str(user_id), frozenset()))
+        column_ids = sorted(column_ids & self.column_user_permissions.get(str(user_id), frozenset()))
+        if not row_ids and not column_ids:
+            return ''
+        return f"row:{','.join(map(str, row_ids))};column:{','.join(map(str, column_ids))}"
+
+    def column_fields(self, user_id: int, table_id: int, fields: List[CoreField]) -> List[CoreField]:
+        user_permissions = self.column_user_permissions.get(str(user_id), frozenset())
+        for permission_id, allowed in self.column_permissions.get(table_id, []):
+            if permission_id in user_permissions and allowed is not None:
+                fields = [f for f in fields or [] if f.id in allowed]
+        return fields
+
+
+_index: Optional[PermissionIndex] = None
+_loaded_at = 0.0
+_version = 0
+_index_lock = threading.Lock()
+
+
+def get_permission_index(session: Session) -> PermissionIndex:
+    """The compiled index, rebuilt after invalidate_permission_index or PERMISSION_CACHE_TTL seconds
+    (changes saved by another worker process)."""
+    global _index, _loaded_at
+    now = time.monotonic()
+    with _index_lock:
+        if _index is not None and now - _loaded_at < settings.PERMISSION_CACHE_TTL:
+            return _index
+        version = _version
+    rules = session.query(DsRules).all()
+    permissions = session.query(DsPermission).filter(DsPermission.enable.is_(True)).all()
+    index = PermissionIndex(rules, permissions)
+    with _index_lock:
+        # an index loaded before an invalidation is used by this call only
+        if version == _version:
+            _index = index
+            _loaded_at = now
+    return index
+
+
+def invalidate_permission_index():
+    global _index, _version
+    with _index_lock:
+        _version += 1
+        _index = None
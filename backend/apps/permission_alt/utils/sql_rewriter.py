@@ -0,0 +1,87 @@
+from typing import List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+from apps.db.constant import DB
+from apps.db.sql_limit import get_sqlglot_dialect
+from common.utils.utils import SQLBotLogUtil
+
+# Elasticsearch SQL has no subqueries in FROM, filters go into the WHERE clause
+_inject_types = {DB.es}
+
+
+def rewrite_sql_with_filters(sql: str, filters: List[dict], ds_type: str) -> Optional[str]:
+    """Apply row permission filters [{"table": name, "filter": where}] to every use of the tables in sql.
+    Each table is replaced by a filtered subquery under the same alias, or for Elasticsearch the filter
+    is added to the WHERE clause. Returns None when the sql or a filter cannot be handled."""
+    table_filters = {}
+    for item in filters:
+        if item.get('table') and item.get('filter'):
+            table_filters.setdefault(item['table'].lower(), []).append(item['filter'])
+    if not table_filters:
+        return sql
+
+    db = DB.get_db(ds_type, True)
+    dialect = get_sqlglot_dialect(ds_type)
+    try:
+        statements = [s for s in sqlglot.parse(sql.strip().rstrip(';'), read=dialect) if s is not None]
+        if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+            return None
+        tree = statements[0]
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        cte_references = _cte_references(tree)
+        for table in list(tree.find_all(exp.Table)):
+            name = table.name.lower()
+            if name not in table_filters or (cte_references is not None and id(table) in cte_references):
+                continue
+            if name in cte_names and cte_references is None:
+                # a cte named like a filtered table, the table inside its body must not be missed
+                return None
+            condition = ' AND '.join(f'({f})' for f in table_filters[name])
+            if db in _inject_types:
+                _inject_filter(table, condition, dialect)
+            else:
+                _wrap_table(tree, table, condition, dialect)
+        return tree.sql(dialect=dialect)
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Rewrite sql with row permission filters failed: {e}")
+        return None
+
+
+def _cte_references(tree: exp.Expression) -> Optional[set]:
+    """ids of the tables that read a cte, resolved per scope: the body of a cte named like a table
+    still reads the table. None when the scopes cannot be resolved."""
+    try:
+        return {id(table) for scope in traverse_scope(tree) for table in scope.tables
+                if isinstance(scope.sources.get(table.alias_or_name), Scope)}
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Resolve cte of sql failed: {e}")
+        return None
+
+
+def _wrap_table(tree: exp.Expression, table: exp.Table, condition: str, dialect: Optional[str]):
+    alias = table.args.get('alias')
+    bare = table.copy()
+    bare.set('alias', None)
+    subquery = sqlglot.parse_one(f'SELECT * FROM {bare.sql(dialect=dialect)} WHERE {condition}',
+                                 read=dialect).subquery(copy=False)
+    if alias is not None:
+        subquery.set('alias', alias)
+    else:
+        subquery.set('alias', exp.TableAlias(this=exp.to_identifier(table.name, quoted=table.this.quoted)))
+        # columns qualified as schema.table.column can only name the subquery by its alias
+        for column in tree.find_all(exp.Column):
+            if column.table.lower() == table.name.lower() and (column.args.get('db') or column.args.get('catalog')):
+                column.set('db', None)
+                column.set('catalog', None)
+    table.replace(subquery)
+
+
+def _inject_filter(table: exp.Table, condition: str, dialect: Optional[str]):
+    from_ = table.parent
+    query = from_.parent if isinstance(from_, exp.From) else None
+    if not isinstance(query, exp.Select) or query.args.get('joins'):
+        raise ValueError(f'filter of table {table.name} can only be added to a single table query')
+    query.where(sqlglot.parse_one(condition, read=dialect), copy=False)
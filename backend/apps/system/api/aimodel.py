@@ -2,13 +2,14 @@ import json
 from typing import List, Union
 
 from fastapi.responses import StreamingResponse
+from apps.ai_model.llm_limiter import llm_limiter
 from apps.ai_model.model_factory import LLMConfig, LLMFactory
 from apps.system.schemas.ai_model_schema import AiModelConfigItem, AiModelCreator, AiModelEditor, AiModelGridItem
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Query
 from sqlmodel import func, select, update
 
 from apps.system.models.system_model import AiModelDetail
-from common.core.deps import SessionDep, Trans
+from common.core.deps import CurrentUser, SessionDep, Trans
 from common.utils.time import get_timestamp
 from common.utils.utils import SQLBotLogUtil, prepare_model_arg
 
@@ -86,6 +87,14 @@ async def query(
     items = session.exec(statement).all()
     return items
 
+@router.get("/limiter", include_in_schema=False)
+async def limiter_stats(current_user: CurrentUser, trans: Trans):
+    """Running and queued llm calls, and queue wait times since start, of every workspace."""
+    if not current_user.isAdmin:
+        raise HTTPException(status_code=403, detail=trans('i18n_permission.no_permission', url='',
+                                                          msg=trans('i18n_permission.only_admin')))
+    return llm_limiter.stats()
+
 @router.get("/{id}", response_model=AiModelEditor)
 async def get_model_by_id(
         session: SessionDep,
@@ -10,6 +10,7 @@ from starlette.middleware.cors import CORSMiddleware
 
 # from apps.datasource.embedding.table_embedding import get_table_embedding
 from apps.datasource.models.datasource import CoreDatasource, DatasourceConf
+from apps.db.engine_pool import get_cached_engine, get_pool_args, get_pool_key
 from apps.system.models.system_model import AssistantModel
 from apps.system.schemas.auth import CacheName, CacheNamespace
 from apps.system.schemas.system_schema import AssistantHeader, AssistantOutDsSchema, UserInfoDTO
@@ -236,16 +237,22 @@ def get_ds_engine(ds: AssistantOutDsSchema) -> Engine:
     from apps.db.db import get_uri_from_config
     uri = get_uri_from_config(ds.type, conf)
 
+    key = get_pool_key(ds.id, ds.type, uri, ds.db_schema)
+    return get_cached_engine(ds.id, key, lambda: _create_ds_engine(ds, uri, timeout))
+
+
+def _create_ds_engine(ds: AssistantOutDsSchema, uri: str, timeout: int) -> Engine:
+    pool_args = get_pool_args(timeout)
     if equals_ignore_case(ds.type, "pg") and ds.db_schema:
         engine = create_engine(uri,
                                connect_args={"options": f"-c search_path={urllib.parse.quote(ds.db_schema)}",
                                              "connect_timeout": timeout},
-                               pool_timeout=timeout)
+                               **pool_args)
     elif equals_ignore_case(ds.type, 'sqlServer'):
-        engine = create_engine(uri, pool_timeout=timeout)
+        engine = create_engine(uri, **pool_args)
     elif equals_ignore_case(ds.type, 'oracle'):
         engine = create_engine(uri,
-                               pool_timeout=timeout)
+                               **pool_args)
     else:
-        engine = create_engine(uri, connect_args={"connect_timeout": timeout}, pool_timeout=timeout)
+        engine = create_engine(uri, connect_args={"connect_timeout": timeout}, **pool_args)
     return engine
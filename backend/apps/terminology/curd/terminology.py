@@ -5,10 +5,11 @@ from typing import List, Optional, Any
 from xml.dom.minidom import parseString
 
 import dicttoxml
-from sqlalchemy import and_, or_, select, func, delete, update, union, text, BigInteger
+from sqlalchemy import and_, or_, select, func, delete, update, text, BigInteger
 from sqlalchemy.orm import aliased
 
-from apps.ai_model.embedding import EmbeddingModelCache
+from apps.ai_model.embedding import embed_query
+from apps.ai_model.embedding_backfill import backfill_empty_embeddings, save_embeddings_in_batches
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_terminology_template
 from apps.terminology.models.terminology_model import Terminology, TerminologyInfo
@@ -411,17 +412,17 @@ def delete_terminology(session: SessionDep, ids: list[int]):
 # engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
 # session_maker = scoped_session(sessionmaker(bind=engine))
 
+def load_terminology_texts(session, ids: List[int]) -> List[tuple[int, str]]:
+    rows = session.query(Terminology.id, Terminology.word).filter(Terminology.id.in_(ids)).all()
+    return [(row.id, row.word) for row in rows]
+
+
 def run_fill_empty_embeddings(session_maker):
     try:
         if not settings.EMBEDDING_ENABLED:
             return
         session = session_maker()
-        stmt1 = select(Terminology.id).where(and_(Terminology.embedding.is_(None), Terminology.pid.is_(None)))
-        stmt2 = select(Terminology.pid).where(
-            and_(Terminology.embedding.is_(None), Terminology.pid.isnot(None))).distinct()
-        combined_stmt = union(stmt1, stmt2)
-        results = session.execute(combined_stmt).scalars().all()
-        save_embeddings(session_maker, results)
+        backfill_empty_embeddings(session, 'terminology', Terminology, load_terminology_texts)
     except Exception:
         traceback.print_exc()
     finally:
@@ -436,54 +437,49 @@ def save_embeddings(session_maker, ids: List[int]):
         return
     try:
         session = session_maker()
-        _list = session.query(Terminology).filter(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).all()
-
-        _words_list = [item.word for item in _list]
-
-        model = EmbeddingModelCache.get_model()
-
-        results = model.embed_documents(_words_list)
-
-        for index in range(len(results)):
-            item = results[index]
-            stmt = update(Terminology).where(and_(Terminology.id == _list[index].id)).values(embedding=item)
-            session.execute(stmt)
-            session.commit()
-
+        # a term and its synonyms
+        _ids = session.query(Terminology.id).filter(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids))).order_by(
+            Terminology.id).all()
+        save_embeddings_in_batches(session, Terminology, [row.id for row in _ids], load_terminology_texts)
     except Exception:
         traceback.print_exc()
     finally:
         session_maker.remove()
 
 
+# nearest neighbours first, so the hnsw index on embedding can be used, oid/datasource are pre-filters
 embedding_sql = f"""
 SELECT id, pid, word, similarity
 FROM
-(SELECT id, pid, word, oid, specific_ds, datasource_ids,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
-FROM terminology AS child
-) TEMP
-WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY} AND oid = :oid
+(SELECT id, pid, word,
+( 1 - (embedding <=> CAST(:embedding_array AS vector)) ) AS similarity
+FROM terminology
+WHERE embedding IS NOT NULL AND oid = :oid
 AND (specific_ds = false OR specific_ds IS NULL)
-ORDER BY similarity DESC
+ORDER BY embedding <=> CAST(:embedding_array AS vector)
 LIMIT {settings.EMBEDDING_TERMINOLOGY_TOP_COUNT}
+) TEMP
+WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY}
+ORDER BY similarity DESC
 """
 
 embedding_sql_with_datasource = f"""
 SELECT id, pid, word, similarity
 FROM
-(SELECT id, pid, word, oid, specific_ds, datasource_ids,
-( 1 - (embedding <=> :embedding_array) ) AS similarity
-FROM terminology AS child
-) TEMP
-WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY} AND oid = :oid
+(SELECT id, pid, word,
+( 1 - (embedding <=> CAST(:embedding_array AS vector)) ) AS similarity
+FROM terminology
+WHERE embedding IS NOT NULL AND oid = :oid
 AND (
     (specific_ds = false OR specific_ds IS NULL)
      OR
     (specific_ds = true AND datasource_ids IS NOT NULL AND datasource_ids @> jsonb_build_array(:datasource))
 )
-ORDER BY similarity DESC
+ORDER BY embedding <=> CAST(:embedding_array AS vector)
 LIMIT {settings.EMBEDDING_TERMINOLOGY_TOP_COUNT}
+) TEMP
+WHERE similarity > {settings.EMBEDDING_TERMINOLOGY_SIMILARITY}
+ORDER BY similarity DESC
 """
 
 
@@ -531,9 +527,7 @@ def select_terminology_by_word(session: SessionDep, word: str, oid: int, datasou
     if settings.EMBEDDING_ENABLED:
         with session.begin_nested():
             try:
-                model = EmbeddingModelCache.get_model()
-
-                embedding = model.embed_query(word)
+                embedding = embed_query(word)
 
                 if datasource is not None:
                     results = session.execute(text(embedding_sql_with_datasource),
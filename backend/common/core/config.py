@@ -91,6 +91,11 @@ class Settings(BaseSettings):
 
     LOCAL_MODEL_PATH: str = './data/models'
     DEFAULT_EMBEDDING_MODEL: str = 'shibing624/text2vec-base-chinese'
+    # size of the vectors of DEFAULT_EMBEDDING_MODEL, the vector columns and their ANN indexes are migrated with it
+    EMBEDDING_DIMENSION: int = 768
+    EMBEDDING_BACKEND: Literal["torch", "onnx"] = "torch"  # onnx needs the optional onnx dependencies
+    EMBEDDING_ONNX_QUANTIZE: bool = True  # int8 dynamic quantization of the onnx model
+    EMBEDDING_ONNX_THREADS: int = 0  # onnxruntime intra op threads, 0 means onnxruntime default
     EMBEDDING_ENABLED: bool = True
     EMBEDDING_DEFAULT_SIMILARITY: float = 0.4
     EMBEDDING_TERMINOLOGY_SIMILARITY: float = EMBEDDING_DEFAULT_SIMILARITY
@@ -98,9 +103,35 @@ class Settings(BaseSettings):
     EMBEDDING_DEFAULT_TOP_COUNT: int = 20
     EMBEDDING_TERMINOLOGY_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
     EMBEDDING_DATA_TRAINING_TOP_COUNT: int = EMBEDDING_DEFAULT_TOP_COUNT
+    EMBEDDING_QUERY_CACHE_SIZE: int = 1024  # recent question vectors kept in memory, 0 disables
+    EMBEDDING_BATCH_SIZE: int = 64  # texts per embed_documents call and per write when saving embeddings
+    EMBEDDING_CHECKPOINT_PATH: str = './data/embedding'
+    EMBEDDING_CACHE_ENABLED: bool = True  # reuse vectors of texts embedded before, stored in embedding_cache
+    EMBEDDING_WORKER_COUNT: int = 0  # background embedding workers, 0 means min(4, cpu count)
+    EMBEDDING_QUEUE_MAX_SIZE: int = 10000  # ids waiting to be embedded, ids beyond are cleared and left to the backfill
 
     GENERATE_SQL_QUERY_LIMIT_ENABLED: bool = True
 
+    # chat tasks as coroutines of the request loop, llm output read with astream and blocking steps
+    # (database, datasource drivers, embedding) on the chat executor, instead of one worker thread per task
+    CHAT_ASYNC_PIPELINE_ENABLED: bool = False
+    CHAT_ASYNC_CONCURRENCY: int = 200  # chat tasks running at once on the async path, later ones wait
+    # steps loading the datasource context of a question (schema, terminologies, data training, connection
+    # check, version) running at once for one request
+    CHAT_PREPARE_CONCURRENCY: int = 5
+
+    # sql answers of first questions reused for similar questions (same datasource schema and permissions,
+    # same day: the sql prompt carries the current date). Opt-in, close questions such as "this month" and
+    # "last month" can be more similar than the threshold
+    CHAT_SQL_CACHE_ENABLED: bool = False
+    CHAT_SQL_CACHE_SIMILARITY: float = 0.98
+    CHAT_SQL_CACHE_MAX_AGE: int = 24 * 3600  # seconds, answers of an earlier day are never reused
+
+    # llm calls running at once, per model and per workspace, 0 means no limit; later calls queue
+    LLM_MODEL_CONCURRENCY: int = 20
+    LLM_WORKSPACE_CONCURRENCY: int = 10
+    LLM_QUEUE_TIMEOUT: int = 60  # seconds a call waits for a slot before the request fails
+
     PARSE_REASONING_BLOCK_ENABLED: bool = True
     DEFAULT_REASONING_CONTENT_START: str = '<think>'
     DEFAULT_REASONING_CONTENT_END: str = '</think>'
@@ -110,8 +141,40 @@ class Settings(BaseSettings):
     PG_POOL_RECYCLE: int = 3600
     PG_POOL_PRE_PING: bool = True
 
+    # datasource engine pool, one engine per datasource configuration
+    DS_POOL_SIZE: int = 5
+    DS_POOL_MAX_OVERFLOW: int = 10
+    DS_POOL_RECYCLE: int = 1800
+    DS_POOL_PRE_PING: bool = True
+    DS_ENGINE_IDLE_TIMEOUT: int = 1800  # seconds, 0 means never evict idle engines
+    DS_ENGINE_MAX_COUNT: int = 100
+    DS_DRIVER_POOL_PING_INTERVAL: int = 30  # seconds idle before a py_driver connection is checked on borrow
+
+    SQL_EXEC_FETCH_SIZE: int = 1000
+
+    # cache of SELECT results per datasource, stored in the CACHE_TYPE backend
+    # off by default: a cached result may be up to SQL_RESULT_CACHE_TTL seconds older than the datasource
+    SQL_RESULT_CACHE_ENABLED: bool = False
+    SQL_RESULT_CACHE_TTL: int = 300  # seconds
+    SQL_RESULT_CACHE_DS_MAX_BYTES: int = 32 * 1024 * 1024  # cached results of one datasource
+    SQL_RESULT_CACHE_MAX_ENTRY_BYTES: int = 4 * 1024 * 1024  # larger results are not cached
+
+    # tables, checked fields and formatted '# Table:' prompt fragments per datasource, in process memory
+    SCHEMA_CACHE_TTL: int = 300  # seconds, bounds staleness of changes made by another worker
+
+    # background table and field sync of datasources
+    DS_SYNC_WORKER_COUNT: int = 2
+    DS_SYNC_BATCH_TABLES: int = 100  # tables per batch, progress is saved after each one
+    DS_SYNC_JOB_STALE: int = 600  # seconds without a heartbeat before a running job is taken over
+    DS_INTROSPECTION_CONCURRENCY: int = 8  # metadata queries in flight per datasource when read table by table
+
+    PERMISSION_CACHE_TTL: int = 30  # seconds, bounds staleness of permission changes made by another worker
+
     TABLE_EMBEDDING_ENABLED: bool = True
     TABLE_EMBEDDING_COUNT: int = 20
+    EMBEDDING_INDEX_TTL: int = 600  # seconds an in-memory table/datasource vector index is reused
+    # datasources with more embedded tables than this are ranked by the hnsw index in the database
+    EMBEDDING_INDEX_MAX_ROWS: int = 20000
     DS_EMBEDDING_COUNT: int = 20
 
     ORACLE_CLIENT_PATH: str = '/opt/sqlbot/db_client/oracle_instant_client'
@@ -0,0 +1,161 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+from common.utils.utils import SQLBotLogUtil
+
+# smaller runs first
+PRIORITY_SAVE = 1
+PRIORITY_BACKFILL = 2
+
+
+class _Job:
+    def __init__(self, key: str, func: Callable, priority: int, ids: Optional[dict]):
+        self.key = key
+        self.func = func
+        self.priority = priority
+        # insertion ordered set, None for jobs without ids
+        self.ids = ids
+
+    def size(self) -> int:
+        return len(self.ids) if self.ids is not None else 1
+
+
+class EmbeddingScheduler:
+    """Runs embedding jobs on a few worker threads.
+    A job waiting in the queue absorbs later submits of the same key, its ids are merged.
+    Pending work is bounded by max_pending ids, submit never waits: ids that do not fit are dropped."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(workers, 1)
+        self.max_pending = max(max_pending, 1)
+        self._cond = threading.Condition()
+        self._heap: list[tuple[int, int, str]] = []
+        self._jobs: dict[str, _Job] = {}
+        self._pending = 0
+        self._running = 0
+        self._seq = itertools.count()
+        self._threads: list[threading.Thread] = []
+
+    def submit(self, key: str, func: Callable, ids: Optional[Iterable[int]] = None,
+               priority: int = PRIORITY_SAVE, on_drop: Optional[Callable[[list], None]] = None) -> bool:
+        """func is called with the merged id list, or without arguments when ids is None.
+        Called from request threads, so it never waits. When the ids do not fit in the queue they are dropped,
+        on_drop is called with them and False is returned. Jobs without ids are always accepted."""
+        new_ids = list(dict.fromkeys(ids)) if ids is not None else None
+        with self._cond:
+            self._start_workers()
+            job = self._jobs.get(key)
+            if job is not None and (new_ids is None or job.ids is None):
+                # the same job is already waiting
+                return True
+            added = [i for i in new_ids if i not in job.ids] if job is not None else (
+                new_ids if new_ids is not None else [None])
+            if not added:
+                return True
+            fits = new_ids is None or self._pending == 0 or self._pending + len(added) <= self.max_pending
+            if fits:
+                self._admit(key, func, priority, job, new_ids, added)
+        if not fits:
+            SQLBotLogUtil.warning(f"Embedding queue is full ({self._pending} pending), "
+                                  f"{len(added)} ids of job {key} dropped")
+            if on_drop:
+                try:
+                    on_drop(added)
+                except Exception as e:
+                    SQLBotLogUtil.error(f"Handle dropped ids of embedding job {key} failed: {e}")
+        return fits
+
+    def _admit(self, key: str, func: Callable, priority: int, job: Optional[_Job], new_ids: Optional[list],
+               added: list):
+        # called holding _cond
+        self._pending += len(added)
+        if job is not None:
+            job.ids.update(dict.fromkeys(added))
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heappush(self._heap, (priority, next(self._seq), key))
+            return
+
+        self._jobs[key] = _Job(key, func, priority, dict.fromkeys(new_ids) if new_ids is not None else None)
+        heapq.heappush(self._heap, (priority, next(self._seq), key))
+        self._cond.notify_all()
+
+    def _start_workers(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'embedding-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self) -> _Job:
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, _, key = heapq.heappop(self._heap)
+                    job = self._jobs.pop(key, None)
+                    # stale heap entries of coalesced jobs are skipped
+                    if job is not None:
+                        self._running += 1
+                        return job
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                if job.ids is None:
+                    job.func()
+                else:
+                    job.func(list(job.ids))
+            except Exception as e:
+                SQLBotLogUtil.error(f"Embedding job {job.key} failed: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._pending -= job.size()
+                    self._cond.notify_all()
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait until nothing is queued or running."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+
+def default_worker_count(configured: int) -> int:
+    return configured if configured > 0 else min(4, os.cpu_count() or 1)
+
+
+# online (question) embeddings in progress, background backfill yields to them
+_online = 0
+_online_cond = threading.Condition()
+
+
+@contextmanager
+def online_embedding():
+    global _online
+    with _online_cond:
+        _online += 1
+    try:
+        yield
+    finally:
+        with _online_cond:
+            _online -= 1
+            _online_cond.notify_all()
+
+
+def wait_online_idle(timeout: float = 5):
+    """Called by background jobs between batches, waits a bounded time for online embeddings to finish."""
+    with _online_cond:
+        _online_cond.wait_for(lambda: _online == 0, timeout)
@@ -1,9 +1,14 @@
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
+import threading
+from typing import Any, Callable, List
 
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-executor = ThreadPoolExecutor(max_workers=200)
+from common.core.config import settings
+from common.utils.embedding_scheduler import EmbeddingScheduler, default_worker_count, PRIORITY_BACKFILL
+
+# embedding is cpu bound, a few workers leave the cores to chat requests
+scheduler = EmbeddingScheduler(workers=default_worker_count(settings.EMBEDDING_WORKER_COUNT),
+                               max_pending=settings.EMBEDDING_QUEUE_MAX_SIZE)
 
 from common.core.db import engine
 
@@ -13,36 +18,91 @@ session_maker = scoped_session(sessionmaker(bind=engine))
 # session = session_maker()
 
 
+# ids dropped by a full queue per save job, cleared by one requeue job
+_dropped: dict[str, dict] = {}
+_dropped_lock = threading.Lock()
+
+
+def _requeue_dropped(key: str, model, where: Callable[[list], Any], backfill: Callable) -> Callable[[list], None]:
+    """on_drop of a save job. The rows keep the embedding of the old text unless it is cleared, so the dropped
+    ids are cleared by a job without ids, always accepted, and the backfill picks up the empty rows.
+    The request thread only records the ids, later drops merge into the waiting job."""
+
+    def clear_and_backfill():
+        from sqlmodel import Session
+
+        from apps.ai_model.embedding_backfill import clear_embeddings
+        with _dropped_lock:
+            ids = list(_dropped.pop(key, {}))
+        if not ids:
+            return
+        with Session(engine) as session:
+            clear_embeddings(session, model, where(ids))
+        backfill()
+
+    def on_drop(ids: list):
+        with _dropped_lock:
+            _dropped.setdefault(key, {}).update(dict.fromkeys(ids))
+        scheduler.submit(f'{key}_requeue', clear_and_backfill)
+
+    return on_drop
+
+
+def warm_up_embedding():
+    from apps.ai_model.embedding import warm_up_embedding_model
+    # queued ahead of the backfill jobs, which would otherwise load the model first
+    scheduler.submit('warm_up', warm_up_embedding_model)
+
+
 def run_save_terminology_embeddings(ids: List[int]):
+    from sqlalchemy import or_
+
     from apps.terminology.curd.terminology import save_embeddings
-    executor.submit(save_embeddings, session_maker, ids)
+    from apps.terminology.models.terminology_model import Terminology
+    scheduler.submit('terminology', lambda _ids: save_embeddings(session_maker, _ids), ids,
+                     on_drop=_requeue_dropped(
+                         'terminology', Terminology,
+                         lambda _ids: or_(Terminology.id.in_(_ids), Terminology.pid.in_(_ids)),
+                         fill_empty_terminology_embeddings))
 
 
 def fill_empty_terminology_embeddings():
     from apps.terminology.curd.terminology import run_fill_empty_embeddings
-    executor.submit(run_fill_empty_embeddings, session_maker)
+    scheduler.submit('terminology_backfill', lambda: run_fill_empty_embeddings(session_maker),
+                     priority=PRIORITY_BACKFILL)
 
 
 def run_save_data_training_embeddings(ids: List[int]):
     from apps.data_training.curd.data_training import save_embeddings
-    executor.submit(save_embeddings, session_maker, ids)
+    from apps.data_training.models.data_training_model import DataTraining
+    scheduler.submit('data_training', lambda _ids: save_embeddings(session_maker, _ids), ids,
+                     on_drop=_requeue_dropped('data_training', DataTraining, lambda _ids: DataTraining.id.in_(_ids),
+                                              fill_empty_data_training_embeddings))
 
 
 def fill_empty_data_training_embeddings():
     from apps.data_training.curd.data_training import run_fill_empty_embeddings
-    executor.submit(run_fill_empty_embeddings, session_maker)
+    scheduler.submit('data_training_backfill', lambda: run_fill_empty_embeddings(session_maker),
+                     priority=PRIORITY_BACKFILL)
 
 
 def run_save_table_embeddings(ids: List[int]):
     from apps.datasource.crud.table import save_table_embedding
-    executor.submit(save_table_embedding, session_maker, ids)
+    from apps.datasource.models.datasource import CoreTable
+    scheduler.submit('table', lambda _ids: save_table_embedding(session_maker, _ids), ids,
+                     on_drop=_requeue_dropped('table', CoreTable, lambda _ids: CoreTable.id.in_(_ids),
+                                              fill_empty_table_and_ds_embeddings))
 
 
 def run_save_ds_embeddings(ids: List[int]):
     from apps.datasource.crud.table import save_ds_embedding
-    executor.submit(save_ds_embedding, session_maker, ids)
+    from apps.datasource.models.datasource import CoreDatasource
+    scheduler.submit('datasource', lambda _ids: save_ds_embedding(session_maker, _ids), ids,
+                     on_drop=_requeue_dropped('datasource', CoreDatasource, lambda _ids: CoreDatasource.id.in_(_ids),
+                                              fill_empty_table_and_ds_embeddings))
 
 
 def fill_empty_table_and_ds_embeddings():
     from apps.datasource.crud.table import run_fill_empty_table_and_ds_embedding
-    executor.submit(run_fill_empty_table_and_ds_embedding, session_maker)
+    scheduler.submit('table_and_ds_backfill', lambda: run_fill_empty_table_and_ds_embedding(session_maker),
+                     priority=PRIORITY_BACKFILL)
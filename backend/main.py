@@ -14,7 +14,9 @@ from starlette.middleware.cors import CORSMiddleware
 
 from alembic import command
 from apps.api import api_router
-from common.utils.embedding_threads import fill_empty_table_and_ds_embeddings
+from apps.datasource.crud.sync_job import resume_sync_jobs
+from apps.db.engine_pool import dispose_all_engines
+from common.utils.embedding_threads import fill_empty_table_and_ds_embeddings, warm_up_embedding
 from apps.system.crud.aimodel_manage import async_model_info
 from apps.system.crud.assistant import init_dynamic_cors
 from apps.system.middleware.auth import TokenMiddleware
@@ -79,9 +81,11 @@ async def lifespan(app: FastAPI):
         run_migrations()
         init_sqlbot_cache()
         init_dynamic_cors(app)
+        warm_up_embedding()
         init_terminology_embedding_data()
         init_data_training_embedding_data()
         init_table_and_ds_embedding()
+        resume_sync_jobs()
         SQLBotLogUtil.info("✅ SQLBot 初始化完成")
         await async_model_info()  # 异步加密已有模型的密钥和地址
     except Exception as e:
@@ -90,6 +94,7 @@ async def lifespan(app: FastAPI):
     # License functionality removed
     # await sqlbot_xpack.core.clean_xpack_cache()
     yield
+    dispose_all_engines()
     SQLBotLogUtil.info("SQLBot 应用关闭")
 
 
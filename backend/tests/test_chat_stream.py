@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('langchain')
+
+from langchain_core.messages import AIMessageChunk  # noqa: E402
+
+from apps.chat.task.llm import aprocess_stream, process_stream  # noqa: E402
+
+
+def _chunks():
+    parts = ['<th', 'ink>先看', '表结构</think>', 'SELECT ', '1']
+    chunks = [AIMessageChunk(content=part) for part in parts]
+    chunks[-1].usage_metadata = {'input_tokens': 3, 'output_tokens': 5, 'total_tokens': 8}
+    return chunks
+
+
+async def _astream(chunks):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+async def _collect(res):
+    return [chunk async for chunk in res]
+
+
+def test_aprocess_stream_matches_process_stream():
+    """测试 astream 结果的解析(思考标签、token 用量)与 stream 一致"""
+    usage, async_usage = {}, {}
+    expected = list(process_stream(iter(_chunks()), usage))
+    actual = asyncio.run(_collect(aprocess_stream(_astream(_chunks()), async_usage)))
+    assert actual == expected
+    assert async_usage == usage == {'input_tokens': 3, 'output_tokens': 5, 'total_tokens': 8}
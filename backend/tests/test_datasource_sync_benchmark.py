@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+import pytest
+
+TABLES = 1500
+COLUMNS = 30
+SCHEMA = 'sqlbot_sync_bench'
+DS_ID = -1
+
+
+@pytest.mark.skipif(not os.environ.get('SQLBOT_BENCHMARK'),
+                    reason='set SQLBOT_BENCHMARK=1 and the POSTGRES_* settings to run benchmarks')
+def test_datasource_sync_benchmark():
+    """1500 张表的数据源同步: 逐表读取字段 vs 一次读取全部字段, 以及批量 upsert 耗时"""
+    from sqlalchemy import text
+    from sqlmodel import Session
+
+    from apps.datasource.crud.datasource import save_tables_and_fields
+    from apps.datasource.models.datasource import CoreDatasource, CoreField, CoreTable
+    from apps.datasource.utils.utils import aes_encrypt
+    from apps.db.db import get_fields, get_fields_by_tables
+    from common.core.config import settings
+    from common.core.db import engine
+
+    columns = ', '.join(f'c{i} varchar(64)' for i in range(COLUMNS))
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA {SCHEMA}'))
+        conn.execute(text(f"""
+            DO $$ BEGIN
+            FOR i IN 1..{TABLES} LOOP
+                EXECUTE format('CREATE TABLE {SCHEMA}.t_%s (id bigint, {columns})', i);
+            END LOOP;
+            END $$"""))
+
+    conf = {'host': settings.POSTGRES_SERVER, 'port': settings.POSTGRES_PORT, 'username': settings.POSTGRES_USER,
+            'password': settings.POSTGRES_PASSWORD, 'database': settings.POSTGRES_DB, 'dbSchema': SCHEMA}
+    ds = CoreDatasource(id=DS_ID, type='pg', configuration=aes_encrypt(json.dumps(conf)).decode())
+    table_names = [f't_{i}' for i in range(1, TABLES + 1)]
+    try:
+        start = time.perf_counter()
+        legacy = {name: get_fields(ds, name) for name in table_names}
+        legacy_cost = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fields_by_table = get_fields_by_tables(ds, table_names)
+        bulk_cost = time.perf_counter() - start
+        assert {k: [f.fieldName for f in v] for k, v in legacy.items()} == \
+               {k: [f.fieldName for f in v] for k, v in fields_by_table.items()}
+
+        tables = [CoreTable(table_name=name, table_comment='') for name in table_names]
+        costs = []
+        with Session(engine) as session:
+            # first sync inserts everything, the second one updates everything
+            for _ in range(2):
+                start = time.perf_counter()
+                save_tables_and_fields(session, ds, tables, fields_by_table)
+                costs.append(time.perf_counter() - start)
+            assert session.query(CoreField).filter(CoreField.ds_id == DS_ID).count() == TABLES * (COLUMNS + 1)
+    finally:
+        with Session(engine) as session:
+            session.query(CoreField).filter(CoreField.ds_id == DS_ID).delete(synchronize_session=False)
+            session.query(CoreTable).filter(CoreTable.ds_id == DS_ID).delete(synchronize_session=False)
+            session.commit()
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE'))
+
+    print(f"\n{TABLES} tables x {COLUMNS + 1} columns: fields {legacy_cost:.2f}s -> {bulk_cost:.2f}s, "
+          f"upsert insert {costs[0]:.2f}s, update {costs[1]:.2f}s")
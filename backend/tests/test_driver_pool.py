@@ -0,0 +1,32 @@
+from apps.db.driver_pool import DriverConnectionPool
+
+
+class _Conn:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_applies_timeout_per_acquire():
+    """测试连接池按每次借用的超时建立连接, 不同超时共用同一个池"""
+    created = []
+
+    def creator(timeout):
+        created.append(_Conn(timeout))
+        return created[-1]
+
+    pool = DriverConnectionPool(1, creator, max_size=2, max_idle=2, max_lifetime=0)
+    with pool.connection(10) as conn:
+        assert conn.timeout == 10
+    with pool.connection(30) as conn:
+        # the idle connection is reused
+        assert conn is created[0]
+        with pool.connection(30) as other:
+            assert other.timeout == 30
+    assert pool.checkedout() == 0 and pool.checkedin() == 2
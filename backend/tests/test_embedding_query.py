@@ -0,0 +1,39 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('langchain_huggingface')
+
+from apps.ai_model import embedding  # noqa: E402
+
+
+class _SlowModel:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed_query(self, text):
+        with self._lock:
+            self.calls += 1
+        time.sleep(0.05)
+        return [float(len(text))]
+
+
+def test_embed_query_once_for_concurrent_steps(monkeypatch):
+    """测试同一请求中并发的步骤只计算一次问题向量"""
+    model = _SlowModel()
+    monkeypatch.setattr(embedding.EmbeddingModelCache, 'get_model', staticmethod(lambda *args, **kwargs: model))
+    monkeypatch.setattr(embedding.settings, 'EMBEDDING_QUERY_CACHE_SIZE', 0)
+    cache = {}
+
+    def step():
+        with embedding.embedding_scope(cache):
+            return embedding.embed_query('上个月各地区的销售额')
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: step(), range(4)))
+    assert results == [[10.0]] * 4
+    assert model.calls == 1
+    assert embedding._pending == {}
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from common.utils.embedding_scheduler import (
+    PRIORITY_BACKFILL,
+    PRIORITY_SAVE,
+    EmbeddingScheduler,
+)
+
+
+def test_scheduler_coalesces_and_orders_jobs():
+    """测试同类任务合并 id、保存任务优先于回填任务"""
+    scheduler = EmbeddingScheduler(workers=1, max_pending=100)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit('blocker', blocker)
+    assert started.wait(5)
+    # the only worker is busy, the following jobs wait in the queue
+    scheduler.submit('backfill', lambda: calls.append('backfill'), priority=PRIORITY_BACKFILL)
+    scheduler.submit('table', lambda ids: calls.append(('table', ids)), [1, 2])
+    scheduler.submit('table', lambda ids: calls.append(('table', ids)), [2, 3], priority=PRIORITY_SAVE)
+    scheduler.submit('backfill', lambda: calls.append('backfill'), priority=PRIORITY_BACKFILL)
+    release.set()
+
+    assert scheduler.join(5)
+    assert calls == [('table', [1, 2, 3]), 'backfill']
+
+
+def test_scheduler_backpressure():
+    """测试队列满时提交不等待, 丢弃的 id 交给 on_drop, 无 id 的回填任务仍可提交"""
+    scheduler = EmbeddingScheduler(workers=1, max_pending=2)
+    started, release = threading.Event(), threading.Event()
+    dropped = []
+
+    def blocker(_ids):
+        started.set()
+        release.wait(5)
+
+    scheduler.submit('blocker', blocker, [1, 2])
+    assert started.wait(5)
+    scheduler.submit('waiting', lambda ids: None, [1, 2])
+    start = time.monotonic()
+    assert not scheduler.submit('table', lambda ids: None, [3, 4], on_drop=dropped.extend)
+    assert time.monotonic() - start < 0.5
+    assert dropped == [3, 4]
+    assert scheduler.submit('backfill', lambda: None, priority=PRIORITY_BACKFILL)
+    release.set()
+    assert scheduler.join(5)
+    assert scheduler.submit('table', lambda ids: None, [3])
+    assert scheduler.join(5)
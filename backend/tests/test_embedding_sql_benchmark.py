@@ -0,0 +1,62 @@
+import os
+import random
+import time
+
+import pytest
+
+ROWS = 100_000
+DIM = 768
+
+# the query before the rewrite: similarity of every row is computed, then filtered
+legacy_sql = """
+SELECT id, pid, word, similarity
+FROM
+(SELECT id, pid, word, oid, specific_ds, datasource_ids,
+( 1 - (embedding <=> :embedding_array) ) AS similarity
+FROM terminology_bench AS child
+) TEMP
+WHERE similarity > 0.4 AND oid = :oid
+AND (specific_ds = false OR specific_ds IS NULL)
+ORDER BY similarity DESC
+LIMIT 20
+"""
+
+
+@pytest.mark.skipif(not os.environ.get('SQLBOT_BENCHMARK'),
+                    reason='set SQLBOT_BENCHMARK=1 and the POSTGRES_* settings to run benchmarks')
+def test_terminology_embedding_sql_benchmark():
+    """100k 条术语: 全表计算相似度 vs hnsw 索引 ORDER BY ... LIMIT"""
+    from sqlalchemy import text
+
+    from apps.terminology.curd.terminology import embedding_sql
+    from common.core.db import engine
+
+    new_sql = embedding_sql.replace('FROM terminology\n', 'FROM terminology_bench\n')
+    with engine.connect() as conn:
+        conn.execute(text(f"""
+            CREATE TEMP TABLE terminology_bench (id bigint, pid bigint, word text, oid bigint, specific_ds boolean,
+            datasource_ids jsonb, embedding vector({DIM}))"""))
+        conn.execute(text(f"""
+            INSERT INTO terminology_bench
+            SELECT g, NULL, 'word_' || g, 1 + g % 3, false, NULL,
+                   (SELECT array_agg(random() - 0.5) FROM generate_series(1, {DIM}) WHERE g > 0)::vector({DIM})
+            FROM generate_series(1, {ROWS}) g"""))
+        conn.execute(text("CREATE INDEX ON terminology_bench USING hnsw (embedding vector_cosine_ops)"))
+        conn.execute(text("CREATE INDEX ON terminology_bench (oid)"))
+        conn.execute(text("ANALYZE terminology_bench"))
+
+        random.seed(1)
+        queries = [str([random.uniform(-0.5, 0.5) for _ in range(DIM)]) for _ in range(20)]
+        costs = {}
+        for name, sql in (('legacy', legacy_sql), ('hnsw', new_sql)):
+            start = time.perf_counter()
+            for query in queries:
+                conn.execute(text(sql), {'embedding_array': query, 'oid': 1}).fetchall()
+            costs[name] = (time.perf_counter() - start) / len(queries)
+        plan = '\n'.join(row[0] for row in conn.execute(
+            text('EXPLAIN ' + new_sql), {'embedding_array': queries[0], 'oid': 1}))
+        conn.rollback()
+
+    print(f"\n{ROWS} rows: {costs['legacy'] * 1000:.1f}ms -> {costs['hnsw'] * 1000:.1f}ms per question "
+          f"({costs['legacy'] / costs['hnsw']:.1f}x)\n{plan}")
+    assert 'terminology_bench_embedding_idx' in plan
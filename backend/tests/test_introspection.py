@@ -0,0 +1,42 @@
+import threading
+import time
+
+import pytest
+
+from apps.db.introspection import fetch_concurrently
+from common.core.config import settings
+
+
+def test_fetch_concurrently_respects_ds_limit(monkeypatch):
+    """测试逐表读取字段时并发执行, 且单个数据源的并发数不超过配置"""
+    monkeypatch.setattr(settings, 'DS_INTROSPECTION_CONCURRENCY', 3)
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def fetch(name):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return [name.upper()]
+
+    names = [f't{i}' for i in range(12)]
+    start = time.perf_counter()
+    result = fetch_concurrently(-2, names, fetch)
+    assert time.perf_counter() - start < 12 * 0.05
+    assert result == {name: [name.upper()] for name in names}
+    assert peak == 3
+
+
+def test_fetch_concurrently_raises_errors():
+    """测试单表读取失败时抛出异常"""
+    def fetch(name):
+        if name == 'bad':
+            raise ValueError(name)
+        return []
+
+    with pytest.raises(ValueError):
+        fetch_concurrently(-3, ['a', 'bad', 'b'], fetch)
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+import pytest
+
+from apps.ai_model.llm_limiter import LLMLimiter, LLMQueueTimeoutError
+
+
+async def _hold(limiter, model, oid, log, name, release: asyncio.Event, positions=None):
+    on_wait = positions.append if positions is not None else None
+    async with limiter.slot(model, oid, on_wait):
+        log.append(name)
+        await release.wait()
+
+
+def test_model_limit_fifo_and_positions():
+    """测试模型并发上限、先进先出与排队位置"""
+
+    async def run():
+        limiter = LLMLimiter(model_limit=1, oid_limit=0, timeout=5)
+        log, positions = [], []
+        release = asyncio.Event()
+        first = asyncio.create_task(_hold(limiter, 'm', 1, log, 'a', release))
+        await asyncio.sleep(0.01)
+        waiting = [asyncio.create_task(_hold(limiter, 'm', 1, log, name, release, positions if name == 'c' else None))
+                   for name in ('b', 'c')]
+        await asyncio.sleep(0.01)
+        assert log == ['a'] and limiter.stats()['waiting'] == 2
+        assert positions == [2]
+        release.set()
+        await asyncio.gather(first, *waiting)
+        assert log == ['a', 'b', 'c']
+        stats = limiter.stats()
+        assert stats['running'] == {} and stats['waiting'] == 0 and stats['queued'] == 2
+        assert stats['admitted'] == 3 and stats['max_queue_wait'] > 0
+
+    asyncio.run(run())
+
+
+def test_workspace_limit_does_not_block_other_workspaces():
+    """测试工作空间并发上限不会阻塞其他工作空间"""
+
+    async def run():
+        limiter = LLMLimiter(model_limit=3, oid_limit=1, timeout=5)
+        log = []
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(_hold(limiter, 'm', oid, log, name, release))
+                 for name, oid in (('a1', 1), ('a2', 1), ('b1', 2))]
+        await asyncio.sleep(0.01)
+        assert sorted(log) == ['a1', 'b1']
+        release.set()
+        await asyncio.gather(*tasks)
+        assert log[-1] == 'a2'
+
+    asyncio.run(run())
+
+
+def test_queue_timeout():
+    """测试排队超时报错且不占用名额"""
+
+    async def run():
+        limiter = LLMLimiter(model_limit=1, oid_limit=0, timeout=0.05)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(limiter, 'm', 1, [], 'a', release))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMQueueTimeoutError):
+            await limiter.acquire('m', 1)
+        release.set()
+        await holder
+        assert limiter.stats()['timeouts'] == 1 and limiter.stats()['running'] == {}
+
+    asyncio.run(run())
+
+
+def test_waiter_on_another_thread_loop():
+    """测试不同线程的事件循环共享名额"""
+    limiter = LLMLimiter(model_limit=1, oid_limit=0, timeout=5)
+    log = []
+    acquired = threading.Event()
+    release = threading.Event()
+
+    async def holder():
+        async with limiter.slot('m', 1):
+            acquired.set()
+            await asyncio.to_thread(release.wait)
+            log.append('holder')
+
+    thread = threading.Thread(target=lambda: asyncio.run(holder()))
+    thread.start()
+    acquired.wait(5)
+
+    async def waiter():
+        threading.Timer(0.05, release.set).start()
+        async with limiter.slot('m', 1):
+            log.append('waiter')
+
+    asyncio.run(waiter())
+    thread.join(5)
+    assert log == ['holder', 'waiter']
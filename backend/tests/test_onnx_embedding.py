@@ -0,0 +1,50 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('onnxruntime')
+pytest.importorskip('langchain_huggingface')
+
+from apps.ai_model.embedding import EmbeddingModelCache, local_embedding_model  # noqa: E402
+from apps.ai_model.onnx_embedding import OnnxEmbeddings  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(local_embedding_model.name),
+                                reason='local embedding model is not downloaded')
+
+TEXTS = ['上个月各地区的销售额是多少', '查询订单表中金额最高的10个客户', 'SQLBot',
+         '# Table: orders, 订单\n[\n(id:bigint),\n(amount:decimal, 订单金额)\n]\n'] * 8
+
+
+def _cosine(a, b) -> np.ndarray:
+    a, b = np.asarray(a), np.asarray(b)
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.mark.parametrize('quantize, min_cosine', [(False, 0.9999), (True, 0.99)])
+def test_onnx_matches_torch(quantize, min_cosine):
+    """测试 onnx (fp32 / int8) 与 torch 向量的余弦一致性"""
+    torch_vectors = EmbeddingModelCache._new_instance().embed_documents(TEXTS)
+    onnx_vectors = OnnxEmbeddings(local_embedding_model.name, quantize=quantize).embed_documents(TEXTS)
+    assert _cosine(torch_vectors, onnx_vectors).min() >= min_cosine
+
+
+@pytest.mark.skipif(not os.environ.get('SQLBOT_BENCHMARK'), reason='set SQLBOT_BENCHMARK=1 to run benchmarks')
+def test_onnx_throughput_benchmark():
+    """torch vs onnx fp32 vs onnx int8 吞吐"""
+    models = {'torch': EmbeddingModelCache._new_instance(),
+              'onnx': OnnxEmbeddings(local_embedding_model.name, quantize=False),
+              'onnx-int8': OnnxEmbeddings(local_embedding_model.name, quantize=True)}
+    lines = []
+    for name, model in models.items():
+        model.embed_query(TEXTS[0])
+        start = time.perf_counter()
+        for text in TEXTS:
+            model.embed_query(text)
+        query_cost = (time.perf_counter() - start) / len(TEXTS)
+        start = time.perf_counter()
+        model.embed_documents(TEXTS * 4)
+        docs_rate = len(TEXTS) * 4 / (time.perf_counter() - start)
+        lines.append(f'{name}: {query_cost * 1000:.1f}ms per query, {docs_rate:.0f} docs/s')
+    print('\n' + '\n'.join(lines))
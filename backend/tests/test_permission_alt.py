@@ -24,4 +24,34 @@ def test_convert_tree_to_sql():
     sql = convert_tree_to_sql(tree, "mysql")  
     assert "`age` > '18'" in sql  
     assert "`status` = 'active'" in sql  
-    assert "AND" in sql
\ No newline at end of file
+    assert "AND" in sql
+
+def test_permission_index():
+    """测试预编译权限索引: 行权限按用户和表取出WHERE条件, 列权限按允许的字段过滤"""
+    import json
+    from apps.datasource.models.datasource import CoreDatasource, CoreField
+    from apps.permission_alt.models.permission_models import DsPermission, DsRules
+    from apps.permission_alt.utils.permission_index import PermissionIndex
+
+    fields = {7: CoreField(id=7, field_name='region', field_type='varchar'),
+              8: CoreField(id=8, field_name='amount', field_type='int')}
+    session = type('Session', (), {'get': lambda self, model, _id: fields.get(_id)})()
+    tree = {"logic": "and", "items": [{"type": "item", "field_id": 7, "term": "eq", "value": "east"}]}
+    permissions = [
+        DsPermission(id=1, type='row', ds_id=1, table_id=10, name='r', auth_target_type='USER',
+                     expression_tree=json.dumps(tree)),
+        DsPermission(id=2, type='column', ds_id=1, table_id=10, name='c', auth_target_type='USER',
+                     permissions=json.dumps([{"field_id": 7, "enable": True}, {"field_id": 8, "enable": False}])),
+    ]
+    rules = [DsRules(id=1, name='g', enable=True, permission_list='[1, 2]', user_list='["2"]'),
+             DsRules(id=2, name='off', enable=False, permission_list='[1]', user_list='[3]')]
+    index = PermissionIndex(rules, permissions)
+    ds = CoreDatasource(id=1, type='mysql')
+
+    assert index.row_filter(session, 2, 10, ds) == "(`region` = 'east')"
+    assert index.row_filter(session, 3, 10, ds) == ''
+    assert index.row_filter(session, 2, 11, ds) == ''
+    assert [f.id for f in index.column_fields(2, 10, list(fields.values()))] == [7]
+    assert [f.id for f in index.column_fields(4, 10, list(fields.values()))] == [7, 8]
+    assert index.permission_key(2, 1) == 'row:1;column:2'
+    assert index.permission_key(3, 1) == ''
@@ -0,0 +1,73 @@
+import datetime
+from contextlib import contextmanager
+from unittest import mock
+
+from apps.db import result_cache
+from apps.db.result_cache import (
+    cached_exec,
+    invalidate_ds_result_cache,
+    is_cacheable_sql,
+    normalize_sql,
+)
+
+
+class _Ds:
+    def __init__(self, id, configuration='conf'):
+        self.id = id
+        self.type = 'pg'
+        self.configuration = configuration
+
+
+@contextmanager
+def _memory_cache():
+    with mock.patch.object(result_cache, '_backend', result_cache._MemoryResultCache()), \
+            mock.patch.object(result_cache.settings, 'SQL_RESULT_CACHE_ENABLED', True), \
+            mock.patch.object(result_cache.settings, 'CACHE_TYPE', 'memory'):
+        yield
+
+
+def test_normalize_sql():
+    """测试注释、空白、关键字大小写不影响缓存键"""
+    assert normalize_sql('select  a\n from t -- comment\n') == normalize_sql('SELECT a FROM t')
+    assert is_cacheable_sql('with x as (select 1) select * from x')
+    assert not is_cacheable_sql('delete from t')
+    assert not is_cacheable_sql('select 1; delete from t')
+
+
+def test_cached_exec():
+    """测试缓存命中、绕过、失效及按数据源占用字节数 LRU 淘汰"""
+    calls = []
+
+    def execute(value):
+        def inner():
+            calls.append(value)
+            return {'fields': ['a'], 'data': [{'a': value}]}
+
+        return inner
+
+    # room for two results of this size
+    max_bytes = 2 * len(result_cache._dumps({'fields': ['a'], 'data': [{'a': 0}]}))
+    with _memory_cache(), mock.patch.object(result_cache.settings, 'SQL_RESULT_CACHE_DS_MAX_BYTES', max_bytes):
+        ds = _Ds(1)
+        assert cached_exec(ds, 'select 1', False, 10, True, execute(1))['data'] == [{'a': 1}]
+        assert cached_exec(ds, 'SELECT 1', False, 10, True, execute(2))['data'] == [{'a': 1}]
+        assert cached_exec(ds, 'select 1', False, 10, False, execute(3))['data'] == [{'a': 3}]
+        assert cached_exec(_Ds(1, 'changed'), 'select 1', False, 10, True, execute(4))['data'] == [{'a': 4}]
+        # the first entry is the least recently used one
+        cached_exec(ds, 'select 2', False, 10, True, execute(5))
+        assert cached_exec(ds, 'select 1', False, 10, True, execute(6))['data'] == [{'a': 6}]
+
+        invalidate_ds_result_cache(1)
+        assert cached_exec(ds, 'select 1', False, 10, True, execute(7))['data'] == [{'a': 7}]
+        assert calls == [1, 3, 4, 5, 6, 7]
+
+
+def test_cached_exec_same_types():
+    """测试缓存未命中与命中返回相同的值类型"""
+    def execute():
+        return {'fields': ['d'], 'data': [{'d': datetime.datetime(2024, 1, 2, 3, 4, 5)}]}
+
+    with _memory_cache():
+        missed = cached_exec(_Ds(2), 'select d from t', False, 0, True, execute)
+        hit = cached_exec(_Ds(2), 'select d from t', False, 0, True, execute)
+    assert missed == hit == {'fields': ['d'], 'data': [{'d': '2024-01-02T03:04:05'}]}
@@ -0,0 +1,100 @@
+import base64
+import datetime
+import os
+import time
+from decimal import Decimal
+
+import orjson
+import pytest
+
+from apps.db.result_set import (
+    ColumnarResult,
+    is_columnar,
+    normalize_records,
+    normalize_rows,
+    to_columnar_result,
+    to_row_result,
+)
+
+
+def test_columnar_round_trip():
+    """测试行/列格式互转"""
+    fields = ['id', 'name', 'amount', 'flag', 'big']
+    rows = [
+        {'id': 1, 'name': 'a', 'amount': 1.5, 'flag': True, 'big': 2 ** 70},
+        {'id': None, 'name': None, 'amount': 2.0, 'flag': False, 'big': None},
+        {'id': 3, 'name': 'c', 'amount': None, 'flag': None, 'big': 5},
+    ]
+    columnar = ColumnarResult.from_rows(fields, rows)
+    assert [column.type for column in columnar.columns] == ['int', 'str', 'float', 'bool', 'object']
+    assert columnar.to_rows() == rows
+
+    fields = fields[:4]
+    rows = [{k: v for k, v in row.items() if k in fields} for row in rows]
+    stored = orjson.loads(orjson.dumps(ColumnarResult.from_rows(fields, rows).to_dict()))
+    assert ColumnarResult.from_dict(stored).to_rows() == rows
+
+
+def test_columnar_result_keeps_extra_keys():
+    """测试 exec_sql 结果转换保留其他字段"""
+    result = {'fields': ['x'], 'data': [{'x': 1}, {'x': None}], 'sql': 'c2VsZWN0IDE=', 'truncated': False}
+    columnar = to_columnar_result(result)
+    assert is_columnar(columnar)
+    assert 'data' not in columnar
+    assert columnar['sql'] == result['sql']
+    assert to_row_result(orjson.loads(orjson.dumps(columnar))) == result
+    assert to_row_result(result) is result
+
+
+def test_normalize_matches_row_by_row():
+    """测试按列批量处理与逐行逐单元格处理结果一致"""
+    rows = [(i, Decimal(i) / 8 if i % 5 else None, float(i) + 0.1 if i % 3 else float(i), 10 ** 16 + i, b'\x00\x01',
+             -123456789012345.0) for i in range(3000)]
+    fields = ['id', 'amount', 'ratio', 'big', 'raw', 'neg']
+    expected = [{f: legacy_format(legacy_prepare(float(v) if isinstance(v, Decimal) else v))
+                 for f, v in zip(fields, row, strict=True)} for row in rows]
+    assert normalize_records(normalize_rows(fields, rows), precision_safe=True) == expected
+    assert normalize_rows(fields, rows, precision_safe=True) == expected
+
+
+@pytest.mark.skipif(not os.environ.get('SQLBOT_BENCHMARK'), reason='set SQLBOT_BENCHMARK=1 to run benchmarks')
+def test_normalize_benchmark():
+    """100k 行结果: exec_sql 转换 + prepare_for_orjson + format_json_list_data vs 按列批量处理"""
+    fields = ['id', 'name', 'amount', 'price', 'create_time', 'big_id']
+    rows = [(i, f'name_{i}', Decimal(f'{i}.25'), i * 1.5, datetime.datetime(2025, 1, 1), 10 ** 17 + i)
+            for i in range(100_000)]
+
+    start = time.perf_counter()
+    legacy = [{str(fields[i]): float(value) if isinstance(value, Decimal) else value for i, value in enumerate(row)}
+              for row in rows]
+    legacy_exec_cost = time.perf_counter() - start
+    prepared = [{k: legacy_prepare(v) for k, v in row.items()} for row in legacy]
+    formatted = [{k: legacy_format(v) for k, v in row.items()} for row in prepared]
+    legacy_cost = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = normalize_rows(fields, rows)
+    batch_exec_cost = time.perf_counter() - start
+    stored = to_columnar_result({'fields': fields, 'data': result}, precision_safe=True)
+    batch_cost = time.perf_counter() - start
+
+    assert result == legacy
+    assert to_row_result(stored)['data'] == formatted
+    print(f'\nexec_sql rows: {legacy_exec_cost * 1000:.1f}ms -> {batch_exec_cost * 1000:.1f}ms, '
+          f'exec + save + format: {legacy_cost * 1000:.1f}ms -> {batch_cost * 1000:.1f}ms '
+          f'({legacy_cost / batch_cost:.1f}x)')
+
+
+def legacy_prepare(value):
+    return base64.b64encode(value).decode('utf-8') if isinstance(value, bytes) else value
+
+
+def legacy_format(value):
+    if isinstance(value, (int, float)):
+        if isinstance(value, int) and len(str(abs(value))) > 15:
+            return str(value)
+        elif isinstance(value, float):
+            decimal_str = format(value, '.16f').rstrip('0').rstrip('.')
+            if len(decimal_str) > 15:
+                return str(value)
+    return value
@@ -0,0 +1,36 @@
+from apps.datasource.utils.schema_cache import (
+    get_catalog,
+    get_fragment,
+    invalidate_schema_cache,
+)
+
+
+def test_schema_fragments_invalidated_per_table():
+    """测试表结构片段缓存: 修改单表只重建该表片段, 同步数据源时全部重建"""
+    ds_id = -1
+    builds = []
+
+    def build(name):
+        builds.append(name)
+        return f'# Table: {name}\n[\n]\n'
+
+    for _ in range(2):
+        assert get_fragment(ds_id, (1, 't1', (10,)), lambda: build('t1')) == '# Table: t1\n[\n]\n'
+        get_fragment(ds_id, (2, 't2', (20,)), lambda: build('t2'))
+    assert builds == ['t1', 't2']
+
+    invalidate_schema_cache(ds_id, [1])
+    get_fragment(ds_id, (1, 't1', (10,)), lambda: build('t1'))
+    get_fragment(ds_id, (2, 't2', (20,)), lambda: build('t2'))
+    assert builds == ['t1', 't2', 't1']
+
+    loads = []
+    assert get_catalog(ds_id, lambda: loads.append(1) or ([], {})) == ([], {})
+    get_catalog(ds_id, lambda: loads.append(1) or ([], {}))
+    assert len(loads) == 1
+
+    invalidate_schema_cache(ds_id)
+    get_catalog(ds_id, lambda: loads.append(1) or ([], {}))
+    get_fragment(ds_id, (2, 't2', (20,)), lambda: build('t2'))
+    assert len(loads) == 2
+    assert builds == ['t1', 't2', 't1', 't2']
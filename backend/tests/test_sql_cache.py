@@ -0,0 +1,78 @@
+import datetime
+import os
+
+import orjson
+import pytest
+
+pytest.importorskip('langchain_huggingface')
+
+from apps.chat.curd import sql_cache  # noqa: E402
+from apps.chat.curd.sql_cache import build_sql_cache_key  # noqa: E402
+from common.core.config import settings  # noqa: E402
+
+
+def test_sql_cache_key():
+    """测试缓存键: 不同权限、不同日期的用户不共用答案"""
+    key = build_sql_cache_key(1, 'v1', 'row:1;column:')
+    assert key == build_sql_cache_key(1, 'v1', 'row:1;column:')
+    assert key.permission_key != build_sql_cache_key(1, 'v1', '').permission_key
+    assert key.day == datetime.date.today()
+    assert key != build_sql_cache_key(1, 'v1', 'row:1;column:', datetime.date.today() - datetime.timedelta(days=1))
+
+
+def test_sql_cache_time_range(monkeypatch):
+    """测试只复用当天且未过期的答案"""
+    today = datetime.date.today()
+    min_time, max_time = sql_cache._time_range(build_sql_cache_key(1, 'v1', ''))
+    assert min_time >= datetime.datetime.combine(today, datetime.time.min)
+    assert max_time == datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time.min)
+
+    monkeypatch.setattr(settings, 'CHAT_SQL_CACHE_MAX_AGE', 60)
+    min_time, _ = sql_cache._time_range(build_sql_cache_key(1, 'v1', ''))
+    assert datetime.datetime.now() - min_time <= datetime.timedelta(seconds=61)
+
+
+def _vector(question: str) -> list[float]:
+    # questions with the same first character are similar
+    vector = [0.0] * settings.EMBEDDING_DIMENSION
+    vector[ord(question[0]) % settings.EMBEDDING_DIMENSION] = 1.0
+    vector[-1] = len(question) / 1000
+    return vector
+
+
+@pytest.mark.skipif(not os.environ.get('SQLBOT_DB_TEST'),
+                    reason='set SQLBOT_DB_TEST=1 and the POSTGRES_* settings to run database tests')
+def test_find_and_save_cached_sql(monkeypatch):
+    """测试缓存读写: 相似问题命中, 权限不同或表结构版本变化后不命中, 旧版本在保存时清理"""
+    from sqlmodel import Session, select
+
+    from apps.chat.models.chat_model import ChatRecord, ChatSqlCache
+    from common.core.db import engine
+
+    monkeypatch.setattr(sql_cache, 'embed_query', _vector)
+    monkeypatch.setattr(sql_cache, 'get_model_id', lambda: 'test-model')
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        # commits of the functions under test become savepoints, everything is rolled back at the end
+        session = Session(bind=conn, join_transaction_mode='create_savepoint')
+        try:
+            record = ChatRecord(chat_id=0, datasource=0, question='上月销售额', create_time=datetime.datetime.now(),
+                                sql_answer=orjson.dumps({'content': 'SELECT 1'}).decode())
+            session.add(record)
+            session.flush()
+            key = build_sql_cache_key(-1, 'v1', 'row:1;column:')
+            sql_cache.save_cached_sql(session, key, '上月销售额', record.id, 1200)
+
+            hit = sql_cache.find_cached_sql(session, key, '上月销售额是多少')
+            assert hit is not None and hit.answer == 'SELECT 1' and hit.generate_ms == 1200
+            assert sql_cache.find_cached_sql(session, key, '本月销售额') is None
+            assert sql_cache.find_cached_sql(session, build_sql_cache_key(-1, 'v1', ''), '上月销售额是多少') is None
+
+            new_version = build_sql_cache_key(-1, 'v2', 'row:1;column:')
+            assert sql_cache.find_cached_sql(session, new_version, '上月销售额是多少') is None
+            sql_cache.save_cached_sql(session, new_version, '上月销售额', record.id, 900)
+            versions = session.exec(select(ChatSqlCache.schema_version).where(ChatSqlCache.datasource == -1)).all()
+            assert versions == ['v2']
+        finally:
+            session.close()
+            transaction.rollback()
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+import sqlglot
+from sqlglot import exp
+
+from apps.db.constant import DB
+from apps.db.sql_limit import get_sqlglot_dialect, limit_sql
+from apps.permission_alt.utils.sql_rewriter import rewrite_sql_with_filters
+from apps.template.template import get_sql_template
+
+
+def _example_answers():
+    for db in DB:
+        template = get_sql_template(db)['template']
+        for key, value in template.items():
+            if key.startswith('example_answer'):
+                yield pytest.param(db, json.loads(value), id=f'{db.type}-{key}')
+
+
+@pytest.mark.parametrize('db,answer', list(_example_answers()))
+def test_rewrite_sql_examples(db, answer):
+    """测试模板示例 SQL 加行权限后: 原条件保留, 每个表都只读取过滤后的数据"""
+    table = answer['tables'][0]
+    condition = f"{db.prefix}country{db.suffix} = '中国'"
+    sql = rewrite_sql_with_filters(answer['sql'], [{'table': table, 'filter': condition}], db.type)
+    assert sql is not None
+
+    dialect = get_sqlglot_dialect(db.type)
+    origin = sqlglot.parse_one(answer['sql'], read=dialect)
+    tree = sqlglot.parse_one(sql, read=dialect)
+    expected = sqlglot.parse_one(condition, read=dialect)
+    tables = [t for t in tree.find_all(exp.Table) if t.name == table]
+    assert len(tables) == len([t for t in origin.find_all(exp.Table) if t.name == table])
+    for t in tables:
+        query = t.find_ancestor(exp.Select)
+        assert expected in list(query.args['where'].find_all(exp.EQ))
+        if db != DB.es:
+            # the outer query is unchanged apart from the table
+            assert query is not tree
+    if origin.args.get('where'):
+        for condition in origin.args['where'].find_all(exp.EQ):
+            assert condition in list(tree.find_all(exp.EQ))
+
+
+def test_rewrite_join_and_cte():
+    """测试多表关联、别名、CTE 与多个过滤条件"""
+    sql = ("WITH o AS (SELECT `o1`.`cid`, `o1`.`amount` FROM `shop`.`orders` `o1`) "
+           "SELECT `c`.`name`, SUM(`o`.`amount`) AS `total` FROM o "
+           "LEFT JOIN `shop`.`customers` `c` ON `c`.`id` = `o`.`cid` GROUP BY `c`.`name`")
+    filters = [{'table': 'orders', 'filter': "`region` = 'east'"},
+               {'table': 'customers', 'filter': "`vip` = '1' OR `level` > 3"},
+               {'table': 'customers', 'filter': ''},
+               {'table': 'o', 'filter': "`x` = 1"}]
+    result = rewrite_sql_with_filters(sql, filters, 'mysql')
+    assert result == ("WITH o AS (SELECT `o1`.`cid`, `o1`.`amount` FROM (SELECT * FROM `shop`.`orders` "
+                      "WHERE (`region` = 'east')) AS `o1`) SELECT `c`.`name`, SUM(`o`.`amount`) AS `total` FROM o "
+                      "LEFT JOIN (SELECT * FROM `shop`.`customers` WHERE (`vip` = '1' OR `level` > 3)) AS `c` "
+                      "ON `c`.`id` = `o`.`cid` GROUP BY `c`.`name`")
+
+
+def test_rewrite_cte_named_like_table():
+    """测试与表同名的 CTE: CTE 内读取的真实表仍加过滤条件, 对 CTE 的引用不加"""
+    filters = [{'table': 'orders', 'filter': "`region` = 'east'"}]
+    result = rewrite_sql_with_filters('WITH orders AS (SELECT * FROM orders) SELECT count(*) FROM orders',
+                                      filters, 'mysql')
+    assert result == ("WITH orders AS (SELECT * FROM (SELECT * FROM orders WHERE (`region` = 'east')) AS orders) "
+                      "SELECT COUNT(*) FROM orders")
+
+
+def test_rewrite_falls_back():
+    """测试无法解析或无法处理时返回 None, 由大模型处理"""
+    assert rewrite_sql_with_filters('SELEC name FROM', [{'table': 't', 'filter': 'a = 1'}], 'pg') is None
+    assert rewrite_sql_with_filters('SELECT "a" FROM "t" WHERE', [{'table': 't', 'filter': 'a = 1'}], 'pg') is None
+    assert rewrite_sql_with_filters('SELECT "a" FROM "t" JOIN "u" ON "t"."id" = "u"."id"',
+                                    [{'table': 't', 'filter': '"b" = 1'}], 'es') is None
+    assert rewrite_sql_with_filters('SELECT 1', [{'table': 't', 'filter': ''}], 'pg') == 'SELECT 1'
+
+
+def test_limit_sql():
+    """测试限制行数: 无 LIMIT 时追加, 较大的 LIMIT 被降低, 非查询语句不变"""
+    assert limit_sql('SELECT a FROM t -- note', 101, 'mysql') == 'SELECT a FROM t -- note\nLIMIT 101'
+    assert limit_sql('SELECT a FROM t LIMIT 10', 101, 'doris') == 'SELECT a FROM t LIMIT 10'
+    assert limit_sql('SELECT a FROM t LIMIT 20, 5000', 101, 'starrocks') == 'SELECT a FROM t LIMIT 101 OFFSET 20'
+    assert limit_sql('SELECT a FROM t UNION ALL SELECT b FROM u LIMIT 5000', 101, 'mysql') == \
+        'SELECT a FROM t UNION ALL SELECT b FROM u LIMIT 101'
+    assert limit_sql('SHOW TABLES', 101, 'mysql') == 'SHOW TABLES'
+    assert limit_sql('SELECT (', 101, 'mysql') == 'SELECT ('
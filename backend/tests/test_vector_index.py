@@ -0,0 +1,60 @@
+import math
+import random
+
+from apps.datasource.embedding.utils import cosine_similarity
+from apps.datasource.embedding.vector_index import VectorIndex
+
+
+def test_top_k_matches_cosine_similarity():
+    """测试矩阵 top-k 与逐个计算余弦相似度排序一致"""
+    random.seed(1)
+    vectors = {i: [random.uniform(-1, 1) for _ in range(32)] for i in range(200)}
+    query = [random.uniform(-1, 1) for _ in range(32)]
+    index = VectorIndex(list(vectors.keys()), list(vectors.values()))
+    assert len(index) == 200
+
+    expected = sorted(((i, cosine_similarity(query, v)) for i, v in vectors.items()), key=lambda x: x[1],
+                      reverse=True)
+    ranked = index.top_k(query, 20)
+    assert [i for i, _ in ranked] == [i for i, _ in expected[:20]]
+    assert all(math.isclose(a[1], b[1], abs_tol=1e-5) for a, b in zip(ranked, expected[:20], strict=True))
+
+    candidates = [5, 7, 11, 999]
+    ranked = index.top_k(query, 10, candidates)
+    assert [i for i, _ in ranked] == [i for i, _ in expected if i in candidates]
+
+
+class _Session:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def execute(self, _statement):
+        self.queries += 1
+        rows = self.rows
+
+        class _Result:
+            def scalar(self):
+                return len(rows)
+
+            def all(self):
+                return rows
+
+        return _Result()
+
+
+def test_table_index_cache(monkeypatch):
+    """测试内存索引按数据源缓存、写入后失效, 超过行数上限时交给数据库排序"""
+    from apps.datasource.embedding import vector_index
+
+    session = _Session([(1, [1.0, 0.0]), (2, [0.0, 1.0]), (3, None)])
+    index = vector_index.get_table_index(session, 1001)
+    assert [i for i, _ in index.top_k([1.0, 0.2], 2, [1, 2, 3])] == [1, 2]
+    assert vector_index.get_table_index(session, 1001) is index and session.queries == 2
+
+    vector_index.invalidate_table_index([1001])
+    assert vector_index.get_table_index(session, 1001) is not index and session.queries == 4
+
+    monkeypatch.setattr(vector_index.settings, 'EMBEDDING_INDEX_MAX_ROWS', 2)
+    assert vector_index.get_table_index(session, 1002) is None
+    vector_index.invalidate_table_index()
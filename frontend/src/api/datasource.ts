@@ -16,6 +16,7 @@ export const datasourceApi = {
   execSql: (id: number | string, sql: string) =>
     request.post(`/datasource/execSql/${id}`, { sql: sql }),
   chooseTables: (id: number, data: any) => request.post(`/datasource/chooseTables/${id}`, data),
+  latestSyncJob: (dsId: number) => request.get(`/datasource/syncJob/latest/${dsId}`),
   tableList: (id: number) => request.post(`/datasource/tableList/${id}`),
   fieldList: (id: number) => request.post(`/datasource/fieldList/${id}`),
   edit: (data: any) => request.post('/datasource/editLocalComment', data),
@@ -0,0 +1,47 @@
+import { datasourceApi } from '@/api/datasource'
+import { ElMessage } from 'element-plus-secondary'
+import { i18n } from '@/i18n'
+
+const t = i18n.global.t
+const POLL_INTERVAL = 2000
+const MAX_WAIT = 10 * 60 * 1000
+
+const sleep = (ms: number, signal: AbortSignal) =>
+  new Promise<void>((resolve) => {
+    const timer = setTimeout(resolve, ms)
+    signal.addEventListener(
+      'abort',
+      () => {
+        clearTimeout(timer)
+        resolve()
+      },
+      { once: true }
+    )
+  })
+
+// tables are synced by a background job on the server, wait until it stops before showing them.
+// Resolves to false when aborted, e.g. the form was closed, otherwise to true: the job stopped,
+// polling failed or MAX_WAIT passed and the job goes on in the background.
+export const waitSyncJob = async (dsId: number, signal: AbortSignal) => {
+  const deadline = Date.now() + MAX_WAIT
+  while (!signal.aborted) {
+    let job: any
+    try {
+      job = await datasourceApi.latestSyncJob(dsId)
+    } catch {
+      return !signal.aborted
+    }
+    if (!job || (job.status !== 'pending' && job.status !== 'running')) {
+      if (job?.status === 'failed') {
+        ElMessage.error(t('ds.sync_failed', { msg: job.error || '' }))
+      }
+      return !signal.aborted
+    }
+    if (Date.now() >= deadline) {
+      ElMessage.info(t('ds.sync_in_background'))
+      return true
+    }
+    await sleep(POLL_INTERVAL, signal)
+  }
+  return false
+}